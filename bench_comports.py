@@ -0,0 +1,48 @@
+"""Micro-benchmark: pyserial comports() vs CachedPortEnumerator.
+
+Times a full pyserial enumeration, the first (cold) cached scan, repeated
+(warm) cached scans, and a scan filtered to KNOWN_ESP_USB_IDS.
+
+    python bench_comports.py [--runs 200]
+"""
+import argparse
+import sys
+import time
+
+import serial.tools.list_ports
+
+from esp_flash_core import KNOWN_ESP_USB_IDS, CachedPortEnumerator
+
+
+def time_calls(func, runs):
+    """Return (ms per call, result of the last call)."""
+    started = time.perf_counter()
+    for _ in range(runs):
+        result = func()
+    return (time.perf_counter() - started) * 1000 / runs, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    rows = []
+    per_call, ports = time_calls(serial.tools.list_ports.comports, args.runs)
+    rows.append(("pyserial comports()", per_call, len(ports), "-"))
+
+    for name, usb_ids in (("cached", None), ("cached, ESP VID:PID only", KNOWN_ESP_USB_IDS)):
+        enumerator = CachedPortEnumerator(usb_ids)
+        cold, ports = time_calls(enumerator, 1)
+        rows.append((f"{name} (cold)", cold, len(ports), enumerator.reads))
+        warm, ports = time_calls(enumerator, args.runs)
+        rows.append((f"{name} (warm)", warm, len(ports), enumerator.reads))
+
+    print(f"{'enumeration':<32} {'ms/call':>9} {'ports':>6} {'sysfs reads':>12}")
+    for name, per_call, count, reads in rows:
+        print(f"{name:<32} {per_call:9.3f} {count:6} {reads:>12}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Startup benchmark for the ESP Flash Tool build profiles.
+
+Launches each build with ESPFLASH_BENCHMARK=1 (no CSV prompt, exits after
+the first paint) and reports the wall time from launch to exit next to
+the in-app startup total (see STARTUP_BUDGET_MS in esp_flash_toolv2.py).
+The first run of each profile is listed as "cold".
+
+    python bench_startup.py                     # both PyInstaller profiles in dist/
+    python bench_startup.py --runs 10 --source  # also the unfrozen script
+    python bench_startup.py --profile name=path/to/app.exe
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+EXE_SUFFIX = ".exe" if os.name == "nt" else ""
+
+DEFAULT_PROFILES = {
+    "onefile": [os.path.join(HERE, "dist", "esp_flash_toolv2" + EXE_SUFFIX)],
+    "onedir": [os.path.join(HERE, "dist", "esp_flash_toolv2", "esp_flash_toolv2" + EXE_SUFFIX)],
+}
+REPORT_TOTAL_RE = re.compile(r"total\s+([\d.]+) ms")
+RUN_TIMEOUT = 60
+
+
+def run_once(command):
+    """Start the app once; return (wall ms, in-app total ms or None)."""
+    fd, report_path = tempfile.mkstemp(prefix="espflash_startup_", suffix=".txt")
+    os.close(fd)
+    env = dict(os.environ, ESPFLASH_BENCHMARK="1", ESPFLASH_STARTUP_REPORT=report_path)
+    try:
+        started = time.perf_counter()
+        subprocess.run(command, env=env, timeout=RUN_TIMEOUT, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        wall_ms = (time.perf_counter() - started) * 1000
+        with open(report_path, encoding="utf-8") as f:
+            match = REPORT_TOTAL_RE.search(f.read())
+        return wall_ms, float(match.group(1)) if match else None
+    finally:
+        os.remove(report_path)
+
+
+def bench(command, runs):
+    results = [run_once(command) for _ in range(runs)]
+    wall = [wall_ms for wall_ms, _ in results]
+    in_app = [total for _, total in results if total is not None]
+    warm = wall[1:] or wall
+    return {
+        "cold": wall[0],
+        "warm_median": statistics.median(warm),
+        "warm_min": min(warm),
+        "in_app": statistics.median(in_app) if in_app else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--source", action="store_true",
+                        help="also time `python esp_flash_toolv2.py`")
+    parser.add_argument("--profile", action="append", default=[], metavar="NAME=PATH",
+                        help="benchmark this executable instead of the dist/ defaults")
+    args = parser.parse_args(argv)
+
+    profiles = {}
+    for item in args.profile:
+        name, _, path = item.partition("=")
+        profiles[name] = [path]
+    if not profiles:
+        profiles = {name: cmd for name, cmd in DEFAULT_PROFILES.items() if os.path.exists(cmd[0])}
+    if args.source:
+        profiles["source"] = [sys.executable, os.path.join(HERE, "esp_flash_toolv2.py")]
+    if not profiles:
+        parser.error("no build found in dist/; build a .spec first or pass --profile")
+
+    print(f"{'profile':<10} {'cold':>9} {'warm med':>9} {'warm min':>9} {'in-app':>9}  ({args.runs} runs, ms)")
+    for name, command in profiles.items():
+        try:
+            row = bench(command, args.runs)
+        except (OSError, subprocess.SubprocessError) as e:
+            print(f"{name:<10} failed: {e}")
+            continue
+        in_app = f"{row['in_app']:9.0f}" if row["in_app"] is not None else f"{'-':>9}"
+        print(f"{name:<10} {row['cold']:9.0f} {row['warm_median']:9.0f} {row['warm_min']:9.0f} {in_app}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
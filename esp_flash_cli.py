@@ -0,0 +1,311 @@
+"""Headless command line front end for ESP Flash Tool.
+
+Uses esp_flash_core only (no tkinter), so it runs on CI runners, SSH
+sessions and test stations without a display.
+
+Examples:
+    python esp_flash_cli.py flash --args build/flasher_args.json -p /dev/ttyUSB0 -p /dev/ttyUSB1
+    python esp_flash_cli.py bundle build/flasher_args.json -o app.espbundle
+    python esp_flash_cli.py flash --args app.espbundle -p /dev/ttyUSB0
+    python esp_flash_cli.py monitor -p /dev/ttyUSB0 --csv records.db
+    python esp_flash_cli.py patch old.bin new.bin -o patch.bin --chip esp32 --optimize
+    python esp_flash_cli.py patch-batch releases/ new.bin -o patches/ --chip esp32
+    python esp_flash_cli.py reset -p /dev/ttyUSB0
+    python esp_flash_cli.py ports --esp-only
+    python esp_flash_cli.py calibrate -p /dev/ttyUSB0
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import serial
+
+from esp_flash_core import (
+    AUTO_BAUD, BUNDLE_ARCHIVE_EXT, MAX_GANG_WORKERS, MONITOR_BAUDRATE,
+    KNOWN_ESP_USB_IDS, BundleError, CachedPortEnumerator, ESPFlashCore, StationSlots, MfgRecordWriter, PatchCache, PatchError, SerialMonitor,
+    build_ota_patch, copy_file_atomic, create_bundle_archive, generate_patch_matrix, optimize_ota_patch,
+    optimized_patch_cache_label, reset_board,
+)
+
+# Líneas de varios hilos sin mezclarse
+print_lock = threading.Lock()
+
+
+def emit(text, prefix=""):
+    # sys.__stdout__: sys.stdout está redirigido al hilo de esptool en curso
+    console = sys.__stdout__
+    with print_lock:
+        for line in text.splitlines():
+            console.write(f"{prefix}{line}\n")
+        console.flush()
+
+
+def warn_missing(missing):
+    for entry in missing:
+        emit(f"Warning: {entry.context} file not found: {entry.rel_path}")
+    searched = sorted({os.path.dirname(path) for entry in missing for path in entry.searched})
+    emit("Searched in: " + ", ".join(searched))
+
+
+def cmd_flash(args):
+    core = ESPFlashCore()
+    core.use_inprocess_esptool = not args.subprocess
+    core.delta_flash = args.delta
+    core.merged_flash = args.merged  # Antes de cargar: la carga precomprime en modo merged
+
+    try:
+        if args.args.endswith(BUNDLE_ARCHIVE_EXT):
+            core.load_bundle_archive(args.args)
+        else:
+            core.load_flasher_args(args.args, on_missing=warn_missing)
+    except (OSError, ValueError, BundleError) as e:
+        emit(f"Error: {e}")
+        return 2
+
+    error = core.check_flash_images()
+    if error:
+        emit(f"Error: {error}")
+        return 2
+
+    ports = list(dict.fromkeys(args.port))
+    workers = min(args.jobs or len(ports), MAX_GANG_WORKERS)
+
+    def flash_one(port):
+        prefix = f"[{port}] " if len(ports) > 1 else ""
+        try:
+            return core.flash_port(port, args.baud, lambda line: emit(line, prefix))
+        except Exception as e:
+            emit(f"Error: {e}", prefix)
+            return 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = dict(zip(ports, pool.map(flash_one, ports)))
+    finally:
+        core.close_bundle()
+
+    failed = [port for port, code in results.items() if code != 0]
+    if len(ports) > 1:
+        emit(f"{len(ports) - len(failed)}/{len(ports)} boards flashed successfully")
+    for port in failed:
+        emit(f"FAILED: {port} (exit code {results[port]})")
+    return 1 if failed else 0
+
+
+def cmd_bundle(args):
+    try:
+        manifest = create_bundle_archive(args.args, args.output, on_missing=warn_missing)
+    except (OSError, ValueError, BundleError) as e:
+        emit(f"Error: {e}")
+        return 2
+    for entry in manifest["files"]:
+        emit(f"{entry['offset']:>10} {entry['name']:<40} {entry['size']:>9} {entry['sha256'][:16]}")
+    emit(f"Bundle written to {args.output} ({os.path.getsize(args.output)} bytes, chip {manifest['chip']})")
+    return 0
+
+
+def cmd_monitor(args):
+    writer = MfgRecordWriter() if args.csv else None
+
+    def on_record(record):
+        writer.submit(args.csv, record)
+
+    monitor = SerialMonitor(args.port, args.baud, on_mfg_record=on_record if writer else None)
+    try:
+        monitor.start()
+    except serial.SerialException as e:
+        emit(f"Error: Failed to open port {args.port}: {e}")
+        return 2
+
+    seq = 0
+    try:
+        while monitor.running:
+            time.sleep(0.1)
+            seq, lines, dropped = monitor.buffer.since(seq)
+            if dropped:
+                emit(f"... {dropped} lines dropped ...")
+            for line in lines:
+                emit(line)
+            while writer and not writer.results.empty():
+                status, path, hw_id, detail = writer.results.get_nowait()
+                if status == "ok":
+                    emit(f"Saved record {hw_id} to {path}", "# ")
+                else:
+                    emit(f"Failed to save record {hw_id}: {detail}", "# ")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        monitor.stop()
+        if writer:
+            writer.close()
+    return 0
+
+
+def cmd_patch(args):
+    cache = None if args.no_cache else PatchCache()
+    label = optimized_patch_cache_label() if args.optimize else args.compression
+
+    started = time.perf_counter()
+    try:
+        cache_key = cache.key(args.base, args.new, label, args.chip) if cache else None
+        cached_patch = cache.get(cache_key) if cache else None
+        if cached_patch:
+            copy_file_atomic(cached_patch, args.output)
+            emit("Patch served from cache")
+        elif args.optimize:
+            best, rows = optimize_ota_patch(args.base, args.new, args.output, args.chip, args.jobs)
+            for row in rows:
+                size = row.get("size")
+                mark = "*" if row is best else " " if row["device"] else "-"
+                emit(f"{mark} {row['label']:<36} {size if size is not None else row.get('error', '')}")
+            emit(f"Selected: {best['label']}")
+        else:
+            build_ota_patch(args.base, args.new, args.output, args.chip, args.compression)
+    except (PatchError, OSError) as e:
+        emit(f"Error: {e}")
+        return 1
+
+    if cache and not cached_patch:
+        try:
+            cache.put(cache_key, args.output)
+        except OSError as e:
+            emit(f"Patch cache not updated: {e}")
+
+    patch_size = os.path.getsize(args.output)
+    new_size = os.path.getsize(args.new)
+    emit(f"Patch written to {args.output}: {patch_size} bytes "
+         f"({patch_size / new_size:.1%} of {new_size}) in {time.perf_counter() - started:.2f} s")
+    return 0
+
+
+def cmd_patch_batch(args):
+    def on_result(entry):
+        if "error" in entry:
+            emit(f"FAILED {entry['base_file']}: {entry['error']}")
+        else:
+            cached = " (cached)" if entry.get("cached") else ""
+            emit(f"{entry['base_file']} -> {entry['patch_file']}: {entry['patch_size']} bytes{cached}")
+
+    try:
+        manifest = generate_patch_matrix(
+            args.base_dir, args.new, args.output, args.chip, args.compression,
+            workers=args.jobs, cache=None if args.no_cache else PatchCache(), on_result=on_result,
+            on_line=emit)
+    except (PatchError, OSError) as e:
+        emit(f"Error: {e}")
+        return 1
+    emit(f"{len(manifest['patches'])} patches, {len(manifest['errors'])} errors")
+    return 1 if manifest["errors"] else 0
+
+
+def cmd_reset(args):
+    try:
+        reset_board(args.port)
+    except (serial.SerialException, OSError) as e:
+        emit(f"Error: {e}")
+        return 1
+    emit(f"Device on {args.port} reset")
+    return 0
+
+
+def cmd_calibrate(args):
+    core = ESPFlashCore()
+    core.use_inprocess_esptool = not args.subprocess
+    if args.chip:
+        core.extra_esptool_args["chip"] = args.chip
+    baud = core.calibrate_baud(args.port, emit)
+    if baud is None:
+        emit(f"No baud rate worked on {args.port}")
+        return 1
+    emit(f"Fastest reliable baud on {args.port}: {baud}")
+    return 0
+
+
+def cmd_ports(args):
+    enumerator = CachedPortEnumerator(KNOWN_ESP_USB_IDS if args.esp_only else None)
+    slots = StationSlots()
+    for port in enumerator():
+        slot = slots.slot_for(port)
+        usb_id = f"{port.vid:04X}:{port.pid:04X}" if port.vid is not None else "-"
+        emit(f"{slot or '-':>4} {port.device:<16} {usb_id:<10} {port.serial_number or '-':<20} "
+             f"{port.location or '-':<12} {port.description}")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="ESP Flash Tool (headless)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("flash", help="flash the files of a flasher_args.json to one or more boards")
+    p.add_argument("--args", required=True, help=f"path to flasher_args.json or a {BUNDLE_ARCHIVE_EXT} file")
+    p.add_argument("-p", "--port", action="append", required=True,
+                   help="serial port (repeat for gang flashing)")
+    p.add_argument("-b", "--baud", default=AUTO_BAUD,
+                   help=f"baud rate, or {AUTO_BAUD} for the adapter's calibrated rate")
+    p.add_argument("-j", "--jobs", type=int, help="boards flashed at the same time")
+    p.add_argument("--delta", action="store_true", help="only write regions that differ")
+    p.add_argument("--merged", action="store_true",
+                   help="merge the regions and send one stream compressed once for all boards")
+    p.add_argument("--subprocess", action="store_true", help="run esptool in a new interpreter")
+    p.set_defaults(func=cmd_flash)
+
+    p = sub.add_parser("bundle", help=f"pack a flasher_args.json and its binaries into one {BUNDLE_ARCHIVE_EXT} file")
+    p.add_argument("args", help="path to flasher_args.json")
+    p.add_argument("-o", "--output", required=True)
+    p.set_defaults(func=cmd_bundle)
+
+    p = sub.add_parser("monitor", help="print serial output and log mfg records")
+    p.add_argument("-p", "--port", required=True)
+    p.add_argument("-b", "--baud", type=int, default=MONITOR_BAUDRATE)
+    p.add_argument("--csv", help="CSV or SQLite (.db) file for mfg records")
+    p.set_defaults(func=cmd_monitor)
+
+    p = sub.add_parser("patch", help="create a delta OTA patch")
+    p.add_argument("base")
+    p.add_argument("new")
+    p.add_argument("-o", "--output", required=True)
+    p.add_argument("--chip", required=True)
+    p.add_argument("--compression", default="heatshrink")
+    p.add_argument("--optimize", action="store_true",
+                   help="try every setting and keep the smallest device-supported patch")
+    p.add_argument("-j", "--jobs", type=int, help="worker processes for --optimize")
+    p.add_argument("--no-cache", action="store_true")
+    p.set_defaults(func=cmd_patch)
+
+    p = sub.add_parser("patch-batch", help="create patches from every .bin in a directory")
+    p.add_argument("base_dir")
+    p.add_argument("new")
+    p.add_argument("-o", "--output", required=True, help="output directory")
+    p.add_argument("--chip", required=True)
+    p.add_argument("--compression", default="heatshrink")
+    p.add_argument("-j", "--jobs", type=int, help="worker processes")
+    p.add_argument("--no-cache", action="store_true")
+    p.set_defaults(func=cmd_patch_batch)
+
+    p = sub.add_parser("reset", help="soft reset a board via DTR/RTS")
+    p.add_argument("-p", "--port", required=True)
+    p.set_defaults(func=cmd_reset)
+
+    p = sub.add_parser("calibrate", help="find and save the fastest reliable baud of a port's adapter")
+    p.add_argument("-p", "--port", required=True)
+    p.add_argument("--chip", help="target chip (default: auto-detect)")
+    p.add_argument("--subprocess", action="store_true", help="run esptool in a new interpreter")
+    p.set_defaults(func=cmd_calibrate)
+
+    p = sub.add_parser("ports", help="list serial ports")
+    p.add_argument("--esp-only", action="store_true",
+                   help="only USB bridges in KNOWN_ESP_USB_IDS (skips ttyS* and other ports)")
+    p.set_defaults(func=cmd_ports)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,2858 @@
+"""GUI-free core of the ESP Flash Tool.
+
+Flashing, serial monitoring, manufacturing-record capture and OTA patch
+generation live here so that both the Tk application (esp_flash_toolv2.py)
+and the command-line runner (esp_flash_cli.py) can use them. Nothing in
+this module imports tkinter.
+"""
+import os
+import json
+import subprocess
+import threading
+import socket
+import serial
+import serial.tools.list_ports
+import re, tempfile
+import csv
+import sys
+import time
+import queue
+import hashlib
+import io
+import mmap
+import struct
+import zlib
+import contextlib
+from collections import deque, namedtuple
+import shutil
+# detools, sqlite3, zipfile y concurrent.futures.process se importan al usarlos:
+# solo hacen falta para parches OTA / bases .db / bundles y retrasan el arranque de la GUI
+
+
+# Default flash parameters as specified
+DEFAULT_FLASH_PARAMS = {
+    "write_flash_args": ["--flash_mode", "dio",
+                        "--flash_size", "10MB",
+                        "--flash_freq", "80m"],
+    "flash_settings": {
+        "flash_mode": "dio",
+        "flash_size": "10MB",
+        "flash_freq": "80m"
+    }
+}
+
+# Matches esptool progress lines, e.g. "Writing at 0x00010000... (12 %)"
+FLASH_PROGRESS_RE = re.compile(r"Writing at (0x[0-9a-fA-F]+).*?(\d+(?:\.\d+)?)\s?%")
+
+# Upper bound for simultaneous write_flash jobs in gang mode
+MAX_GANG_WORKERS = 16
+
+# Serial monitor: lines kept in memory
+MONITOR_RING_LINES = 10000
+MONITOR_MAX_LINE_BYTES = 64 * 1024  # Partial line flushed if no newline arrives
+MONITOR_BAUDRATE = 115200
+
+# Port hotplug watcher
+PORT_POLL_INTERVAL = 1.0  # Fallback when netlink uevents are not available
+PORT_SETTLE_DELAY = 0.3  # Let udev finish /dev and sysfs before enumerating
+NETLINK_KOBJECT_UEVENT = 15
+
+# Linux serial device names (same set pyserial's list_ports_linux globs)
+LINUX_PORT_PREFIXES = ("ttyS", "ttyUSB", "ttyXRUSB", "ttyACM", "ttyAMA", "rfcomm", "ttyAP")
+LINUX_USB_PORT_PREFIXES = ("ttyUSB", "ttyXRUSB", "ttyACM")  # Only these can have a VID:PID
+
+# USB bridges used on ESP boards (VID, PID): candidates for auto-flash
+KNOWN_ESP_USB_IDS = {
+    (0x303A, 0x1001),  # Espressif USB-Serial/JTAG (esp32c3/c6/s3)
+    (0x10C4, 0xEA60),  # Silicon Labs CP210x
+    (0x1A86, 0x7523),  # WCH CH340
+    (0x1A86, 0x55D4),  # WCH CH9102
+    (0x0403, 0x6001),  # FTDI FT232R
+    (0x0403, 0x6010),  # FTDI FT2232
+}
+
+# Manufacturing records: journal entries before the CSV is rewritten
+MFG_JOURNAL_COMPACT_EVERY = 500
+# SQLite records: pending upserts are committed together after this delay (s)
+SQLITE_COMMIT_INTERVAL = 2.0
+SQLITE_EXTENSIONS = (".db", ".sqlite", ".sqlite3")
+# Writer thread waits this long (s) after a record so bursts are coalesced
+MFG_WRITER_BATCH_DELAY = 0.2
+
+# ESP app image layout (esp_image_format.h)
+ESP_IMAGE_MAGIC = 0xE9
+ESP_IMAGE_HEADER = struct.Struct("<BBBBI")  # magic, segments, flash mode, size/freq, entry
+ESP_IMAGE_EXT_HEADER = struct.Struct("<B3sHBHH4sB")  # wp pin, drv, chip id, revs, reserved, hash
+ESP_SEGMENT_HEADER = struct.Struct("<II")  # load address, length
+ESP_CHECKSUM_MAGIC = 0xEF
+ESP_IMAGE_MAX_SEGMENTS = 16
+ESP_IMAGE_CHIP_IDS = {
+    "esp32": 0, "esp32s2": 2, "esp32c3": 5, "esp32s3": 9, "esp32c2": 12,
+    "esp32c6": 13, "esp32h2": 16, "esp32p4": 18, "esp32c61": 20, "esp32c5": 23,
+}
+
+AppImageInfo = namedtuple("AppImageInfo", [
+    "chip_id", "chip", "entrypoint", "flash_mode", "flash_size_freq", "segments",
+    "checksum", "checksum_valid", "hash_appended", "digest", "digest_valid", "image_size",
+])
+
+# Delta OTA patch header: magic, validation digest of the base image, reserved (64 bytes)
+ESP_DELTA_OTA_MAGIC = 0xfccdde10
+MAGIC_SIZE = 4
+DIGEST_SIZE = 32
+RESERVED_HEADER = 64 - (MAGIC_SIZE + DIGEST_SIZE)
+PATCH_MANIFEST_NAME = "manifest.json"
+
+# "Optimize" patch mode: detools settings tried in parallel
+OPTIMIZE_ALGORITHMS = ("bsdiff", "match-blocks")
+OPTIMIZE_COMPRESSIONS = ("heatshrink", "crle", "none", "lzma")
+OPTIMIZE_HEATSHRINK_WINDOWS = (8, 9, 10, 11, 12)
+OPTIMIZE_HEATSHRINK_LOOKAHEADS = (4, 5, 6, 7)
+# What the device-side detools decoder accepts; heatshrink (window, lookahead)
+# pairs must match the HEATSHRINK_STATIC_* values the firmware was built with
+DEVICE_PATCH_COMPRESSIONS = ("heatshrink", "crle", "none")
+DEVICE_HEATSHRINK_PARAMS = {(8, 7)}
+
+# OTA patch cache location and size bound (least recently used entries evicted)
+PATCH_CACHE_DIR = os.path.expanduser("~/Documents/ESPFlashTool_Data/patch_cache")
+PATCH_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# Baud calibration: candidates tried from the fastest, bytes read per trial
+CALIBRATION_BAUDS = (2000000, 1500000, 921600, 460800, 230400, 115200)
+CALIBRATION_READ_BYTES = 0x40000
+CALIBRATION_PASSES = 2  # Consecutive clean reads needed to accept a rate
+AUTO_BAUD = "Auto"  # Baud value meaning "calibrated rate of this adapter"
+DEFAULT_FLASH_BAUD = 460800  # Used by AUTO_BAUD for adapters never calibrated
+BAUD_PROFILE_PATH = os.path.expanduser("~/Documents/ESPFlashTool_Data/baud_profiles.json")
+
+# Station slots: USB hub position (or USB serial) -> logical slot number
+STATION_SLOTS_PATH = os.path.expanduser("~/Documents/ESPFlashTool_Data/station_slots.json")
+
+# Delta flash: regions are compared in blocks, then changed blocks sector by sector
+FLASH_SECTOR_SIZE = 0x1000
+DELTA_BLOCK_SIZE = 0x10000
+
+# Merged flashing: regions that share a flash sector are joined with 0xFF
+# padding into one segment; each segment is zlib-compressed once per bundle
+MERGE_COMPRESS_LEVEL = 9  # Same level esptool uses
+MERGED_CACHE_ENTRIES = 4
+ESP_FLASH_MODES = {"qio": 0, "qout": 1, "dio": 2, "dout": 3}
+# Compressed write timeouts, as esptool computes them
+DEFL_MIN_TIMEOUT = 3
+STUB_DEFLATE_BUFFER_SIZE = 0x8000
+STUB_ERASE_BLOCK_SIZE = 0x10000  # Erased by the stub before each deflate buffer
+# write_flash options the merged path applies; any other one (--encrypt,
+# --force, --erase-all...) makes it fall back to write_flash
+MERGED_WRITE_FLASH_OPTIONS = ("--flash_mode", "--flash-mode", "--flash_freq", "--flash-freq",
+                              "--flash_size", "--flash-size")
+SECURE_BOOT_V1_PROTECTED_END = 0x8000  # Bootloader area write_flash refuses with Secure Boot V1
+KEY_MANAGER_PROTECTED_END = 0x2000  # Key recovery info with Key Manager flash encryption
+
+# Single-file firmware bundles (uncompressed zip + manifest)
+BUNDLE_ARCHIVE_EXT = ".espbundle"
+BUNDLE_MANIFEST_NAME = "manifest.json"
+BUNDLE_FORMAT_VERSION = 1
+ZIP_LOCAL_HEADER_SIZE = 30  # Name/extra lengths are the two shorts at offset 26
+
+# Deflated payloads by content hash: in memory, and on disk (mmapped back)
+PAYLOAD_CACHE_DIR = os.path.expanduser("~/Documents/ESPFlashTool_Data/payload_cache")
+PAYLOAD_CACHE_MAX_BYTES = 256 * 1024 * 1024
+PAYLOAD_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+
+_esptool_module = None
+_esptool_lock = threading.Lock()
+_file_digest_cache = {}  # path -> ((size, mtime_ns), digests)
+_dir_listing_cache = {}  # directory -> (mtime_ns, normcased file names)
+
+
+class ThreadLocalStream:
+    """sys.stdout/sys.stderr replacement that routes writes to a per-thread stream.
+
+    Used by the in-process esptool backend so that several esptool runs on
+    different threads each capture their own output.
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def _target(self):
+        return getattr(self.local, 'stream', None) or self.default
+
+    def write(self, text):
+        target = self._target()
+        if target is None:  # Build sin consola (console=False)
+            return len(text)
+        return target.write(text)
+
+    def flush(self):
+        target = self._target()
+        if target is not None:
+            target.flush()
+
+    def isatty(self):
+        return False
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+class LineStream:
+    """Minimal text stream that calls `on_line` for every complete line."""
+
+    def __init__(self, on_line):
+        self.on_line = on_line
+        self.buffer = ""
+
+    def write(self, text):
+        self.buffer += text
+        # esptool usa '\r' para reescribir las líneas de progreso
+        *lines, self.buffer = re.split(r"\r\n|\r|\n", self.buffer)
+        for line in lines:
+            self.on_line(line + "\n")
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.buffer:
+            self.on_line(self.buffer + "\n")
+            self.buffer = ""
+
+    def isatty(self):
+        return False
+
+
+def load_esptool():
+    """Import the esptool package once; return None if it is unavailable."""
+    global _esptool_module
+    with _esptool_lock:
+        if _esptool_module is None:
+            try:
+                import esptool
+            except ImportError:
+                return None
+            _esptool_module = esptool
+            if not isinstance(sys.stdout, ThreadLocalStream):
+                sys.stdout = ThreadLocalStream(sys.stdout)
+            if not isinstance(sys.stderr, ThreadLocalStream):
+                sys.stderr = ThreadLocalStream(sys.stderr)
+    return _esptool_module
+
+
+def esptool_option(value):
+    """Spell a reset option ("default_reset") the way the installed esptool expects."""
+    esptool = load_esptool()
+    if int(esptool.__version__.split('.')[0]) >= 5:
+        return value.replace('_', '-')
+    return value.replace('-', '_')
+
+
+def file_digests(path):
+    """Return the content and MD5 digests of a flash file, cached by size/mtime.
+
+    Returns:
+        dict: "data" (bytes), "md5" of the whole file, and the per-block and
+        per-sector MD5 lists used by delta flashing.
+    """
+    stat = os.stat(path)
+    key = (stat.st_size, stat.st_mtime_ns)
+    cached = _file_digest_cache.get(path)
+    if cached and cached[0] == key:
+        return cached[1]
+
+    with open(path, "rb") as f:
+        data = f.read()
+    digests = {
+        "data": data,
+        "md5": hashlib.md5(data).hexdigest(),
+        "blocks": [hashlib.md5(data[i:i + DELTA_BLOCK_SIZE]).hexdigest()
+                   for i in range(0, len(data), DELTA_BLOCK_SIZE)],
+        "sectors": [hashlib.md5(data[i:i + FLASH_SECTOR_SIZE]).hexdigest()
+                    for i in range(0, len(data), FLASH_SECTOR_SIZE)],
+    }
+    _file_digest_cache[path] = (key, digests)
+    return digests
+
+
+def changed_sector_ranges(esp, offset, digests):
+    """Compare a region against the device flash and return the changed ranges.
+
+    Blocks whose on-device MD5 matches are skipped; mismatching blocks are
+    narrowed down to 4 KB sectors, and contiguous changed sectors are merged.
+
+    Returns:
+        list: (start, end) byte ranges relative to the region start.
+    """
+    data = digests["data"]
+    changed = []
+    for block_index, block_md5 in enumerate(digests["blocks"]):
+        start = block_index * DELTA_BLOCK_SIZE
+        size = min(DELTA_BLOCK_SIZE, len(data) - start)
+        if esp.flash_md5sum(offset + start, size) == block_md5:
+            continue
+        for sector_start in range(start, start + size, FLASH_SECTOR_SIZE):
+            sector_size = min(FLASH_SECTOR_SIZE, len(data) - sector_start)
+            sector_md5 = digests["sectors"][sector_start // FLASH_SECTOR_SIZE]
+            if esp.flash_md5sum(offset + sector_start, sector_size) == sector_md5:
+                continue
+            if changed and changed[-1][1] == sector_start:
+                changed[-1] = (changed[-1][0], sector_start + sector_size)
+            else:
+                changed.append((sector_start, sector_start + sector_size))
+    return changed
+
+
+MergedSegment = namedtuple("MergedSegment", ["address", "size", "md5", "payload"])
+
+
+def write_flash_setting(write_flash_args, name, default="keep"):
+    """Return the value of --flash_<name> / --flash-<name> in write_flash args."""
+    for option in (f"--flash_{name}", f"--flash-{name}"):
+        if option in write_flash_args:
+            index = write_flash_args.index(option)
+            if index + 1 < len(write_flash_args):
+                return write_flash_args[index + 1]
+    return default
+
+
+def bootloader_flash_settings(write_flash_args):
+    """Return the (mode, freq, size) write_flash patches into the bootloader header.
+
+    "detect" is treated as "keep": the header is built before connecting,
+    so the size detected on the board cannot be used.
+    """
+    return tuple("keep" if value == "detect" else value
+                 for value in (write_flash_setting(write_flash_args, name) for name in ("mode", "freq", "size")))
+
+
+def patch_bootloader_params(chip, data, flash_mode="keep", flash_freq="keep", flash_size="keep"):
+    """Set flash mode/freq/size in a bootloader image header, as esptool write_flash does.
+
+    The appended SHA-256 is recomputed when the image carries one. Data
+    that is not a valid image is returned unchanged.
+
+    Raises:
+        ValueError: If a setting is not valid for the chip.
+    """
+    if flash_size == "detect":
+        flash_size = "keep"
+    if (flash_mode, flash_freq, flash_size) == ("keep",) * 3 or len(data) < 24 or data[0] != ESP_IMAGE_MAGIC:
+        return data
+    target = load_esptool().targets.CHIP_DEFS[chip]
+    header = bytearray(data)
+    if flash_mode != "keep":
+        if flash_mode not in ESP_FLASH_MODES:
+            raise ValueError(f"Flash mode {flash_mode!r} is not supported")
+        header[2] = ESP_FLASH_MODES[flash_mode]
+    size_freq = header[3]
+    try:
+        if flash_freq != "keep":
+            size_freq = (size_freq & 0xF0) | target.parse_flash_freq_arg(flash_freq)
+        if flash_size != "keep":
+            size_freq = (size_freq & 0x0F) | target.parse_flash_size_arg(flash_size)
+    except load_esptool().FatalError as e:
+        raise ValueError(str(e))
+    header[3] = size_freq
+    if bytes(header[2:4]) == data[2:4]:
+        return data
+
+    with tempfile.NamedTemporaryFile(suffix=".bin", delete=False) as f:
+        f.write(data)
+    try:
+        image = parse_app_image(f.name)
+    except ValueError:
+        return data  # No es una imagen válida: no se toca (igual que esptool)
+    finally:
+        os.remove(f.name)
+    if image.hash_appended:
+        data_length = image.image_size - 32
+        header[data_length:image.image_size] = hashlib.sha256(header[:data_length]).digest()
+    return bytes(header)
+
+
+def build_merged_segments(items, sector_size=FLASH_SECTOR_SIZE):
+    """Group (address, data) regions into a sparse list of segments.
+
+    Two regions are joined only when no whole sector lies between them:
+    the gap (filled with 0xFF) is then inside sectors that write_flash
+    erases anyway for those regions. Any other gap starts a new segment,
+    so flash that belongs to no region (NVS, phy_init...) is never erased.
+
+    Returns:
+        list: (address, data) segments sorted by address. A segment made of
+        a single region is that region's buffer itself (no copy).
+
+    Raises:
+        ValueError: If two regions overlap.
+    """
+    segments = []  # [address, chunks, end]
+    for address, data in sorted(items, key=lambda item: item[0]):
+        if segments:
+            end = segments[-1][2]
+            if address < end:
+                raise ValueError(f"Region at {address:#x} overlaps the one ending at {end:#x}")
+            # Sector del final de la anterior == sector del inicio de esta
+            if -(-end // sector_size) >= address // sector_size:
+                segments[-1][1] += [b"\xff" * (address - end), data]
+                segments[-1][2] = address + len(data)
+                continue
+        segments.append([address, [data], address + len(data)])
+    return [(address, chunks[0] if len(chunks) == 1 else b"".join(chunks))
+            for address, chunks, _ in segments]
+
+
+def defl_block_timeout(uncompressed_size):
+    """Timeout for one compressed block (stub erases ahead of each deflate buffer).
+
+    Same formula as esptool, with its configurable erase/write seconds per MB.
+    """
+    loader = load_esptool().loader
+    erases = -(-uncompressed_size // STUB_DEFLATE_BUFFER_SIZE) + 1
+    size = uncompressed_size + erases * STUB_ERASE_BLOCK_SIZE
+    return loader.timeout_per_mb(loader.ERASE_WRITE_TIMEOUT_PER_MB, size)
+
+
+def write_merged_segments(esp, segments, on_line):
+    """Stream precompressed MergedSegments with the stub and verify each by MD5.
+
+    Raises:
+        RuntimeError: If a segment's flash MD5 does not match.
+    """
+    total = sum(segment.size for segment in segments)
+    done = 0
+    started = time.perf_counter()
+    timeout = DEFL_MIN_TIMEOUT
+    for segment in segments:
+        esp.flash_defl_begin(segment.size, len(segment.payload), segment.address)
+        decompress = zlib.decompressobj()
+        written = 0
+        for seq, position in enumerate(range(0, len(segment.payload), esp.FLASH_WRITE_SIZE)):
+            block = bytes(segment.payload[position:position + esp.FLASH_WRITE_SIZE])
+            block_size = len(decompress.decompress(block))
+            esp.flash_defl_block(block, seq, timeout=timeout)
+            # El stub confirma el bloque y lo escribe mientras recibe el siguiente
+            timeout = defl_block_timeout(block_size)
+            written += block_size
+            on_line(f"Writing at {segment.address + written:#010x}... "
+                    f"({int((done + written) * 100 / total)} %)\n")
+        done += segment.size
+    esp.flash_defl_finish(reboot=False)
+
+    elapsed = time.perf_counter() - started
+    sent = sum(len(segment.payload) for segment in segments)
+    on_line(f"Wrote {total} bytes ({sent} compressed) in {len(segments)} segment(s) "
+            f"in {elapsed:.1f} seconds\n")
+    for segment in segments:
+        if esp.flash_md5sum(segment.address, segment.size) != segment.md5:
+            raise RuntimeError(f"MD5 of segment at {segment.address:#010x} does not match data in flash")
+    on_line("Hash of data verified.\n")
+
+
+def check_merged_target(esp, chip, flash_items, write_flash_args):
+    """Run the checks esptool write_flash does before writing (without --force).
+
+    The connected chip must be `chip`, images must suit its chip and
+    revision, and Secure Boot V1 or flash encryption must not forbid a
+    plaintext write. Call it on the ROM loader, before run_stub.
+
+    Returns:
+        str: Why the checks cannot be done here (the caller then flashes
+        with write_flash), or None if the board can be written.
+
+    Raises:
+        esptool.FatalError: If write_flash would refuse to write.
+    """
+    esptool = load_esptool()
+    for arg in write_flash_args:
+        if arg.startswith("-") and arg not in MERGED_WRITE_FLASH_OPTIONS:
+            return f"write_flash option {arg} is not supported"
+    target = esptool.targets.CHIP_DEFS.get(chip)
+    if target is None:
+        return f"unknown chip {chip}"
+    if esp.CHIP_NAME != target.CHIP_NAME:
+        raise esptool.FatalError(f"This chip is {esp.CHIP_NAME}, not {target.CHIP_NAME}. "
+                                 "Wrong --chip argument?")
+    if esp.secure_download_mode:
+        return "secure download mode"
+    if esp.CHIP_NAME == "ESP8266":
+        return None
+    validate_images = getattr(esptool.cmds, "_validate_image_compatibility", None)
+    if validate_images is None:
+        return "this esptool cannot check image compatibility"
+
+    lowest = min(int(offset, 0) for offset, _ in flash_items)
+    try:
+        if esp.get_secure_boot_v1_enabled() and lowest < SECURE_BOOT_V1_PROTECTED_END:
+            raise esptool.FatalError(
+                "Secure Boot V1 detected, writing to flash regions < 0x8000 is disabled "
+                "to protect the bootloader")
+        if (esp.get_flash_encryption_enabled() and esp.uses_key_manager_for_flash_encryption()
+                and lowest < KEY_MANAGER_PROTECTED_END):
+            raise esptool.FatalError(
+                "Flash encryption with Key Manager detected, writing to flash region "
+                "0x0-0x2000 is disabled to protect key recovery info")
+
+        images = []
+        for offset, path in flash_items:
+            with open(path, "rb") as f:
+                images.append((int(offset, 0), (f.read(), os.path.basename(path))))
+        validate_images(esp, images)
+
+        if esp.get_encrypted_download_disabled() and esp.get_flash_encryption_enabled():
+            raise esptool.FatalError(
+                "Detected flash encryption enabled and download manual encrypt disabled. "
+                "Flashing plaintext data may brick your device!")
+    except (AttributeError, esptool.util.NotSupportedError) as e:
+        return f"security check not available ({e})"
+    return None
+
+
+class BundleError(Exception):
+    """A firmware bundle that must not be flashed (missing, empty, overlapping...)."""
+
+
+class MissingFilesError(BundleError):
+    """flasher_args.json entries whose file could not be found (`missing`: MissingFile list)."""
+
+    def __init__(self, missing):
+        self.missing = missing
+        names = ", ".join(f"{entry.rel_path} ({entry.context})" for entry in missing)
+        super().__init__(f"{len(missing)} file(s) not found: {names}")
+
+
+BundleRegion = namedtuple("BundleRegion", ["address", "offset", "path", "size", "mtime_ns"])
+
+
+def parse_flash_size(value):
+    """Return the bytes of a --flash_size value ("4MB", "512KB"), or None for keep/detect."""
+    match = re.fullmatch(r"(\d+)\s*([KM])B", str(value).strip(), re.IGNORECASE)
+    if not match:
+        return None
+    return int(match.group(1)) * (1024 if match.group(2).upper() == "K" else 1024 * 1024)
+
+
+class FirmwareBundle:
+    """The flash files of a bundle, validated and hashed once before any board.
+
+    The constructor opens every file and checks for empty files, overlaps
+    and --flash_size overflow, so a bad bundle fails before flashing starts.
+    SHA-256/MD5 digests are computed on a background thread (see `digests`).
+    Files are mmapped only while someone is inside `mapped()` (hashing,
+    precompression): Windows cannot rebuild a mapped file, so an idle tool
+    keeps none. Inside `mapped()`, `view(path)` returns a read-only
+    memoryview (no copies). Files can also come from `views`, e.g. members
+    of a BundleArchive.
+
+    Raises:
+        BundleError: If a file cannot be read or the layout is invalid.
+    """
+
+    def __init__(self, flash_files, write_flash_args=(), views=None):
+        self.flash_files = dict(flash_files)
+        self.external_views = dict(views or {})
+        self._views = {}  # path -> memoryview while mapped
+        self._maps = []
+        self._users = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        self._digests = {}
+        self.digests_ready = threading.Event()
+        self.regions = sorted((self._stat(offset, path) for offset, path in self.flash_files.items()),
+                              key=lambda region: region.address)
+        self._validate(parse_flash_size(write_flash_setting(list(write_flash_args), "size")))
+        threading.Thread(target=self._hash_all, daemon=True).start()
+
+    def _stat(self, offset, path):
+        try:
+            with open(path, "rb") as f:
+                stat = os.fstat(f.fileno())
+        except OSError as e:
+            raise BundleError(f"Cannot read {path} ({offset}): {e}")
+        if stat.st_size == 0:
+            raise BundleError(f"{os.path.basename(path)} ({offset}) is empty")
+        return BundleRegion(int(offset, 0), offset, path, stat.st_size, stat.st_mtime_ns)
+
+    def _validate(self, flash_size):
+        previous = None
+        for region in self.regions:
+            name = os.path.basename(region.path)
+            end = region.address + region.size
+            if previous and region.address < previous.address + previous.size:
+                raise BundleError(
+                    f"{name} ({region.offset}) overlaps {os.path.basename(previous.path)} "
+                    f"({previous.offset}, ends at {previous.address + previous.size:#x})")
+            if flash_size is not None and end > flash_size:
+                raise BundleError(
+                    f"{name} ({region.offset}) ends at {end:#x}, beyond the "
+                    f"{flash_size // (1024 * 1024)}MB flash (--flash_size)")
+            previous = region
+
+    @contextlib.contextmanager
+    def mapped(self):
+        """Keep the files mapped (and `view` usable) for the duration of the block.
+
+        Raises:
+            BundleError: If the bundle was closed or a file changed since loading.
+        """
+        with self.lock:
+            if self.closed:
+                raise BundleError("The files were reloaded; load them again")
+            if self._users == 0:
+                self._map_all()
+            self._users += 1
+        try:
+            yield self
+        finally:
+            with self.lock:
+                self._users -= 1
+                if self._users == 0:
+                    self._unmap_all()
+
+    def _map_all(self):
+        try:
+            for region in self.regions:
+                if region.path in self.external_views:
+                    self._views[region.path] = self.external_views[region.path][:]
+                    continue
+                with open(region.path, "rb") as f:
+                    stat = os.fstat(f.fileno())
+                    if (stat.st_size, stat.st_mtime_ns) != (region.size, region.mtime_ns):
+                        raise BundleError(
+                            f"{os.path.basename(region.path)} ({region.offset}) changed on disk "
+                            "after it was loaded; load the files again")
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps.append(mapped)
+                self._views[region.path] = memoryview(mapped)
+        except OSError as e:
+            self._unmap_all()
+            raise BundleError(f"Cannot read {region.path} ({region.offset}): {e}")
+        except BundleError:
+            self._unmap_all()
+            raise
+
+    def _unmap_all(self):
+        for view in self._views.values():
+            try:
+                view.release()
+            except BufferError:
+                pass  # Aún hay vistas en uso: se libera al recogerlas
+        for mapped in self._maps:
+            try:
+                mapped.close()
+            except BufferError:
+                pass
+        self._views = {}
+        self._maps = []
+
+    def _hash_all(self):
+        try:
+            with self.mapped():
+                for region in self.regions:
+                    data = self._views[region.path]
+                    self._digests[region.path] = {
+                        "sha256": hashlib.sha256(data).hexdigest(),
+                        "md5": hashlib.md5(data).hexdigest(),
+                    }
+        except BundleError:
+            pass  # Cerrado o modificado: check_unchanged lo informa al flashear
+        finally:
+            self.digests_ready.set()
+
+    def view(self, path):
+        """Inside `mapped()`, return the read-only memoryview of a bundle file (None if not part of it)."""
+        return self._views.get(path)
+
+    def digests(self, timeout=None):
+        """Wait for the background hashing and return {path: {"sha256", "md5"}}."""
+        self.digests_ready.wait(timeout)
+        return dict(self._digests)
+
+    def check_unchanged(self):
+        """Raise BundleError if a file was rebuilt or truncated after the bundle was loaded."""
+        for region in self.regions:
+            try:
+                stat = os.stat(region.path)
+            except OSError as e:
+                raise BundleError(f"Cannot read {region.path}: {e}")
+            if (stat.st_size, stat.st_mtime_ns) != (region.size, region.mtime_ns):
+                raise BundleError(
+                    f"{os.path.basename(region.path)} ({region.offset}) changed on disk "
+                    "after it was loaded; load the files again")
+
+    def close(self):
+        """Stop further mapping; the files are unmapped once the last user leaves."""
+        with self.lock:
+            self.closed = True
+            if self._users == 0:
+                self._unmap_all()
+
+
+class BundleArchive:
+    """A single-file firmware bundle: an uncompressed zip with a manifest.
+
+    The manifest (written first) holds chip, write_flash/extra esptool args
+    and, per file, its offset, member name, size and SHA-256. The archive is
+    mmapped once; members are stored, so each one is a slice of the map
+    (`members`), checked against its SHA-256 in one sequential pass.
+
+    Raises:
+        BundleError: If the archive, its manifest or a member digest is invalid.
+    """
+
+    def __init__(self, path):
+        import zipfile
+
+        self.path = path
+        self.members = {}
+        self._map = None
+        self._view = None
+        try:
+            with open(path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                with zipfile.ZipFile(f) as archive:
+                    infos = {info.filename: info for info in archive.infolist()}
+            self._view = memoryview(self._map)
+            for name, info in infos.items():
+                if info.compress_type != zipfile.ZIP_STORED:
+                    raise BundleError(f"{name} is compressed; bundle members must be stored")
+                name_length, extra_length = struct.unpack_from("<HH", self._map, info.header_offset + 26)
+                start = info.header_offset + ZIP_LOCAL_HEADER_SIZE + name_length + extra_length
+                self.members[name] = self._view[start:start + info.file_size]
+
+            if BUNDLE_MANIFEST_NAME not in self.members:
+                raise BundleError(f"No {BUNDLE_MANIFEST_NAME} in bundle")
+            self.manifest = json.loads(bytes(self.members[BUNDLE_MANIFEST_NAME]))
+            if self.manifest.get("format") != BUNDLE_FORMAT_VERSION:
+                raise BundleError(f"Unsupported bundle format {self.manifest.get('format')!r}")
+            for entry in self.manifest["files"]:
+                self._check_entry(entry)
+                data = self.members.get(entry["name"])
+                if data is None or len(data) != entry["size"]:
+                    raise BundleError(f"{entry['name']} ({entry['offset']}) is missing or truncated")
+                if hashlib.sha256(data).hexdigest() != entry["sha256"]:
+                    raise BundleError(f"{entry['name']} ({entry['offset']}) does not match its SHA-256")
+        except BundleError:
+            self.close()
+            raise
+        except (OSError, ValueError, KeyError, TypeError, AttributeError, struct.error, zipfile.BadZipFile) as e:
+            self.close()
+            raise BundleError(f"Invalid bundle {os.path.basename(path)}: {e}")
+
+    @staticmethod
+    def _check_entry(entry):
+        """Reject manifest entries whose name could leave the extraction folder or whose offset is invalid."""
+        name = entry["name"]
+        if (not isinstance(name, str) or name in ("", ".", "..") or os.path.isabs(name)
+                or ":" in name or os.path.basename(name.replace("\\", "/")) != name):
+            raise BundleError(f"Invalid member name {name!r} in manifest")
+        offset = entry["offset"]
+        try:
+            if not isinstance(offset, str) or not offset.lower().startswith("0x"):
+                raise ValueError
+            int(offset, 16)
+        except ValueError:
+            raise BundleError(f"Invalid offset {offset!r} for {name} in manifest")
+
+    def extract(self, directory):
+        """Write the firmware members to `directory` for path-based esptool runs.
+
+        Returns:
+            tuple: ({offset: path}, {path: member memoryview})
+        """
+        flash_files = {}
+        views = {}
+        for entry in self.manifest["files"]:
+            path = os.path.join(directory, entry["name"])
+            with open(path, "wb") as f:
+                f.write(self.members[entry["name"]])
+            flash_files[entry["offset"]] = path
+            views[path] = self.members[entry["name"]]
+        return flash_files, views
+
+    def close(self):
+        for view in list(self.members.values()) + [self._view]:
+            if view is not None:
+                view.release()
+        self.members = {}
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # Aún hay vistas en uso: se libera al recogerlas
+            self._map = None
+
+
+def create_bundle_archive(json_path, output_path, on_missing=None):
+    """Pack a flasher_args.json and its binaries into one BundleArchive file.
+
+    The layout is validated with FirmwareBundle first, so a bundle that
+    could not be flashed is never written.
+
+    Returns:
+        dict: The manifest written to the archive.
+
+    Raises:
+        BundleError: If the files are missing or their layout is invalid.
+        ValueError: If the JSON is invalid or no file can be resolved.
+    """
+    import zipfile
+
+    flash_files, write_flash_args, extra_esptool_args = parse_flasher_args(
+        json_path, on_missing, require_all=True)
+    bundle = FirmwareBundle(flash_files, write_flash_args)
+    try:
+        digests = bundle.digests()
+        files = [
+            {
+                "offset": region.offset,
+                "name": f"{region.offset}_{os.path.basename(region.path)}",
+                "size": region.size,
+                "sha256": digests[region.path]["sha256"],
+            }
+            for region in bundle.regions
+        ]
+        manifest = {
+            "format": BUNDLE_FORMAT_VERSION,
+            "chip": extra_esptool_args.get("chip"),
+            "write_flash_args": write_flash_args,
+            "extra_esptool_args": extra_esptool_args,
+            "files": files,
+            "source": os.path.basename(json_path),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+
+        temp_path = f"{output_path}.{os.getpid()}.tmp"
+        try:
+            with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_STORED) as archive:
+                archive.writestr(BUNDLE_MANIFEST_NAME, json.dumps(manifest, indent=2))
+                with bundle.mapped():
+                    for entry, region in zip(files, bundle.regions):
+                        archive.writestr(entry["name"], bundle.view(region.path))
+            os.replace(temp_path, output_path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+    finally:
+        bundle.close()
+    return manifest
+
+
+class MonitorRingBuffer:
+    """Fixed-capacity, thread-safe ring buffer of serial monitor lines.
+
+    Every appended line gets a sequence number so the GUI can ask for the
+    lines it has not rendered yet, and learn how many were overwritten.
+    """
+
+    def __init__(self, capacity=MONITOR_RING_LINES):
+        self.lines = deque(maxlen=capacity)
+        self.total = 0  # Sequence number of the next line
+        self.lock = threading.Lock()
+
+    def extend(self, lines):
+        with self.lock:
+            self.lines.extend(lines)
+            self.total += len(lines)
+
+    def since(self, seq):
+        """Return (next_seq, new_lines, dropped) for lines appended after `seq`."""
+        with self.lock:
+            first = self.total - len(self.lines)
+            dropped = max(0, first - seq)
+            new_lines = list(self.lines)[max(seq, first) - first:]
+            return self.total, new_lines, dropped
+
+
+def split_serial_lines(pending, chunk):
+    """Split a received chunk into complete decoded lines.
+
+    Returns:
+        tuple: (lines, remaining partial bytes)
+    """
+    pending += chunk
+    *complete, pending = pending.split(b"\n")
+    if len(pending) > MONITOR_MAX_LINE_BYTES:
+        complete.append(pending)
+        pending = b""
+    lines = [raw.decode("utf-8", errors="ignore").strip() for raw in complete]
+    return [line for line in lines if line], pending
+
+
+class MfgRecordStore:
+    """Manufacturing records indexed by hw_id, backed by a CSV plus a journal.
+
+    The CSV is read once. New boards whose fields match the CSV header are
+    appended to the CSV directly; updates of known boards (and rows with a
+    different set of fields) are appended to `<csv>.journal` as JSON lines.
+    The journal is replayed on load and folded back into the CSV by
+    `compact()`, which runs periodically and when the store is closed.
+    """
+
+    def __init__(self, csv_path):
+        self.csv_path = csv_path
+        self.journal_path = csv_path + ".journal"
+        self.rows = []
+        self.index = {}  # hw_id -> position in self.rows
+        self.fieldnames = []  # Columns for the next CSV rewrite
+        self.file_fieldnames = []  # Columns currently in the CSV header
+        self.journal_entries = 0
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if os.path.exists(self.csv_path) and os.path.getsize(self.csv_path) > 0:
+            with open(self.csv_path, mode='r', newline='', encoding='utf-8') as csv_file:
+                reader = csv.DictReader(csv_file)
+                for row in reader:
+                    self.index.setdefault(row.get("hw_id"), len(self.rows))
+                    self.rows.append(row)
+                self.file_fieldnames = list(reader.fieldnames or [])
+        self.fieldnames = list(self.file_fieldnames)
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, mode='r', encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        self._apply(json.loads(line))
+                    except json.JSONDecodeError:
+                        continue  # Última línea incompleta tras un corte
+                    self.journal_entries += 1
+            if self.journal_entries:
+                self.compact()
+
+    def _apply(self, record):
+        """Merge a record into memory; return True if it is a new board."""
+        hw_id = record.get("hw_id")
+        position = self.index.get(hw_id)
+        # Igual que antes: las columnas son las del último registro recibido
+        self.fieldnames = list(record.keys())
+        if position is None:
+            self.index[hw_id] = len(self.rows)
+            self.rows.append(dict(record))
+            return True
+        self.rows[position].update(record)
+        return False
+
+    def upsert(self, record):
+        """Insert or merge one record.
+
+        Returns:
+            int: Number of records in the store.
+        """
+        with self.lock:
+            is_new = self._apply(record)
+            if not self.file_fieldnames:
+                self.compact()
+            elif is_new and list(record.keys()) == self.file_fieldnames:
+                with open(self.csv_path, mode='a', newline='', encoding='utf-8') as csv_file:
+                    csv.DictWriter(csv_file, fieldnames=self.file_fieldnames).writerow(record)
+            else:
+                with open(self.journal_path, mode='a', encoding='utf-8') as journal:
+                    journal.write(json.dumps(record) + "\n")
+                self.journal_entries += 1
+                if self.journal_entries >= MFG_JOURNAL_COMPACT_EVERY:
+                    self.compact()
+            return len(self.rows)
+
+    def export_csv(self, path):
+        """Write all records to `path` with the current columns."""
+        with open(path, mode='w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=self.fieldnames, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(self.rows)
+
+    def compact(self):
+        """Rewrite the CSV from memory atomically and drop the journal."""
+        temp_path = self.csv_path + ".tmp"
+        self.export_csv(temp_path)
+        os.replace(temp_path, self.csv_path)
+        # Establecer permisos Linux (rw-rw----)
+        os.chmod(self.csv_path, 0o660)
+        self.file_fieldnames = list(self.fieldnames)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal_entries = 0
+
+    def flush_delay(self):
+        """Records are written by upsert itself: nothing is ever waiting for a commit."""
+        return None
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self.lock:
+            if self.journal_entries:
+                self.compact()
+
+
+class SqliteRecordStore:
+    """Manufacturing records in a SQLite database (WAL mode), keyed by hw_id.
+
+    Records are kept as JSON and merged like the CSV store (`row.update`).
+    Upserts are buffered and committed in one transaction by `flush()`,
+    which the owner calls once `flush_delay()` reaches zero (every
+    SQLITE_COMMIT_INTERVAL seconds), so several tool instances can share
+    one database file without rewriting it.
+    """
+
+    def __init__(self, db_path):
+        self.csv_path = db_path  # Misma interfaz que MfgRecordStore
+        self.pending = {}  # hw_id -> merged record waiting for commit
+        self.pending_since = None  # time.monotonic() of the oldest uncommitted upsert
+        self.lock = threading.Lock()
+        import sqlite3
+        self.conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS mfg_records (
+                hw_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_mfg_records_created ON mfg_records(created_at);
+            CREATE INDEX IF NOT EXISTS idx_mfg_records_updated ON mfg_records(updated_at);
+        """)
+        self.record_count = self.conn.execute("SELECT COUNT(*) FROM mfg_records").fetchone()[0]
+
+    def upsert(self, record):
+        """Buffer one record for the next batched commit (see flush_delay).
+
+        Returns:
+            int: Approximate number of records (committed + pending).
+        """
+        with self.lock:
+            hw_id = str(record.get("hw_id"))
+            self.pending.setdefault(hw_id, {}).update(record)
+            if self.pending_since is None:
+                self.pending_since = time.monotonic()
+            return self.record_count + len(self.pending)
+
+    def flush_delay(self):
+        """Seconds until the buffered records are due for commit, or None if there are none."""
+        with self.lock:
+            if not self.pending:
+                return None
+            return max(0.0, self.pending_since + SQLITE_COMMIT_INTERVAL - time.monotonic())
+
+    def flush(self):
+        """Commit all pending records in a single transaction.
+
+        On failure the records stay pending and are retried after another
+        SQLITE_COMMIT_INTERVAL.
+        """
+        with self.lock:
+            if not self.pending:
+                return
+            now = time.time()
+            # BEGIN IMMEDIATE: la lectura y la escritura del merge no se cruzan con otra instancia
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for hw_id, record in self.pending.items():
+                    row = self.conn.execute(
+                        "SELECT data FROM mfg_records WHERE hw_id = ?", (hw_id,)).fetchone()
+                    data = json.loads(row[0]) if row else {}
+                    data.update(record)
+                    self.conn.execute(
+                        "INSERT INTO mfg_records (hw_id, data, created_at, updated_at) "
+                        "VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT(hw_id) DO UPDATE SET data = excluded.data, "
+                        "updated_at = excluded.updated_at",
+                        (hw_id, json.dumps(data), now, now))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                self.pending_since = time.monotonic()
+                raise
+            self.pending.clear()
+            self.pending_since = None
+            self.record_count = self.conn.execute("SELECT COUNT(*) FROM mfg_records").fetchone()[0]
+
+    def records_between(self, start, end=None):
+        """Return records created in [start, end) (Unix timestamps), oldest first."""
+        self.flush()
+        end = time.time() + 1 if end is None else end
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT data FROM mfg_records WHERE created_at >= ? AND created_at < ? "
+                "ORDER BY created_at", (start, end)).fetchall()
+        return [json.loads(data) for (data,) in rows]
+
+    def records_today(self):
+        """Return records of boards first logged since local midnight."""
+        midnight = time.mktime(time.localtime()[:3] + (0, 0, 0, 0, 0, -1))
+        return self.records_between(midnight)
+
+    def export_csv(self, path):
+        """Write all records to a CSV file (union of all fields as columns)."""
+        records = self.records_between(0)
+        fieldnames = []
+        for record in records:
+            fieldnames.extend(key for key in record if key not in fieldnames)
+        with open(path, mode='w', newline='', encoding='utf-8') as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+            writer.writeheader()
+            writer.writerows(records)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self.lock:
+                self.conn.close()
+
+
+def open_record_store(path):
+    """Open the SQLite store for .db/.sqlite paths, the CSV store otherwise."""
+    if path.lower().endswith(SQLITE_EXTENSIONS):
+        return SqliteRecordStore(path)
+    return MfgRecordStore(path)
+
+
+class MfgRecordWriter:
+    """Background thread that persists mfg records off the serial read path.
+
+    `submit()` only queues the record. The writer thread merges queued
+    records for the same hw_id into one upsert, owns the record store and
+    reports ("ok" | "error", path, hw_id, detail) tuples on `results`.
+    Records a store buffers (SQLite) are committed by this thread when due
+    and reported "ok" only after the commit.
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.results = queue.Queue()
+        self.store = None
+        self.unconfirmed = {}  # hw_id -> path, buffered by the store and not committed yet
+        self.thread = threading.Thread(target=self._run, name="mfg-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, path, record):
+        self.queue.put((path, dict(record)))
+
+    def close(self, timeout=5):
+        """Write everything still queued, close the store and stop the thread."""
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            delay = self.store.flush_delay() if self.store is not None else None
+            try:
+                batch = [self.queue.get(timeout=delay)]
+            except queue.Empty:
+                self._flush_store()  # Commit pendiente vencido
+                continue
+            time.sleep(MFG_WRITER_BATCH_DELAY)
+            while True:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            # Fusionar actualizaciones del mismo hw_id (mismo orden que row.update)
+            merged = {}
+            for item in batch:
+                if item is None:
+                    stopping = True
+                    continue
+                path, record = item
+                merged.setdefault((path, record.get("hw_id")), {}).update(record)
+
+            for (path, hw_id), record in merged.items():
+                try:
+                    if self.store is None or self.store.csv_path != path:
+                        self._close_store()
+                        self.store = open_record_store(path)
+                    count = self.store.upsert(record)
+                    if self.store.flush_delay() is None:
+                        self.results.put(("ok", path, hw_id, count))
+                    else:
+                        self.unconfirmed[hw_id] = path  # Se informa tras el commit
+                except Exception as e:
+                    self.results.put(("error", path, hw_id, e))
+        self._close_store()
+
+    def _flush_store(self):
+        """Commit what the store buffered and report each record once it is committed."""
+        try:
+            self.store.flush()
+        except Exception as e:
+            for hw_id, path in self.unconfirmed.items():
+                self.results.put(("error", path, hw_id, e))
+            return
+        count = getattr(self.store, "record_count", None)
+        for hw_id, path in self.unconfirmed.items():
+            self.results.put(("ok", path, hw_id, count))
+        self.unconfirmed.clear()
+
+    def _close_store(self):
+        if self.store is not None:
+            if self.unconfirmed:
+                self._flush_store()
+            try:
+                self.store.close()
+            except Exception as e:
+                self.results.put(("error", self.store.csv_path, None, e))
+            self.unconfirmed.clear()
+            self.store = None
+
+
+def xor_bytes(data):
+    """XOR of all bytes in `data`, folding it as one big integer by halves."""
+    value = int.from_bytes(data, "little")
+    width = len(data)
+    while width > 1:
+        half = (width + 1) // 2
+        value = (value >> (half * 8)) ^ (value & ((1 << (half * 8)) - 1))
+        width = half
+    return value
+
+
+def parse_app_image(path):
+    """Parse an ESP32-family app/bootloader image without running esptool.
+
+    The file is read through a read-only memory map: header, extended
+    header, segment table, XOR checksum and the appended SHA-256.
+
+    Returns:
+        AppImageInfo: `segments` is a list of (load_address, file_offset, length);
+        `digest` is the 32-byte appended SHA-256 (None if not appended).
+
+    Raises:
+        ValueError: If the file is not a valid app image.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size < ESP_IMAGE_HEADER.size + ESP_IMAGE_EXT_HEADER.size:
+            raise ValueError("File too small for an ESP image")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                magic, segment_count, flash_mode, flash_size_freq, entrypoint = \
+                    ESP_IMAGE_HEADER.unpack_from(view, 0)
+                if magic != ESP_IMAGE_MAGIC:
+                    raise ValueError(f"Invalid image magic 0x{magic:02x}")
+                if segment_count > ESP_IMAGE_MAX_SEGMENTS:
+                    raise ValueError(f"Invalid segment count {segment_count}")
+                (_, _, chip_id, _, _, _, _, hash_appended) = \
+                    ESP_IMAGE_EXT_HEADER.unpack_from(view, ESP_IMAGE_HEADER.size)
+
+                # Tabla de segmentos + checksum XOR de los datos
+                position = ESP_IMAGE_HEADER.size + ESP_IMAGE_EXT_HEADER.size
+                segments = []
+                checksum = ESP_CHECKSUM_MAGIC
+                for _ in range(segment_count):
+                    if position + ESP_SEGMENT_HEADER.size > len(view):
+                        raise ValueError("Truncated segment header")
+                    load_address, length = ESP_SEGMENT_HEADER.unpack_from(view, position)
+                    position += ESP_SEGMENT_HEADER.size
+                    if position + length > len(view):
+                        raise ValueError(f"Segment at 0x{load_address:08x} exceeds file size")
+                    segments.append((load_address, position, length))
+                    checksum ^= xor_bytes(view[position:position + length])
+                    position += length
+
+                # El checksum ocupa el último byte de un bloque de 16
+                position += 15 - (position % 16)
+                if position >= len(view):
+                    raise ValueError("Truncated image checksum")
+                stored_checksum = view[position]
+                position += 1
+
+                digest = None
+                digest_valid = False
+                if hash_appended:
+                    if position + 32 > len(view):
+                        raise ValueError("Truncated appended SHA-256")
+                    digest = bytes(view[position:position + 32])
+                    digest_valid = hashlib.sha256(view[:position]).digest() == digest
+                    position += 32
+            finally:
+                view.release()
+
+    chip = next((name for name, value in ESP_IMAGE_CHIP_IDS.items() if value == chip_id), None)
+    return AppImageInfo(
+        chip_id=chip_id, chip=chip, entrypoint=entrypoint, flash_mode=flash_mode,
+        flash_size_freq=flash_size_freq, segments=segments,
+        checksum=stored_checksum, checksum_valid=stored_checksum == checksum,
+        hash_appended=bool(hash_appended), digest=digest, digest_valid=digest_valid,
+        image_size=position,
+    )
+
+
+def sha256_file(path):
+    """Return the SHA-256 hex digest of a file."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def copy_file_atomic(src_path, dest_path):
+    """Copy a file through a unique temp file and rename it into place."""
+    temp_fd, temp_path = tempfile.mkstemp(
+        prefix=".copy_", suffix=".tmp", dir=os.path.dirname(os.path.abspath(dest_path)))
+    try:
+        with open(src_path, "rb") as src_file, os.fdopen(temp_fd, "wb") as dest_file:
+            shutil.copyfileobj(src_file, dest_file)
+        os.replace(temp_path, dest_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def write_json_atomic(path, data):
+    """Write `data` as JSON through a unique temp file and rename it into place."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temp_fd, temp_path = tempfile.mkstemp(prefix=".json_", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(temp_fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class PatchCache:
+    """Content-addressed cache of finished OTA patch files (header included).
+
+    Entries are keyed by the SHA-256 of the base and new images plus the
+    compression and chip, so renamed or copied images still hit. The file
+    mtime records the last use; the oldest entries are evicted once the
+    cache grows beyond `max_bytes`.
+    """
+
+    def __init__(self, directory=PATCH_CACHE_DIR, max_bytes=PATCH_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def key(self, base_path, new_path, compression, chip):
+        parts = [sha256_file(base_path), sha256_file(new_path), compression, chip]
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def get(self, key):
+        """Return the cached patch path for `key` (marking it used), or None."""
+        path = self._entry_path(key)
+        with self.lock:
+            if not os.path.exists(path):
+                return None
+            os.utime(path)
+            return path
+
+    def put(self, key, patch_path):
+        """Copy a finished patch into the cache and evict old entries."""
+        os.makedirs(self.directory, exist_ok=True)
+        copy_file_atomic(patch_path, self._entry_path(key))
+        with self.lock:
+            self._evict()
+
+    def _evict(self):
+        evict_oldest_files(self.directory, ".bin", self.max_bytes)
+
+
+def evict_oldest_files(directory, suffix, max_bytes):
+    """Remove the least recently used `suffix` files until `directory` fits in `max_bytes`."""
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue  # En Windows falla si otro proceso lo tiene mapeado
+        total -= size
+
+
+class PayloadCache:
+    """zlib-compressed flash payloads keyed by content SHA-256 and level.
+
+    Payloads stay in memory (up to `memory_bytes`) and, when `directory` is
+    set, are also stored on disk and mmapped back, so a restarted station
+    skips compression too. Compression runs under the lock: a board that
+    needs a payload being precompressed waits for it instead of redoing it.
+    An mmapped payload is handed out as a memoryview, so an evicted mmap is
+    closed at once unless a caller still reads it (then when it lets go).
+    """
+
+    def __init__(self, directory=PAYLOAD_CACHE_DIR, max_bytes=PAYLOAD_CACHE_MAX_BYTES,
+                 memory_bytes=PAYLOAD_MEMORY_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_bytes = memory_bytes
+        self.entries = {}  # key -> bytes or mmap, oldest first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(data, level):
+        return f"{hashlib.sha256(data).hexdigest()}-{level}"
+
+    def get(self, data, level=MERGE_COMPRESS_LEVEL):
+        """Return the deflated `data`, compressing it only on the first request."""
+        key = self.key(data, level)
+        with self.lock:
+            payload = self.entries.pop(key, None)
+            if payload is None:
+                payload = self._load(key)
+            if payload is None:
+                self.misses += 1
+                payload = zlib.compress(data, level)
+                self._store(key, payload)
+            else:
+                self.hits += 1
+            self.entries[key] = payload
+            self._trim()
+            return memoryview(payload) if isinstance(payload, mmap.mmap) else payload
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, f"{key}.zlib")
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        try:
+            with open(self._entry_path(key), "rb") as f:
+                payload = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None  # No existe o está vacío
+        os.utime(self._entry_path(key))
+        return payload
+
+    def _store(self, key, payload):
+        if not self.directory:
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f"{self._entry_path(key)}.{os.getpid()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(payload)
+            os.replace(temp_path, self._entry_path(key))
+            evict_oldest_files(self.directory, ".zlib", self.max_bytes)
+        except OSError:
+            pass  # Sin caché en disco se sigue usando la de memoria
+
+    def _trim(self):
+        total = sum(len(payload) for payload in self.entries.values())
+        while total > self.memory_bytes and len(self.entries) > 1:
+            payload = self.entries.pop(next(iter(self.entries)))
+            total -= len(payload)
+            if isinstance(payload, mmap.mmap):
+                try:
+                    payload.close()  # En Windows el mmap bloquea el archivo de la caché
+                except BufferError:
+                    pass  # Un segmento en uso aún lo lee: se cierra al soltar su vista
+
+
+class PatchError(Exception):
+    """Raised when an OTA patch cannot be built from the given images."""
+
+
+def check_patch_images(base_path, new_path, chip):
+    """Validate both images for `chip` and return the base validation digest.
+
+    Raises:
+        PatchError: If an image is invalid, built for another chip or the
+            base image has no valid appended SHA-256.
+    """
+    images = []
+    for path, name in ((base_path, "Base"), (new_path, "New")):
+        try:
+            image = parse_app_image(path)
+        except (OSError, ValueError) as e:
+            raise PatchError(f"Invalid app image {os.path.basename(path)}: {e}")
+        if image.chip_id != ESP_IMAGE_CHIP_IDS.get(chip, image.chip_id):
+            raise PatchError(f"{name} binary is for {image.chip or image.chip_id}, not {chip}")
+        images.append(image)
+
+    base_image = images[0]
+    if not (base_image.hash_appended and base_image.digest_valid):
+        raise PatchError("Validation hash not found")
+    return base_image.digest
+
+
+def build_ota_patch(base_path, new_path, save_path, chip, compression="heatshrink", **patch_options):
+    """Create a delta OTA patch file: 64-byte header followed by the detools patch.
+
+    The header holds ESP_DELTA_OTA_MAGIC, the base image validation digest
+    (what the device compares against its running app) and reserved bytes.
+    Extra `patch_options` (algorithm, heatshrink_window_sz2, ...) are passed
+    to detools.create_patch.
+
+    Returns:
+        bytes: The base image validation digest written to the header.
+
+    Raises:
+        PatchError: On invalid images or detools failures.
+    """
+    import detools
+
+    digest = check_patch_images(base_path, new_path, chip)
+
+    # Cabecera y parche van directo a un temporal único junto al destino;
+    # el rename atómico evita que dos generaciones se pisen.
+    temp_fd, temp_patch_path = tempfile.mkstemp(
+        prefix=".patch_", suffix=".tmp", dir=os.path.dirname(os.path.abspath(save_path)))
+    try:
+        with open(base_path, "rb") as ffrom, open(new_path, "rb") as fto, \
+                os.fdopen(temp_fd, "wb") as fpatch:
+            # Write custom header
+            fpatch.write(ESP_DELTA_OTA_MAGIC.to_bytes(MAGIC_SIZE, 'little'))
+            fpatch.write(digest)
+            fpatch.write(b"\x00" * RESERVED_HEADER)
+            # detools en el mismo proceso (equivalente a "python -m detools create_patch -c heatshrink")
+            detools.create_patch(ffrom, fto, fpatch, compression=compression, **patch_options)
+        os.replace(temp_patch_path, save_path)
+    except detools.Error as e:
+        raise PatchError(f"detools error: {e}")
+    finally:
+        if os.path.exists(temp_patch_path):
+            os.remove(temp_patch_path)
+    return digest
+
+
+def patch_option_sets():
+    """Yield every detools option set tried by the patch optimizer."""
+    for algorithm in OPTIMIZE_ALGORITHMS:
+        for compression in OPTIMIZE_COMPRESSIONS:
+            if compression != "heatshrink":
+                yield {"algorithm": algorithm, "compression": compression}
+                continue
+            for window in OPTIMIZE_HEATSHRINK_WINDOWS:
+                for lookahead in OPTIMIZE_HEATSHRINK_LOOKAHEADS:
+                    if lookahead < window:
+                        yield {"algorithm": algorithm, "compression": compression,
+                               "heatshrink_window_sz2": window,
+                               "heatshrink_lookahead_sz2": lookahead}
+
+
+def describe_patch_options(options):
+    """Short label for an option set, e.g. "bsdiff/heatshrink w8 l7"."""
+    label = f"{options['algorithm']}/{options['compression']}"
+    if options["compression"] == "heatshrink":
+        label += f" w{options['heatshrink_window_sz2']} l{options['heatshrink_lookahead_sz2']}"
+    return label
+
+
+def device_supports_patch(options):
+    """True if the device-side decoder can apply a patch built with `options`."""
+    if options["compression"] not in DEVICE_PATCH_COMPRESSIONS:
+        return False
+    if options["compression"] == "heatshrink":
+        params = (options["heatshrink_window_sz2"], options["heatshrink_lookahead_sz2"])
+        return params in DEVICE_HEATSHRINK_PARAMS
+    return True
+
+
+def run_compression_trial(base_path, new_path, options):
+    """Process-pool worker: build a patch in memory and return its size and time."""
+    import detools
+
+    started = time.perf_counter()
+    fpatch = io.BytesIO()
+    try:
+        with open(base_path, "rb") as ffrom, open(new_path, "rb") as fto:
+            detools.create_patch(ffrom, fto, fpatch, **options)
+    except Exception as e:
+        return {"options": options, "error": str(e)}
+    return {
+        "options": options,
+        "size": RESERVED_HEADER + MAGIC_SIZE + DIGEST_SIZE + len(fpatch.getvalue()),
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def optimize_ota_patch(base_path, new_path, save_path, chip, workers=None):
+    """Try every detools setting in parallel and write the smallest usable patch.
+
+    Only settings the device decoder supports (DEVICE_PATCH_COMPRESSIONS,
+    DEVICE_HEATSHRINK_PARAMS) are eligible; the others are still measured
+    so the trade-off table shows what a decoder change would gain.
+
+    Returns:
+        tuple: (best row, all rows sorted by size). Each row has "label",
+        "options", "size", "seconds", "device" and optionally "error".
+
+    Raises:
+        PatchError: If the images are invalid or no supported setting works.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    check_patch_images(base_path, new_path, chip)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_compression_trial, base_path, new_path, options)
+                   for options in patch_option_sets()]
+        rows = [future.result() for future in futures]
+
+    for row in rows:
+        row["label"] = describe_patch_options(row["options"])
+        row["device"] = device_supports_patch(row["options"])
+    rows.sort(key=lambda row: (row.get("size") is None, row.get("size", 0), row.get("seconds", 0)))
+
+    candidates = [row for row in rows if row["device"] and "error" not in row]
+    if not candidates:
+        raise PatchError("No device-supported compression produced a patch")
+    best = candidates[0]
+
+    options = dict(best["options"])
+    build_ota_patch(base_path, new_path, save_path, chip, options.pop("compression"), **options)
+    return best, rows
+
+
+def optimized_patch_cache_label():
+    """Cache key part for optimized patches (changes with the device limits)."""
+    return f"optimize:{','.join(DEVICE_PATCH_COMPRESSIONS)}:{sorted(DEVICE_HEATSHRINK_PARAMS)}"
+
+
+def run_patch_job(base_path, new_path, save_path, chip, compression):
+    """Process-pool worker: build one patch and describe the result for the manifest."""
+    started = time.perf_counter()
+    entry = {"base_file": os.path.basename(base_path)}
+    try:
+        digest = build_ota_patch(base_path, new_path, save_path, chip, compression)
+    except Exception as e:
+        entry["error"] = str(e)
+        return entry
+    patch_size = os.path.getsize(save_path)
+    entry.update({
+        "base_digest": digest.hex(),
+        "patch_file": os.path.basename(save_path),
+        "patch_size": patch_size,
+        "ratio": round(patch_size / os.path.getsize(new_path), 4),
+        "seconds": round(time.perf_counter() - started, 2),
+    })
+    return entry
+
+
+def generate_patch_matrix(base_dir, new_path, output_dir, chip, compression="heatshrink",
+                          workers=None, cache=None, on_result=None, on_line=None):
+    """Build patches from every .bin in `base_dir` to `new_path` in parallel.
+
+    Patches are built in a process pool (one detools run per core), served
+    from `cache` (a PatchCache) when possible, and listed in a
+    manifest.json in `output_dir` keyed by base validation digest.
+
+    Args:
+        on_result: Optional callback called with each manifest entry as it completes.
+        on_line: Optional callback for notes that are not manifest entries
+            (a patch that could not be added to `cache`).
+
+    Returns:
+        dict: The manifest that was written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    new_sha256 = sha256_file(new_path)
+    new_name = os.path.splitext(os.path.basename(new_path))[0]
+    manifest = {
+        "target_file": os.path.basename(new_path),
+        "target_sha256": new_sha256,
+        "chip": chip,
+        "compression": compression,
+        "patches": {},
+        "errors": [],
+    }
+
+    def record(entry):
+        if "error" in entry:
+            manifest["errors"].append(entry)
+        else:
+            manifest["patches"][entry["base_digest"]] = entry
+        if on_result:
+            on_result(entry)
+
+    jobs = []
+    for name in sorted(os.listdir(base_dir)):
+        base_path = os.path.join(base_dir, name)
+        if not name.lower().endswith(".bin") or not os.path.isfile(base_path):
+            continue
+        base_sha256 = sha256_file(base_path)
+        if base_sha256 == new_sha256:
+            continue  # Misma imagen que el objetivo: no hace falta parche
+        base_name = os.path.splitext(name)[0]
+        save_path = os.path.join(output_dir, f"patch_{base_name}_{base_sha256[:8]}_to_{new_name}.bin")
+
+        cached_patch = None
+        if cache is not None:
+            cache_key = cache.key(base_path, new_path, compression, chip)
+            cached_patch = cache.get(cache_key)
+        if cached_patch:
+            copy_file_atomic(cached_patch, save_path)
+            with open(save_path, "rb") as f:
+                f.seek(MAGIC_SIZE)
+                digest = f.read(DIGEST_SIZE)
+            patch_size = os.path.getsize(save_path)
+            record({
+                "base_file": name,
+                "base_digest": digest.hex(),
+                "patch_file": os.path.basename(save_path),
+                "patch_size": patch_size,
+                "ratio": round(patch_size / os.path.getsize(new_path), 4),
+                "seconds": 0.0,
+                "cached": True,
+            })
+            continue
+        jobs.append((base_path, save_path))
+
+    if jobs:
+        from concurrent.futures import ProcessPoolExecutor, as_completed
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {
+                pool.submit(run_patch_job, base_path, new_path, save_path, chip, compression):
+                    (base_path, save_path)
+                for base_path, save_path in jobs
+            }
+            for future in as_completed(futures):
+                base_path, save_path = futures[future]
+                entry = future.result()
+                if "error" not in entry and cache is not None:
+                    try:
+                        cache.put(cache.key(base_path, new_path, compression, chip), save_path)
+                    except OSError as e:
+                        if on_line:
+                            on_line(f"Patch cache not updated: {e}\n")
+                record(entry)
+
+    with open(os.path.join(output_dir, PATCH_MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def run_esptool_inprocess(args, on_line):
+    """Run esptool.main(args) in this process, streaming its output to `on_line`.
+
+    Returns:
+        int: Process-style return code (0 on success, 2 on esptool fatal error).
+    """
+    esptool = load_esptool()
+    stream = LineStream(on_line)
+    sys.stdout.local.stream = sys.stderr.local.stream = stream
+    try:
+        esptool.main(list(args))
+        return_code = 0
+    except SystemExit as e:
+        if e.code is None or isinstance(e.code, int):
+            return_code = e.code or 0
+        else:
+            stream.write(f"{e.code}\n")
+            return_code = 1
+    except esptool.FatalError as e:
+        stream.write(f"\nA fatal error occurred: {e}\n")
+        return_code = 2
+    except serial.SerialException as e:
+        stream.write(f"\nA serial exception error occurred: {e}\n")
+        return_code = 1
+    except Exception as e:
+        stream.write(f"\nesptool error: {e}\n")
+        return_code = 1
+    finally:
+        stream.close()
+        sys.stdout.local.stream = sys.stderr.local.stream = None
+    return return_code
+
+
+# Manufacturing data lines sent by the firmware, e.g. {"type":"mfg","hw_id":...}
+MFG_RECORD_RE = re.compile(r'(\{.*?"type":"mfg".*?\})')
+
+
+def extract_mfg_record(line):
+    """Return the mfg JSON record embedded in a monitor line, or None."""
+    if '{"type":"mfg"' not in line:
+        return None
+    match = MFG_RECORD_RE.search(line)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(1))
+    except json.JSONDecodeError:
+        print("Failed to decode JSON")
+        return None
+
+
+def reset_board(port):
+    """Perform a soft reset of the board on `port` using DTR/RTS."""
+    # Check if port exists and is accessible
+    if not os.path.exists(port):
+        raise serial.SerialException(f"Port {port} not found")
+
+    # Reset sequence (DTR/RTS)
+    with serial.Serial(port=port, baudrate=MONITOR_BAUDRATE) as ser:
+        ser.dtr = False
+        ser.rts = True
+        time.sleep(0.1)
+        ser.dtr = True
+        ser.rts = False
+
+
+class SerialMonitor:
+    """Serial port reader thread feeding a MonitorRingBuffer.
+
+    Reads in_waiting-sized chunks, splits lines itself and hands every mfg
+    record found to `on_mfg_record`. Rendering is left to the caller, which
+    polls `buffer.since()`.
+    """
+
+    def __init__(self, port, baudrate=MONITOR_BAUDRATE, on_mfg_record=None):
+        self.port = port
+        self.baudrate = baudrate
+        self.on_mfg_record = on_mfg_record
+        self.buffer = MonitorRingBuffer()
+        self.ser = None
+        self.thread = None
+        self.running = False
+
+    def start(self):
+        """Open the port and start the reader thread.
+
+        Raises:
+            serial.SerialException: If the port cannot be opened.
+        """
+        # Configuración serial con control de flujo
+        self.ser = serial.Serial(
+            port=self.port,
+            baudrate=self.baudrate,
+            timeout=1,
+            rtscts=True  # Habilita control de flujo hardware
+        )
+        self.ser.reset_input_buffer()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """Safe shutdown procedure"""
+        self.running = False
+        if self.thread and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+        if self.ser and self.ser.is_open:
+            self.ser.close()
+
+    def _run(self):
+        """Hilo de lectura: bloques grandes, líneas al ring buffer"""
+        pending = b""
+        while self.running and self.ser.is_open:
+            try:
+                # Leer todo lo disponible; si no hay nada, esperar 1 byte (timeout)
+                chunk = self.ser.read(self.ser.in_waiting or 1)
+                if not chunk:
+                    continue
+                lines, pending = split_serial_lines(pending, chunk)
+                if not lines:
+                    continue
+                self.buffer.extend(lines)
+
+                # Procesar datos de manufactura
+                if self.on_mfg_record:
+                    for data in lines:
+                        record = extract_mfg_record(data)
+                        if record:
+                            self.on_mfg_record(record)
+
+            except (serial.SerialException, OSError, TypeError, AttributeError) as e:
+                print(f"Serial read error: {e}")
+                break
+        self.running = False
+
+
+def read_usb_ids(tty_name):
+    """Read only idVendor/idProduct of a Linux tty from sysfs.
+
+    Returns:
+        tuple: (vid, pid), or None if the tty is not a USB device.
+    """
+    device_link = f"/sys/class/tty/{tty_name}/device"
+    if not os.path.exists(device_link):
+        return None
+    device_path = os.path.realpath(device_link)
+    subsystem = os.path.basename(os.path.realpath(os.path.join(device_path, "subsystem")))
+    if subsystem == "usb-serial":
+        interface_path = os.path.dirname(device_path)
+    elif subsystem == "usb":
+        interface_path = device_path
+    else:
+        return None
+    usb_device_path = os.path.dirname(interface_path)
+    try:
+        with open(os.path.join(usb_device_path, "idVendor")) as f:
+            vid = int(f.read().strip(), 16)
+        with open(os.path.join(usb_device_path, "idProduct")) as f:
+            pid = int(f.read().strip(), 16)
+    except (OSError, ValueError):
+        return None
+    return vid, pid
+
+
+class CachedPortEnumerator:
+    """comports() replacement that only reads sysfs for new or replaced nodes.
+
+    On Linux /dev is listed once (instead of one glob per name pattern)
+    and the ListPortInfo of each node is cached by (inode, device
+    number). A re-plugged board gets a fresh node and is read again.
+    With `usb_ids` set, only USB ttys are considered, and their VID:PID
+    is checked before the full attribute read. Other platforms use
+    pyserial's comports() and filter the result.
+
+    Instances are callable and thread-safe, so one can be shared by
+    PortWatcher and the GUI.
+    """
+
+    def __init__(self, usb_ids=None):
+        self.usb_ids = set(usb_ids) if usb_ids is not None else None
+        self.cache = {}  # device -> ((st_ino, st_rdev), ListPortInfo or None)
+        self.reads = 0  # Nodes read from sysfs (for benchmarks)
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        return self.comports()
+
+    def comports(self):
+        if not sys.platform.startswith("linux"):
+            return [port for port in serial.tools.list_ports.comports()
+                    if self.usb_ids is None or (port.vid, port.pid) in self.usb_ids]
+
+        prefixes = LINUX_PORT_PREFIXES if self.usb_ids is None else LINUX_USB_PORT_PREFIXES
+        with self.lock:
+            current = {}
+            with os.scandir("/dev") as entries:
+                for entry in entries:
+                    if not entry.name.startswith(prefixes):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # Nodo borrado durante el listado
+                    key = (stat.st_ino, stat.st_rdev)
+                    cached = self.cache.get(entry.path)
+                    if cached is None or cached[0] != key:
+                        # No se usa mtime: escribir en el tty lo actualiza
+                        cached = (key, self._read_port(entry.path, entry.name))
+                        self.reads += 1
+                    current[entry.path] = cached
+            self.cache = current
+            ports = [info for _, info in current.values() if info is not None]
+        return sorted(ports, key=lambda port: port.device)
+
+    def _read_port(self, path, name):
+        from serial.tools.list_ports_linux import SysFS
+
+        if self.usb_ids is not None and read_usb_ids(name) not in self.usb_ids:
+            return None
+        info = SysFS(path)
+        if info.subsystem == "platform":
+            return None  # Puerto interno no presente (igual que pyserial)
+        return info
+
+
+class StationSlots:
+    """Persistent map from a physical USB position to a station slot number.
+
+    Ports are keyed by hub location ("loc:1-1.2") when pyserial reports
+    one and by USB serial number ("sn:...") otherwise, so a board that
+    re-enumerates as another /dev node keeps its slot. Unknown keys get
+    the lowest free slot; the map is saved to `path` on every change and
+    can be edited by hand to renumber a station.
+    """
+
+    def __init__(self, path=STATION_SLOTS_PATH):
+        self.path = path
+        self.slots = {}  # key -> slot number
+        self.lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.slots = {key: int(slot) for key, slot in json.load(f).items()}
+        except (OSError, ValueError, AttributeError):
+            self.slots = {}
+
+    @staticmethod
+    def key_for(port):
+        if port.location:
+            return f"loc:{port.location}"
+        if port.serial_number:
+            return f"sn:{port.serial_number}"
+        return None  # Puertos internos (ttyS*): sin slot
+
+    def slot_for(self, port, assign=True):
+        """Return the slot of `port`, assigning the lowest free one if new (None if no key)."""
+        key = self.key_for(port)
+        if key is None:
+            return None
+        with self.lock:
+            slot = self.slots.get(key)
+            if slot is None and assign:
+                used = set(self.slots.values())
+                slot = next(number for number in range(1, len(used) + 2) if number not in used)
+                self.slots[key] = slot
+                self._save()
+            return slot
+
+    def _save(self):
+        try:
+            write_json_atomic(self.path, self.slots)
+        except OSError as e:
+            print(f"Station slots not saved: {e}")
+
+
+class BaudProfiles:
+    """Highest verified flashing baud per USB-UART adapter, saved as JSON.
+
+    Adapters are keyed "VID:PID:serial". An adapter that was never
+    calibrated gets the lowest rate recorded for the same VID:PID, so a
+    new board on a known bridge type still starts fast.
+    """
+
+    def __init__(self, path=BAUD_PROFILE_PATH):
+        self.path = path
+        self.profiles = {}  # key -> baud
+        self.lock = threading.Lock()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self.profiles = {key: int(baud) for key, baud in json.load(f).items()}
+        except (OSError, ValueError, AttributeError):
+            self.profiles = {}
+
+    @staticmethod
+    def key_for(port):
+        if port is None or port.vid is None:
+            return None  # Sin VID:PID no hay adaptador que recordar
+        return f"{port.vid:04X}:{port.pid:04X}:{port.serial_number or ''}"
+
+    def get(self, port):
+        key = self.key_for(port)
+        if key is None:
+            return None
+        with self.lock:
+            if key in self.profiles:
+                return self.profiles[key]
+            usb_id = key.rsplit(":", 1)[0] + ":"
+            same_bridge = [baud for other, baud in self.profiles.items() if other.startswith(usb_id)]
+            return min(same_bridge) if same_bridge else None
+
+    def set(self, port, baud):
+        key = self.key_for(port)
+        if key is None:
+            return
+        with self.lock:
+            self.profiles[key] = int(baud)
+            try:
+                write_json_atomic(self.path, self.profiles)
+            except OSError as e:
+                print(f"Baud profiles not saved: {e}")
+
+
+class PortWatcher:
+    """Background thread that reports serial ports appearing and disappearing.
+
+    On Linux it blocks on a netlink socket for kernel uevents and only
+    enumerates after a tty/usb event; elsewhere (or without netlink) it
+    polls `enumerate_ports` every PORT_POLL_INTERVAL seconds. Each change
+    calls `on_change(added, removed, initial)` from the watcher thread, with
+    ListPortInfo objects for new ports and device names for removed ones.
+    The first scan is reported with initial=True.
+    """
+
+    def __init__(self, on_change, enumerate_ports=None, poll_interval=PORT_POLL_INTERVAL):
+        self.on_change = on_change
+        self.enumerate_ports = enumerate_ports or CachedPortEnumerator()
+        self.poll_interval = poll_interval
+        self.ports = {}  # device -> ListPortInfo
+        self.mode = None  # "netlink" | "polling"
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="port-watcher", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        if self.thread and self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join(self.poll_interval + 1)
+
+    def scan(self, initial=False):
+        """Enumerate once and report the difference with the previous scan."""
+        current = {port.device: port for port in self.enumerate_ports()}
+        added = [port for device, port in current.items()
+                 if device not in self.ports or self._identity(self.ports[device]) != self._identity(port)]
+        removed = [device for device in self.ports if device not in current]
+        self.ports = current
+        if added or removed or initial:
+            self.on_change(added, removed, initial)
+
+    @staticmethod
+    def _identity(port):
+        # Mismo nodo /dev con otra placa (p.ej. ttyACM0 reasignado)
+        return (port.vid, port.pid, port.serial_number, port.location)
+
+    def _open_uevent_socket(self):
+        if not hasattr(socket, "AF_NETLINK"):
+            return None
+        try:
+            sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+            sock.bind((0, 1))  # Grupo 1: eventos del kernel
+        except OSError:
+            return None
+        sock.settimeout(self.poll_interval)
+        return sock
+
+    def _run(self):
+        sock = self._open_uevent_socket()
+        self.mode = "netlink" if sock else "polling"
+        try:
+            self._safe_scan(initial=True)
+            while self.running:
+                if sock is None:
+                    time.sleep(self.poll_interval)
+                    self._safe_scan()
+                    continue
+                try:
+                    message = sock.recv(8192)
+                except socket.timeout:
+                    continue
+                except OSError:
+                    # Socket caído: seguir por sondeo
+                    sock.close()
+                    sock = None
+                    self.mode = "polling"
+                    continue
+                if b"SUBSYSTEM=tty" not in message and b"SUBSYSTEM=usb" not in message:
+                    continue
+                # Agrupar la ráfaga de eventos de un enchufe en un solo escaneo
+                time.sleep(PORT_SETTLE_DELAY)
+                self._drain(sock)
+                self._safe_scan()
+        finally:
+            if sock is not None:
+                sock.close()
+
+    def _drain(self, sock):
+        sock.setblocking(False)
+        try:
+            while True:
+                sock.recv(8192)
+        except OSError:
+            pass
+        finally:
+            sock.settimeout(self.poll_interval)
+
+    def _safe_scan(self, initial=False):
+        try:
+            self.scan(initial)
+        except Exception as e:
+            print(f"Port scan failed: {e}")
+
+
+MissingFile = namedtuple("MissingFile", ["rel_path", "context", "searched"])
+
+
+def list_directory(path):
+    """Return the (normcased) file names in a directory, or None if it cannot be read.
+
+    Listings are cached until the directory mtime changes, so reloading the
+    same build tree costs one stat per directory instead of a readdir.
+    """
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        _dir_listing_cache.pop(path, None)
+        return None
+    cached = _dir_listing_cache.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with os.scandir(path) as entries:
+            names = frozenset(os.path.normcase(entry.name) for entry in entries if not entry.is_dir())
+    except OSError:
+        return None
+    _dir_listing_cache[path] = (mtime, names)
+    return names
+
+
+class PathResolver:
+    """Resolves flasher_args.json entries against one listing per candidate directory.
+
+    Each entry is tried, in order, as given (relative to the CWD), relative
+    to the JSON, by name in the JSON directory, and the same two under
+    build/. Every directory involved is listed once (see list_directory)
+    and candidates are looked up in the listings instead of being stat'ed.
+    """
+
+    def __init__(self, config_dir):
+        self.config_dir = config_dir
+        self.listings = {}  # directory -> file names (None if missing)
+
+    def candidates(self, rel_path):
+        name = os.path.basename(rel_path)
+        return [
+            os.path.abspath(rel_path),  # Ruta absoluta directa
+            os.path.normpath(os.path.join(self.config_dir, rel_path)),  # Relativa al JSON
+            os.path.join(self.config_dir, name),  # Solo el nombre en dir JSON
+            os.path.abspath(os.path.join('build', rel_path)),  # En directorio build
+            os.path.abspath(os.path.join('build', name)),  # Nombre en build
+        ]
+
+    def exists(self, path):
+        directory, name = os.path.split(os.path.normpath(path))
+        if directory not in self.listings:
+            self.listings[directory] = list_directory(directory)
+        names = self.listings[directory]
+        return names is not None and os.path.normcase(name) in names
+
+    def resolve(self, rel_path):
+        """Return the normalized path of the first existing candidate, or None."""
+        if not rel_path or not isinstance(rel_path, str):
+            return None
+        for path in self.candidates(rel_path):
+            if self.exists(path):
+                return os.path.normpath(path)
+        return None
+
+
+def resolve_file_path(rel_path, config_dir):
+    """Resolves file paths using multiple fallback strategies."""
+    return PathResolver(config_dir).resolve(rel_path)
+
+
+def parse_flasher_args(json_path, on_missing=None, require_all=False):
+    """Processes flasher_args.json files with a variable structure and robust path handling.
+
+    Args:
+        on_missing: Optional callback called once with the list of
+            MissingFile entries whose file cannot be found.
+        require_all: Raise MissingFilesError (after on_missing) instead of
+            dropping entries whose file cannot be found.
+
+    Returns:
+        tuple: (flash_files, write_flash_args, extra_esptool_args)
+
+    Raises:
+        ValueError: If the JSON is invalid or no file can be resolved.
+        MissingFilesError: With require_all, if any entry cannot be resolved.
+    """
+    config_dir = os.path.dirname(os.path.abspath(json_path))
+
+    # Carga y validación básica del JSON
+    with open(json_path, 'r') as f:
+        try:
+            config_data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Inavlid JSON File: {str(e)}")
+
+    if not isinstance(config_data, dict):
+        raise ValueError("JSON File does not have valid parameters")
+
+    resolver = PathResolver(config_dir)
+    missing = []
+
+    def report_missing(rel_path, context):
+        searched = resolver.candidates(rel_path) if isinstance(rel_path, str) and rel_path else []
+        searched = list(dict.fromkeys(searched))
+        missing.append(MissingFile(rel_path, context, searched))
+
+    # Procesamiento dinámico de flash_files
+    processed_files = {}
+
+    # Caso 1: Estructura con flash_files directo
+    if 'flash_files' in config_data and isinstance(config_data['flash_files'], dict):
+        for offset, rel_path in config_data['flash_files'].items():
+            if not isinstance(offset, str) or not offset.startswith('0x'):
+                continue
+
+            abs_path = resolver.resolve(rel_path)
+            if abs_path:
+                processed_files[offset] = abs_path
+            else:
+                report_missing(rel_path, offset)
+
+    # Caso 2: Estructura modular (bootloader, app, partition-table)
+    for section in ['bootloader', 'app', 'partition-table', 'ota_data', 'nvs']:
+        if section in config_data and isinstance(config_data[section], dict):
+            section_data = config_data[section]
+            offset = section_data.get('offset')
+            rel_path = section_data.get('file')
+
+            if offset and rel_path and isinstance(offset, str) and offset.startswith('0x'):
+                abs_path = resolver.resolve(rel_path)
+                if abs_path:
+                    processed_files[offset] = abs_path
+                else:
+                    report_missing(rel_path, f"{section} ({offset})")
+
+    # Un único aviso con todas las entradas sin resolver
+    if missing and on_missing:
+        on_missing(missing)
+    if missing and require_all:
+        raise MissingFilesError(missing)
+
+    # Validación de archivos mínimos requeridos
+    if not processed_files:
+        raise ValueError("No valid files found for flashing")
+
+    # Manejo de parámetros de flasheo con valores por defecto
+    write_flash_args = config_data.get(
+        'write_flash_args',
+        DEFAULT_FLASH_PARAMS["write_flash_args"].copy()
+    )
+    extra_esptool_args = config_data.get('extra_esptool_args', {})
+    return processed_files, write_flash_args, extra_esptool_args
+
+
+class ESPFlashCore:
+    """Flashing state and operations shared by the Tk application and the CLI.
+
+    Holds the loaded flash files and esptool arguments and knows how to
+    flash one port with them. It never touches Tk or shows dialogs: output
+    goes through `on_line` callbacks and errors are raised or returned.
+    """
+
+    def __init__(self):
+        self.flash_files = {}
+        self.extra_esptool_args = {}
+        self.write_flash_args = []
+        self.use_inprocess_esptool = True  # Run esptool without a new interpreter
+        self.delta_flash = False  # Skip regions already on the board
+        self.merged_flash = False  # One compressed stream of merged regions per board
+        self.merged_cache = {}  # Bundle key -> list of MergedSegment (shared between boards)
+        self.merged_lock = threading.Lock()
+        self.payload_cache = PayloadCache()
+        self.bundle = None  # FirmwareBundle of flash_files, mapped at load
+        self.bundle_archive = None  # BundleArchive the files were extracted from
+        self.bundle_views = {}  # Extracted path -> archive member memoryview
+        self.bundle_temp_dir = None
+        self.port_enumerator = CachedPortEnumerator()
+        self.baud_profiles = BaudProfiles()
+
+    def load_flasher_args(self, json_path, on_missing=None):
+        """Load flash files and esptool arguments from a flasher_args.json.
+
+        Raises:
+            MissingFilesError: If any entry's file cannot be found (the
+                bundle is not loaded; `on_missing` still gets the report).
+            BundleError: If the files cannot be mapped or overlap.
+        """
+        self.flash_files, self.write_flash_args, self.extra_esptool_args = \
+            parse_flasher_args(json_path, on_missing, require_all=True)
+        self.close_bundle()
+        self.open_bundle()
+        self.precompress_async()
+
+    def load_bundle_archive(self, archive_path):
+        """Load a single-file bundle (see BundleArchive) instead of a flasher_args.json.
+
+        Members are verified and served from the archive mapping; copies are
+        written to a temp folder only for esptool, which takes file names.
+
+        Raises:
+            BundleError: If the archive or its layout is invalid.
+        """
+        archive = BundleArchive(archive_path)
+        self.close_bundle()
+        self.bundle_temp_dir = tempfile.mkdtemp(prefix="espflash_bundle_")
+        try:
+            self.flash_files, self.bundle_views = archive.extract(self.bundle_temp_dir)
+            self.bundle_archive = archive
+            self.write_flash_args = list(archive.manifest.get(
+                "write_flash_args", DEFAULT_FLASH_PARAMS["write_flash_args"]))
+            self.extra_esptool_args = dict(archive.manifest.get("extra_esptool_args", {}))
+            self.open_bundle()
+        except BaseException:
+            self.close_bundle()
+            archive.close()
+            self.flash_files = {}  # Las copias temporales ya no existen
+            raise
+        self.precompress_async()
+        return archive.manifest
+
+    def open_bundle(self):
+        """Map and validate the current flash_files, replacing the previous bundle.
+
+        Raises:
+            BundleError: If a file is missing, empty, overlapping or beyond --flash_size.
+        """
+        if self.bundle is not None:
+            self.bundle.close()
+            self.bundle = None
+        self.bundle = FirmwareBundle(self.flash_files, self.write_flash_args, self.bundle_views)
+        return self.bundle
+
+    def get_bundle(self):
+        """Return the bundle of the current flash_files, reopening it if they changed."""
+        if self.bundle is None or self.bundle.flash_files != self.flash_files:
+            return self.open_bundle()
+        return self.bundle
+
+    def close_bundle(self):
+        """Unmap the loaded files and drop a loaded bundle archive and its temp copies."""
+        if self.bundle is not None:
+            self.bundle.close()
+            self.bundle = None
+        self.bundle_views = {}
+        if self.bundle_archive is not None:
+            self.bundle_archive.close()
+            self.bundle_archive = None
+        if self.bundle_temp_dir:
+            shutil.rmtree(self.bundle_temp_dir, ignore_errors=True)
+            self.bundle_temp_dir = None
+
+    def set_merged_flash(self, enabled):
+        """Turn merged flashing on or off; turning it on precompresses the loaded bundle."""
+        self.merged_flash = enabled
+        if enabled:
+            self.precompress_async()
+
+    def precompress_async(self):
+        """Build the merged, compressed payload of the loaded bundle in the background.
+
+        Only in merged mode, the one that uses it. Boards flashed later take
+        the ready blocks from the cache; one that starts before it finishes
+        waits on the cache lock. The thread gets the current bundle: a
+        reload meanwhile closes it and the precompression is dropped.
+        """
+        bundle = self.bundle
+        if (not self.merged_flash or bundle is None
+                or self.extra_esptool_args.get("chip", "esp32") == "auto"):
+            return
+        flash_items = list(bundle.flash_files.items())
+
+        def run():
+            if load_esptool() is None:
+                return
+            try:
+                self.merged_payload(flash_items, lambda line: None, bundle)
+            except Exception:
+                pass  # Se repite (y se informa) al flashear
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def get_esptool_invocation(self):
+        """Return the interpreter + esptool.py prefix used to launch esptool."""
+        # Obtener la ruta correcta de esptool.py
+        if getattr(sys, 'frozen', False):
+            # Si la aplicación está empaquetada con PyInstaller
+            base_path = sys._MEIPASS
+        else:
+            # Si la aplicación se ejecuta desde el código fuente
+            base_path = os.path.dirname(os.path.abspath(__file__))
+
+        esptool_path = os.path.join(base_path, "esptool_py", "esptool", "esptool.py")
+
+        if getattr(sys, 'frozen', False):
+            python_exec = sys.executable  # Usa el Python embebido
+        else:
+            python_exec = "python"
+
+        return [python_exec, esptool_path]
+
+    def get_subprocess_options(self):
+        """Return Popen keyword arguments that hide the console window on Windows."""
+        # Configurar parámetros para ocultar la ventana en Windows
+        startupinfo = None
+        creationflags = 0
+        if sys.platform.startswith('win'):
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+            startupinfo.wShowWindow = subprocess.SW_HIDE
+            creationflags = subprocess.CREATE_NO_WINDOW
+        else:  # Configuración para Linux
+            # Asegurar que esptool está en el PATH del entorno empaquetado
+            if getattr(sys, 'frozen', False):
+                esptool_dir = os.path.join(sys._MEIPASS, "esptool")
+                if esptool_dir not in os.environ["PATH"].split(os.pathsep):
+                    os.environ["PATH"] += os.pathsep + esptool_dir
+
+        return {"startupinfo": startupinfo, "creationflags": creationflags}
+
+    def run_esptool(self, args, on_line):
+        """Run esptool with `args`, calling `on_line` for each output line.
+
+        Uses the in-process backend when enabled and esptool is importable,
+        otherwise falls back to launching esptool.py in a subprocess.
+
+        Returns:
+            int: esptool return code.
+        """
+        if self.use_inprocess_esptool and load_esptool() is not None:
+            return run_esptool_inprocess(args, on_line)
+
+        process = subprocess.Popen(
+            self.get_esptool_invocation() + list(args),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            universal_newlines=True,
+            bufsize=1,
+            **self.get_subprocess_options()
+        )
+        for line in process.stdout:
+            on_line(line)
+        return process.wait()
+
+    def build_flash_command(self, port, baudrate, flash_items=None):
+        """Build the esptool write_flash arguments for one port.
+
+        Args:
+            flash_items: Optional list of (offset, file) pairs to write instead
+                of self.flash_files (used by delta flashing).
+        """
+        # Construir el comando base
+        cmd = [
+            "-p", port,
+            "-b", str(baudrate),
+            "--before", self.extra_esptool_args.get("before", "default_reset"),
+            "--after", self.extra_esptool_args.get("after", "hard_reset"),
+            "--chip", self.extra_esptool_args.get("chip", "esp32"),
+            "write_flash"
+        ]
+        cmd.extend(self.write_flash_args)
+
+        # Agregar los archivos de flash con sus offsets
+        if flash_items is None:
+            flash_items = self.flash_files.items()
+        for offset, file in flash_items:
+            cmd.extend([offset, file])
+        return cmd
+
+    def port_info(self, port):
+        """Return the ListPortInfo of device `port`, or None if it is not listed."""
+        return next((info for info in self.port_enumerator() if info.device == port), None)
+
+    def resolve_baud(self, port, baudrate, on_line):
+        """Replace AUTO_BAUD with the calibrated rate of the adapter on `port`."""
+        if str(baudrate).lower() != AUTO_BAUD.lower():
+            return baudrate
+        baud = self.baud_profiles.get(self.port_info(port))
+        if baud is None:
+            on_line(f"No baud profile for {port}, using {DEFAULT_FLASH_BAUD}\n")
+            return DEFAULT_FLASH_BAUD
+        on_line(f"Using calibrated baud {baud} for {port}\n")
+        return baud
+
+    def calibrate_baud(self, port, on_line, bauds=CALIBRATION_BAUDS):
+        """Find the highest baud at which the adapter on `port` moves data without errors.
+
+        From the fastest candidate down, reads CALIBRATION_READ_BYTES of flash
+        CALIBRATION_PASSES times (the stub checks each read's MD5); the first
+        rate that passes is saved in baud_profiles. Nothing is written.
+
+        Returns:
+            int: The calibrated baud, or None if every rate failed.
+        """
+        info = self.port_info(port)
+        temp_fd, temp_path = tempfile.mkstemp(prefix="espflash_cal_", suffix=".bin")
+        os.close(temp_fd)
+        cmd_prefix = [
+            "-p", port,
+            "--before", self.extra_esptool_args.get("before", "default_reset"),
+            "--after", "no_reset",
+            "--chip", self.extra_esptool_args.get("chip", "auto"),
+        ]
+        try:
+            for baud in bauds:
+                on_line(f"Trying {baud} baud...\n")
+                for attempt in range(CALIBRATION_PASSES):
+                    output = []
+                    cmd = cmd_prefix + ["-b", str(baud), "read_flash", "0", hex(CALIBRATION_READ_BYTES), temp_path]
+                    if self.run_esptool(cmd, output.append) != 0:
+                        errors = [line.strip() for line in output if "error" in line.lower()]
+                        detail = errors[-1] if errors else "".join(output[-1:]).strip()
+                        on_line(f"  {baud} baud failed: {detail}\n")
+                        if any("could not open" in line.lower() for line in output):
+                            return None  # El puerto no abre: ningún baud va a funcionar
+                        break
+                else:
+                    on_line(f"  {baud} baud OK\n")
+                    if BaudProfiles.key_for(info):
+                        self.baud_profiles.set(info, baud)
+                        on_line(f"Saved for adapter {BaudProfiles.key_for(info)}\n")
+                    else:
+                        on_line("Port has no USB VID:PID, rate not saved\n")
+                    return baud
+            return None
+        finally:
+            os.remove(temp_path)
+
+    def plan_delta_flash(self, port, temp_dir, on_line):
+        """Hash every region on the device and keep only what changed.
+
+        Regions whose flash MD5 already matches are skipped; the bootloader
+        is compared with the header write_flash would write (--flash_mode/
+        freq/size applied). Changed regions are reduced to their changed 4 KB
+        sectors, written as slices into `temp_dir`. A changed bootloader is
+        rewritten whole because esptool patches its header while writing.
+
+        Returns:
+            list: (offset, file) pairs to write; empty if the board is up to date.
+        """
+        esptool = load_esptool()
+        if esptool is None:
+            raise RuntimeError("Delta flash needs the esptool package (in-process backend)")
+
+        sys.stdout.local.stream = sys.stderr.local.stream = LineStream(on_line)
+        esp = None
+        try:
+            esp = esptool.cmds.detect_chip(
+                port, esptool.ESPLoader.ESP_ROM_BAUD,
+                esptool_option(self.extra_esptool_args.get("before", "default_reset")))
+            if self.extra_esptool_args.get("stub", True) is not False:
+                esp = esp.run_stub()
+
+            chip = self.extra_esptool_args.get("chip", "auto")
+            if chip == "auto":
+                chip = esp.CHIP_NAME.lower().replace("-", "")
+            items = []
+            for offset, path in self.flash_files.items():
+                region_start = int(offset, 0)
+                digests = file_digests(path)
+                name = os.path.basename(path)
+                expected_md5 = digests["md5"]
+                if region_start == esp.BOOTLOADER_FLASH_OFFSET:
+                    patched = patch_bootloader_params(
+                        chip, digests["data"], *bootloader_flash_settings(self.write_flash_args))
+                    expected_md5 = hashlib.md5(patched).hexdigest()
+                if esp.flash_md5sum(region_start, len(digests["data"])) == expected_md5:
+                    on_line(f"{offset} {name}: unchanged, skipped\n")
+                    continue
+
+                ranges = changed_sector_ranges(esp, region_start, digests)
+                if (region_start == esp.BOOTLOADER_FLASH_OFFSET
+                        or region_start % FLASH_SECTOR_SIZE
+                        or not ranges):
+                    on_line(f"{offset} {name}: changed, rewriting region\n")
+                    items.append((offset, path))
+                    continue
+
+                changed_bytes = sum(end - start for start, end in ranges)
+                on_line(f"{offset} {name}: {changed_bytes // 1024} KB in "
+                        f"{len(ranges)} range(s) changed\n")
+                for start, end in ranges:
+                    slice_path = os.path.join(temp_dir, f"{region_start + start:#010x}.bin")
+                    with open(slice_path, "wb") as f:
+                        f.write(digests["data"][start:end])
+                    items.append((hex(region_start + start), slice_path))
+
+            if not items and self.extra_esptool_args.get("after", "hard_reset") == "hard_reset":
+                esp.hard_reset()
+            return items
+        finally:
+            if esp is not None:
+                esp._port.close()
+            sys.stdout.local.stream = sys.stderr.local.stream = None
+
+    def merged_payload(self, flash_items, on_line, bundle=None):
+        """Merge and compress the regions to write, reusing the result between boards.
+
+        Keyed by file identity (path, size, mtime), write_flash settings and
+        chip, so gang workers and later boards share one compression. The
+        data comes from `bundle` (default: the bundle of flash_files).
+
+        Returns:
+            list: MergedSegment entries.
+        """
+        chip = self.extra_esptool_args.get("chip", "esp32")
+        settings = bootloader_flash_settings(self.write_flash_args)
+        if write_flash_setting(self.write_flash_args, "size") == "detect":
+            on_line("--flash_size detect: the bootloader keeps the flash size it was built with\n")
+        files = []
+        for offset, path in flash_items:
+            stat = os.stat(path)
+            files.append((int(offset, 0), path, stat.st_size, stat.st_mtime_ns))
+        key = (chip, settings, tuple(files))
+
+        with self.merged_lock:
+            segments = self.merged_cache.get(key)
+            if segments is not None:
+                on_line(f"Merged image: {len(segments)} segment(s) from cache\n")
+                return segments
+
+            started = time.perf_counter()
+            bootloader_offset = load_esptool().targets.CHIP_DEFS[chip].BOOTLOADER_FLASH_OFFSET
+            if bundle is None:
+                bundle = self.get_bundle()
+            bundle.check_unchanged()
+            digests = bundle.digests()
+            with bundle.mapped():
+                regions = []
+                known_md5 = {}  # Regiones sin modificar: MD5 ya calculado por el bundle
+                for address, path, _, _ in files:
+                    data = bundle.view(path)
+                    if data is None:
+                        data = file_digests(path)["data"]  # Rangos temporales del modo delta
+                    elif path in digests:
+                        known_md5[address, len(data)] = digests[path]["md5"]
+                    if address == bootloader_offset:
+                        patched = patch_bootloader_params(chip, data, *settings)
+                        if patched is not data:
+                            known_md5.pop((address, len(data)), None)
+                            data = patched
+                    regions.append((address, data))
+                misses = self.payload_cache.misses
+                segments = [
+                    MergedSegment(address, len(data),
+                                  known_md5.get((address, len(data))) or hashlib.md5(data).hexdigest(),
+                                  self.payload_cache.get(data, MERGE_COMPRESS_LEVEL))
+                    for address, data in build_merged_segments(regions)
+                ]
+            compressed_now = self.payload_cache.misses - misses
+            while len(self.merged_cache) >= MERGED_CACHE_ENTRIES:
+                self.merged_cache.pop(next(iter(self.merged_cache)))
+            self.merged_cache[key] = segments
+
+        size = sum(segment.size for segment in segments)
+        compressed = sum(len(segment.payload) for segment in segments)
+        on_line(f"Merged image: {len(files)} region(s) in {len(segments)} segment(s), "
+                f"{size} -> {compressed} bytes ({len(segments) - compressed_now} precompressed) "
+                f"in {time.perf_counter() - started:.2f} s\n")
+        return segments
+
+    def flash_port_merged(self, port, baudrate, on_line, flash_items=None):
+        """Write the regions as one merged, precompressed stream (in-process esptool).
+
+        The board gets the same checks as write_flash first (see
+        check_merged_target).
+
+        Returns:
+            int: Process-style return code, like run_esptool_inprocess, or
+            None if the checks cannot be done on this board: nothing was
+            written and the caller flashes with write_flash instead.
+        """
+        esptool = load_esptool()
+        if flash_items is None:
+            flash_items = list(self.flash_files.items())
+
+        sys.stdout.local.stream = sys.stderr.local.stream = stream = LineStream(on_line)
+        esp = None
+        try:
+            segments = self.merged_payload(flash_items, on_line)
+            esp = esptool.cmds.detect_chip(
+                port, esptool.ESPLoader.ESP_ROM_BAUD,
+                esptool_option(self.extra_esptool_args.get("before", "default_reset")))
+            reason = check_merged_target(esp, self.extra_esptool_args.get("chip", "esp32"),
+                                         flash_items, self.write_flash_args)
+            if reason:
+                on_line(f"Merged image not possible: {reason}, flashing regions separately\n")
+                return None
+            esp = esp.run_stub()
+            if int(baudrate) != esptool.ESPLoader.ESP_ROM_BAUD:
+                esp.change_baud(int(baudrate))
+            esp.flash_spi_attach(0)
+            flash_size = write_flash_setting(self.write_flash_args, "size")
+            if flash_size not in ("keep", "detect"):
+                esp.flash_set_parameters(esptool.util.flash_size_bytes(flash_size))
+
+            write_merged_segments(esp, segments, on_line)
+            if self.extra_esptool_args.get("after", "hard_reset") == "hard_reset":
+                on_line("Hard resetting via RTS pin...\n")
+                esp.hard_reset()
+            return 0
+        except esptool.FatalError as e:
+            stream.write(f"\nA fatal error occurred: {e}\n")
+            return 2
+        except (serial.SerialException, RuntimeError, ValueError, OSError, BundleError) as e:
+            stream.write(f"\n{e}\n")
+            return 1
+        finally:
+            stream.close()
+            if esp is not None:
+                esp._port.close()
+            sys.stdout.local.stream = sys.stderr.local.stream = None
+
+    def flash_port(self, port, baudrate, on_line):
+        """Flash the loaded files to one port, honouring delta and merged flash modes.
+
+        Returns:
+            int: esptool return code.
+        """
+        temp_dir = None
+        flash_items = None
+        baudrate = self.resolve_baud(port, baudrate, on_line)
+        try:
+            if self.delta_flash:
+                temp_dir = tempfile.mkdtemp(prefix="espflash_delta_")
+                try:
+                    flash_items = self.plan_delta_flash(port, temp_dir, on_line)
+                except Exception as e:
+                    # Si falla la comparación se escribe todo como antes
+                    on_line(f"Delta check failed ({e}), flashing all regions\n")
+                    flash_items = None
+                if flash_items == []:
+                    on_line("All regions up to date, nothing to write\n")
+                    return 0
+
+            if self.merged_flash:
+                if load_esptool() is None or self.extra_esptool_args.get("chip", "esp32") == "auto":
+                    on_line("Merged image needs the esptool package and a known chip, "
+                            "flashing regions separately\n")
+                else:
+                    returncode = self.flash_port_merged(port, baudrate, on_line, flash_items)
+                    if returncode is not None:
+                        return returncode
+
+            cmd = self.build_flash_command(port, baudrate, flash_items)
+            on_line("Command: esptool " + " ".join(cmd) + "\n\n")
+            return self.run_esptool(cmd, on_line)
+        finally:
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+
+    def check_flash_images(self):
+        """Validate app/bootloader images in flash_files against the target chip.
+
+        The bundle layout (see FirmwareBundle) is checked first. Files that
+        do not start with the image magic (partition table, ota data...) are
+        skipped; an image that cannot be parsed is reported as corrupted.
+
+        Returns:
+            str: Error message, or None if every image looks valid.
+        """
+        try:
+            self.get_bundle().check_unchanged()
+        except BundleError as e:
+            return str(e)
+
+        chip = self.extra_esptool_args.get("chip", "esp32")
+        for offset, path in self.flash_files.items():
+            name = os.path.basename(path)
+            try:
+                image = parse_app_image(path)
+            except ValueError as e:
+                # Solo se ignoran los que no son imágenes; una 0xE9 que no se
+                # puede leer entera está truncada o dañada
+                try:
+                    with open(path, "rb") as f:
+                        is_image = f.read(1) == bytes([ESP_IMAGE_MAGIC])
+                except OSError as read_error:
+                    return f"Cannot read {path}: {read_error}"
+                if is_image:
+                    return f"{name} ({offset}) is corrupted or truncated: {e}"
+                continue
+            except OSError as e:
+                return f"Cannot read {path}: {e}"
+            expected = ESP_IMAGE_CHIP_IDS.get(chip)
+            if expected is not None and image.chip_id != expected:
+                return f"{name} ({offset}) is built for {image.chip or image.chip_id}, not {chip}"
+            if not image.checksum_valid or (image.hash_appended and not image.digest_valid):
+                return f"{name} ({offset}) is corrupted (checksum/SHA-256 mismatch)"
+        return None
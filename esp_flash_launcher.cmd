@@ -0,0 +1,29 @@
+@echo off
+rem Starts the one-dir build (esp_flash_toolv2_onedir.spec) from a local copy.
+rem The folder next to this script (e.g. on a network share) is copied to
+rem %LOCALAPPDATA% only when the build changes; later launches reuse it.
+setlocal
+set "SRC=%~dp0esp_flash_toolv2"
+set "DST=%LOCALAPPDATA%\ESPFlashTool\esp_flash_toolv2"
+
+if not exist "%SRC%\esp_flash_toolv2.exe" (
+    echo esp_flash_toolv2 folder not found next to %~nx0
+    exit /b 1
+)
+
+rem Build stamp: size and timestamp of the exe
+for %%F in ("%SRC%\esp_flash_toolv2.exe") do set "STAMP=%%~zF %%~tF"
+set "OLD="
+if exist "%DST%\.build_stamp" set /p OLD=<"%DST%\.build_stamp"
+
+if not "%OLD%"=="%STAMP%" (
+    robocopy "%SRC%" "%DST%" /MIR /NFL /NDL /NJH /NJS /NP >nul
+    if errorlevel 8 (
+        rem Copy failed: run from the original folder
+        start "" "%SRC%\esp_flash_toolv2.exe" %*
+        exit /b 0
+    )
+    >"%DST%\.build_stamp" echo %STAMP%
+)
+
+start "" "%DST%\esp_flash_toolv2.exe" %*
@@ -1,55 +1,103 @@
+import time
+STARTUP_T0 = time.perf_counter()  # Antes de cualquier import: mide el arranque completo
+
 import os
-import json
-import subprocess
+import sys
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk, simpledialog, scrolledtext
-import serial.tools.list_ports
 import threading
 import serial
-import re, subprocess, tempfile
-import csv
-import sys
-import time
-import detools, shutil 
-
-
-
-
-# Default flash parameters as specified
-DEFAULT_FLASH_PARAMS = {
-    "write_flash_args": ["--flash_mode", "dio",
-                        "--flash_size", "10MB",
-                        "--flash_freq", "80m"],
-    "flash_settings": {
-        "flash_mode": "dio",
-        "flash_size": "10MB",
-        "flash_freq": "80m"
-    }
-}
-
-class ESPFlashTool:
-    def __init__(self, root):
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+from esp_flash_core import (
+    DEFAULT_FLASH_PARAMS, FLASH_PROGRESS_RE, MAX_GANG_WORKERS, MONITOR_BAUDRATE,
+    ESP_DELTA_OTA_MAGIC, MAGIC_SIZE, DIGEST_SIZE, RESERVED_HEADER, PATCH_MANIFEST_NAME,
+    ESPFlashCore, MfgRecordWriter, PatchCache, PatchError, SerialMonitor,
+    build_ota_patch, copy_file_atomic, generate_patch_matrix, optimize_ota_patch,
+    optimized_patch_cache_label, reset_board, load_esptool,
+    KNOWN_ESP_USB_IDS, PortWatcher, StationSlots, AUTO_BAUD, BUNDLE_ARCHIVE_EXT, MissingFilesError,
+)
+
+# Flash output is queued by the worker and drained by the GUI every UI_POLL_MS
+FLASH_QUEUE_SIZE = 1000
+UI_POLL_MS = 100
+
+# Serial monitor widget: lines kept in the widget, refresh period
+MONITOR_WIDGET_MAX_LINES = 3000
+MONITOR_REFRESH_MS = 250
+
+# Auto-flash: ignore a board that reappears this soon after any flash
+# (manual, gang or auto: the hard reset re-enumerates native USB boards)
+AUTO_FLASH_COOLDOWN_S = 15
+
+# Startup: time until the window is painted, excluding the CSV prompt.
+# Report printed with --startup-report or ESPFLASH_STARTUP_REPORT=1, or
+# appended to the file named by ESPFLASH_STARTUP_REPORT (windowed builds).
+# ESPFLASH_BENCHMARK=1 skips the prompts and exits after the first paint.
+STARTUP_BUDGET_MS = 800
+
+class ESPFlashTool(ESPFlashCore):
+    def __init__(self, root, startup_marks=None):
+        super().__init__()
+        self.startup_marks = startup_marks if startup_marks is not None else []
+        self.benchmark_startup = bool(os.environ.get("ESPFLASH_BENCHMARK"))
         self.root = root
         self.root.title("ESP Flash Tool")
         self.root.geometry("605x595")
 
         self.port_var = tk.StringVar()
         self.port_var.trace_add('write', self.update_disconnect_button_state)
-        self.baudrate_var = tk.StringVar(value="460800")
+        self.port_var.trace_add('write', self.remember_selected_slot)
+        self.station_slots = StationSlots()  # Hub position -> station slot (persistent)
+        self.port_slots = {}  # Device -> slot of the ports currently listed
+        self.selected_slot = None  # Slot followed by the port selection across re-enumeration
+        self.monitor_slot = None  # Slot of the monitored board, to resume after a reconnect
+        self.baudrate_var = tk.StringVar(value=AUTO_BAUD)  # Auto: calibrated rate of the adapter
+        # Opciones del core (ESPFlashCore) reflejadas en checkboxes
+        self.inprocess_esptool_var = tk.BooleanVar(value=self.use_inprocess_esptool)
+        self.inprocess_esptool_var.trace_add(
+            'write', lambda *args: setattr(self, 'use_inprocess_esptool', self.inprocess_esptool_var.get()))
+        self.delta_flash_var = tk.BooleanVar(value=self.delta_flash)
+        self.delta_flash_var.trace_add(
+            'write', lambda *args: setattr(self, 'delta_flash', self.delta_flash_var.get()))
+        self.merged_flash_var = tk.BooleanVar(value=self.merged_flash)
+        self.merged_flash_var.trace_add(
+            'write', lambda *args: self.set_merged_flash(self.merged_flash_var.get()))
         self.flash_args = {}
-        self.flash_files = {}
-        self.extra_esptool_args = {}
-        self.write_flash_args = []
         self.json_data = None  # Initialize json_data
         self.csv_file_path = None  # Path to the CSV file selected by the user
+        self.record_writer = MfgRecordWriter()  # Persists mfg records in the background
+        self.record_status_var = tk.StringVar(value="")
+        self.record_error_shown = False
         self.custom_files = []  # Stores tuples of (filepath, offset)
         self.monitoring = False
         self.serial_connection = None  
         self.serial_running = False 
-        self.ESP_DELTA_OTA_MAGIC = 0xfccdde10  # <--- ¡Mayúsculas!
-        self.MAGIC_SIZE = 4
-        self.DIGEST_SIZE = 32
-        self.RESERVED_HEADER = 64 - (self.MAGIC_SIZE + self.DIGEST_SIZE)
+        self.serial_monitor = None  # SerialMonitor while "Start Monitoring" is active
+        self.gang_executor = None  # Worker pool for multi-port flashing
+        self.flash_thread = None  # Worker thread for single-port flashing
+        self.flash_thread_port = None  # Port of flash_thread's job
+        self.flash_status_var = tk.StringVar(value="Idle")
+        self.monitor_max_lines_var = tk.StringVar(value=str(MONITOR_WIDGET_MAX_LINES))
+        self.gang_pending = set()  # Ports with a gang flash job still running
+        # Hotplug: el hilo del watcher encola cambios, la GUI los aplica con root.after
+        self.port_map = {}
+        self.port_events = queue.Queue()
+        # self.port_enumerator (ESPFlashCore) is shared by refresh_ports and the watcher
+        self.port_watcher = PortWatcher(lambda *change: self.port_events.put(change), self.port_enumerator)
+        self.auto_flash_var = tk.BooleanVar(value=False)
+        self.auto_flash_executor = None
+        self.auto_flash_queue = queue.Queue()
+        self.auto_flash_pending = set()  # Ports with an auto-flash job running
+        self.auto_flash_done = {}  # Board key -> time.monotonic() when its last flash finished
+        self.flash_job_keys = {}  # Port -> board key of every running job (manual, gang, auto)
+        self.ESP_DELTA_OTA_MAGIC = ESP_DELTA_OTA_MAGIC  # <--- ¡Mayúsculas!
+        self.MAGIC_SIZE = MAGIC_SIZE
+        self.DIGEST_SIZE = DIGEST_SIZE
+        self.RESERVED_HEADER = RESERVED_HEADER
+        self.patch_cache = PatchCache()
+        self.optimize_patch_var = tk.BooleanVar(value=False)
 
         self.chip_var = tk.StringVar(value="esp32c6")
 
@@ -60,10 +108,46 @@ class ESPFlashTool:
         self.new_binary_full = ""
 
         # Ask the user for the CSV file path at startup
-        self.set_csv_file_path()
+        self.startup_marks.append(("init", time.perf_counter()))
+        if not self.benchmark_startup:
+            self.set_csv_file_path()
+        self.startup_marks.append(("csv prompt", time.perf_counter()))
 
         self.create_widgets()
+        self.startup_marks.append(("widgets", time.perf_counter()))
         self.refresh_ports()  # Refresh ports on startup
+        self.startup_marks.append(("ports", time.perf_counter()))
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.poll_record_results()
+        self.root.after_idle(self.finish_startup)
+
+    def finish_startup(self):
+        """First idle after the window is drawn: report timings, then warm esptool."""
+        self.startup_marks.append(("first paint", time.perf_counter()))
+        lines, total_ms = startup_report(self.startup_marks)
+        report_target = os.environ.get("ESPFLASH_STARTUP_REPORT", "")
+        if report_target == "1" or (not report_target and "--startup-report" in sys.argv):
+            print("\n".join(lines))
+        elif report_target:
+            try:
+                with open(report_target, "a", encoding="utf-8") as f:
+                    f.write("\n".join(lines) + "\n")
+            except OSError as e:
+                print(f"Startup report not written: {e}")
+        if total_ms > STARTUP_BUDGET_MS:
+            self.monitor_output.insert(
+                tk.END, f"Startup took {total_ms:.0f} ms (budget {STARTUP_BUDGET_MS} ms)\n")
+
+        if self.benchmark_startup:
+            self.on_close()
+            return
+
+        self.port_watcher.start()
+        self.root.after(UI_POLL_MS, self.poll_port_events)
+
+        # Importar esptool en segundo plano: el primer "Flash" no espera al import
+        if self.use_inprocess_esptool:
+            threading.Thread(target=load_esptool, name="esptool-warmup", daemon=True).start()
 
 
     def create_widgets(self):
@@ -105,6 +189,11 @@ class ESPFlashTool:
             command=self.refresh_ports,
             width=18
         ).pack(pady=(0, 5))
+        ttk.Checkbutton(
+            port_buttons_frame,
+            text="Auto-flash new boards",
+            variable=self.auto_flash_var
+        ).pack(pady=(0, 5))
 
         #----------------------------------------------
         # Fila 2: Baudrate
@@ -116,12 +205,35 @@ class ESPFlashTool:
         self.baudrate_combobox = ttk.Combobox(
             baudrate_frame, 
             textvariable=self.baudrate_var, 
-            values=["9600", "19200", "38400", "57600", "115200", "230400", "460800", "921600"], 
+            values=[AUTO_BAUD, "9600", "19200", "38400", "57600", "115200", "230400", "460800", "921600",
+                    "1500000", "2000000"],
             width=8,
             state="readonly"
         )
         self.baudrate_combobox.pack(side=tk.LEFT)
-        self.baudrate_combobox.set("460800")
+        self.baudrate_combobox.set(AUTO_BAUD)
+        ttk.Button(
+            baudrate_frame,
+            text="Calibrate",
+            command=self.start_baud_calibration,
+            width=9
+        ).pack(side=tk.LEFT, padx=(5, 0))
+
+        ttk.Checkbutton(
+            baudrate_frame,
+            text="In-process esptool",
+            variable=self.inprocess_esptool_var
+        ).pack(side=tk.LEFT, padx=(20, 0))
+        ttk.Checkbutton(
+            baudrate_frame,
+            text="Delta flash",
+            variable=self.delta_flash_var
+        ).pack(side=tk.LEFT, padx=(10, 0))
+        ttk.Checkbutton(
+            baudrate_frame,
+            text="Merged image",
+            variable=self.merged_flash_var
+        ).pack(side=tk.LEFT, padx=(10, 0))
 
         #----------------------------------------------
         # Separador horizontal
@@ -167,11 +279,20 @@ class ESPFlashTool:
         action_frame = ttk.Frame(self.root)
         action_frame.grid(row=5, column=0, columnspan=3, padx=10, pady=10, sticky='ew')
 
-        ttk.Button(action_frame, text="Flash Device", command=self.flash_device).pack(side=tk.LEFT, padx=5)
+        self.flash_button = ttk.Button(action_frame, text="Flash Device", command=self.flash_device)
+        self.flash_button.pack(side=tk.LEFT, padx=5)
+        ttk.Button(action_frame, text="Gang Flash", command=self.open_gang_flash).pack(side=tk.LEFT, padx=5)
         ttk.Button(action_frame, text="Reset Device", command=self.reset_device).pack(side=tk.LEFT, padx=5)  # New button
         self.monitor_button = ttk.Button(action_frame, text="Start Monitoring", command=self.toggle_monitoring)
         self.monitor_button.pack(side=tk.LEFT, padx=5)
 
+        # Barra de progreso del flasheo
+        progress_frame = ttk.Frame(action_frame)
+        progress_frame.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.flash_progress = ttk.Progressbar(progress_frame, orient='horizontal', mode='determinate', maximum=100)
+        self.flash_progress.pack(side=tk.TOP, fill=tk.X, expand=True)
+        ttk.Label(progress_frame, textvariable=self.flash_status_var, font=('Consolas', 7)).pack(side=tk.TOP, anchor='w')
+
         #----------------------------------------------
         # Fila 6: Monitor Output (Ajuste clave)
         #----------------------------------------------
@@ -193,6 +314,11 @@ class ESPFlashTool:
                 command=self.clean_monitor).pack(side=tk.LEFT, padx=20)
         ttk.Button(bottom_frame, text="Reset App", 
                 command=self.reset_app).pack(side=tk.LEFT, padx=20)
+        self.record_status_label = ttk.Label(bottom_frame, textvariable=self.record_status_var)
+        self.record_status_label.pack(side=tk.RIGHT, padx=(20, 0))
+        ttk.Label(bottom_frame, text="Max lines:").pack(side=tk.LEFT, padx=(20, 5))
+        ttk.Spinbox(bottom_frame, from_=100, to=100000, increment=500,
+                textvariable=self.monitor_max_lines_var, width=7).pack(side=tk.LEFT)
 
         # Configuración de expansión (Ajuste clave)
         self.root.grid_rowconfigure(6, weight=1)  # Solo la fila del monitor se expande
@@ -232,7 +358,7 @@ class ESPFlashTool:
             
             # Resetear configuración
             self.port_var.set('')
-            self.baudrate_var.set('460800')
+            self.baudrate_var.set(AUTO_BAUD)
             self.refresh_ports()
             
             # Limpiar monitor
@@ -247,29 +373,150 @@ class ESPFlashTool:
     def refresh_ports(self):
         """Refresh the list of available ports with detailed info."""
         self.port_map = {}  # Diccionario para mapear texto -> nombre real del puerto
+        self.port_slots = {}
         port_info = []
         
-        for port in serial.tools.list_ports.comports():
-            # Obtener información detallada
-            device = port.device
-            desc = port.description.split("(")[0].strip() if port.description else "Unknown"
-            serial_num = port.serial_number if port.serial_number else ""
-            
-            # Formato compacto para el Combobox
-            display_text = f"{device} - {desc}"
-            if serial_num:
-                display_text += f" ({serial_num})"
-            
+        for port in self.port_enumerator():
+            display_text = self.port_display_text(port)
             port_info.append(display_text)
-            self.port_map[display_text] = device  # Mapeo al nombre real
+            self.port_map[display_text] = port.device  # Mapeo al nombre real
 
         self.port_combobox['values'] = port_info
         self.port_combobox.config(width=40)  # Aumentar ancho para mejor visualización
         
         # Solo mostrar advertencia si no hay puertos, no seleccionar automáticamente
-        if not port_info:
+        if not port_info and not self.benchmark_startup:
             messagebox.showwarning("No Ports", "No serial ports detected")
                 
+    def port_display_text(self, port):
+        """Compact combobox text for a ListPortInfo: slot, device, description, serial.
+
+        Also records the port's station slot in port_slots.
+        """
+        slot = self.station_slots.slot_for(port)
+        self.port_slots[port.device] = slot
+        desc = port.description.split("(")[0].strip() if port.description else "Unknown"
+        display_text = f"{port.device} - {desc}"
+        if port.serial_number:
+            display_text += f" ({port.serial_number})"
+        if slot is not None:
+            display_text = f"[{slot}] {display_text}"
+        return display_text
+
+    def remember_selected_slot(self, *args):
+        """Track the slot behind the selected port (only for listed ports)."""
+        device = self.port_map.get(self.port_var.get())
+        if device is not None:
+            self.selected_slot = self.port_slots.get(device)
+
+    def poll_port_events(self):
+        """Apply hotplug changes queued by the port watcher (Tk thread)."""
+        while True:
+            try:
+                added, removed, initial = self.port_events.get_nowait()
+            except queue.Empty:
+                break
+            self.apply_port_changes(added, removed, initial)
+        if self.port_watcher.running:
+            self.root.after(UI_POLL_MS, self.poll_port_events)
+
+    def apply_port_changes(self, added, removed, initial=False):
+        """Update port_map and the combobox incrementally, then auto-flash new boards."""
+        gone = set(removed) | {port.device for port in added}
+        for display_text in [text for text, device in self.port_map.items() if device in gone]:
+            del self.port_map[display_text]
+        for device in gone:
+            self.port_slots.pop(device, None)
+        added_texts = {}
+        for port in added:
+            added_texts[port.device] = self.port_display_text(port)
+            self.port_map[added_texts[port.device]] = port.device
+        self.port_combobox['values'] = list(self.port_map)
+
+        # Una placa re-enumerada (ttyACM0 -> ttyACM3) conserva su slot: la
+        # selección y el monitor la siguen sin reescanear ni reseleccionar
+        for port in added:
+            slot = self.port_slots.get(port.device)
+            if slot is None:
+                continue
+            if slot == self.selected_slot and self.port_var.get() not in self.port_map:
+                self.port_var.set(added_texts[port.device])
+            if slot == self.monitor_slot:
+                self.resume_monitor(port.device)
+
+        if not initial and self.auto_flash_var.get():
+            for port in added:
+                if (port.vid, port.pid) in KNOWN_ESP_USB_IDS:
+                    self.start_auto_flash(port)
+
+    def board_key(self, device, port_info=None):
+        """Identify the board on `device` across re-enumeration (USB serial or hub position)."""
+        port_info = port_info or self.port_info(device)
+        if port_info is None:
+            return device
+        return port_info.serial_number or port_info.location or device
+
+    def begin_flash_job(self, device, port_info=None):
+        """Mark `device` as busy so auto-flash leaves it alone (Tk thread)."""
+        self.flash_job_keys[device] = self.board_key(device, port_info)
+
+    def end_flash_job(self, device):
+        """Start the auto-flash cooldown of the board whose job just finished (Tk thread)."""
+        self.auto_flash_done[self.flash_job_keys.pop(device, device)] = time.monotonic()
+
+    def start_auto_flash(self, port):
+        """Flash a newly connected board without any dialog (unattended mode)."""
+        board_key = self.board_key(port.device, port)
+        last_flash = self.auto_flash_done.get(board_key)
+        if port.device in self.flash_job_keys or board_key in self.flash_job_keys.values() or (
+                last_flash is not None and time.monotonic() - last_flash < AUTO_FLASH_COOLDOWN_S):
+            return  # Trabajo en curso, o la placa se re-enumera tras su reset
+        if self.serial_monitor is not None and self.serial_monitor.port == port.device:
+            return  # El monitor tiene el puerto abierto
+        if not self.flash_files or not self.write_flash_args:
+            self.monitor_output.insert(
+                tk.END, f"Auto-flash skipped on {port.device}: load flasher_args.json first\n")
+            self.monitor_output.see(tk.END)
+            return
+        image_error = self.check_flash_images()
+        if image_error:
+            self.monitor_output.insert(tk.END, f"Auto-flash skipped on {port.device}: {image_error}\n")
+            self.monitor_output.see(tk.END)
+            return
+
+        if self.auto_flash_executor is None:
+            self.auto_flash_executor = ThreadPoolExecutor(
+                max_workers=MAX_GANG_WORKERS, thread_name_prefix="auto-flash")
+            self.root.after(UI_POLL_MS, self.poll_auto_flash_queue)
+        self.auto_flash_pending.add(port.device)
+        self.begin_flash_job(port.device, port)
+        self.monitor_output.insert(tk.END, f"\nAuto-flash started on {port.device} ({port.vid:04X}:{port.pid:04X})\n")
+        self.monitor_output.see(tk.END)
+        self.auto_flash_executor.submit(
+            self.run_flash_job, port.device, self.baudrate_var.get(), self.auto_flash_queue)
+
+    def poll_auto_flash_queue(self):
+        """Report finished auto-flash jobs in the monitor (Tk thread)."""
+        while True:
+            try:
+                kind, port, value = self.auto_flash_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind != "done":
+                continue
+            return_code, detail = value
+            self.auto_flash_pending.discard(port)
+            self.end_flash_job(port)
+            result = "OK" if return_code == 0 else f"FAILED ({detail})"
+            self.monitor_output.insert(tk.END, f"Auto-flash {port}: {result}\n")
+            self.monitor_output.see(tk.END)
+
+        if self.auto_flash_pending:
+            self.root.after(UI_POLL_MS, self.poll_auto_flash_queue)
+        else:
+            self.auto_flash_executor.shutdown(wait=False)
+            self.auto_flash_executor = None
+
     def set_csv_file_path(self):
         """Ask the user for the CSV file path with Linux permissions handling"""
         default_dir = os.path.expanduser("~/Documents/ESPFlashTool_Data")
@@ -288,14 +535,14 @@ class ESPFlashTool:
                 file_path = filedialog.askopenfilename(
                     initialdir=default_dir,
                     title="Select CSV File",
-                    filetypes=[("CSV Files", "*.csv")],
+                    filetypes=[("CSV Files", "*.csv"), ("SQLite Database", "*.db *.sqlite *.sqlite3")],
                     defaultextension=".csv"
                 )
             else:
                 file_path = filedialog.asksaveasfilename(
                     initialdir=default_dir,
                     title="Create New CSV File",
-                    filetypes=[("CSV Files", "*.csv")],
+                    filetypes=[("CSV Files", "*.csv"), ("SQLite Database", "*.db *.sqlite *.sqlite3")],
                     defaultextension=".csv"
                 )
             
@@ -368,6 +615,7 @@ class ESPFlashTool:
                 current_geometry = self.root.geometry()
             
             # Resetear todos los atributos relacionados con el flasheo
+            self.close_bundle()  # Suelta el bundle y las copias de un .espbundle
             self.flash_files = {}
             self.flash_args = {}
             self.custom_files = []
@@ -398,20 +646,23 @@ class ESPFlashTool:
             self.last_error = error_msg  # Esta línea estaba mal indentada
 
     def add_folder(self):
-        """Add files using a flasher_args.json file instead of folder selection."""
+        """Add files using a flasher_args.json file (or a firmware bundle) instead of folder selection."""
         file_path = filedialog.askopenfilename(
-            title="Select flasher_args.json",
+            title="Select flasher_args.json or firmware bundle",
             initialdir=os.getcwd(),
-            filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
+            filetypes=[("JSON files", "*.json"), ("Firmware bundles", f"*{BUNDLE_ARCHIVE_EXT}"),
+                       ("All files", "*.*")]
         )
         
         if file_path and file_path.endswith('flasher_args.json'):
             self.ensure_flash_files_initialized()
             self.process_flasher_args(file_path)
+        elif file_path and file_path.endswith(BUNDLE_ARCHIVE_EXT):
+            self.process_bundle_archive(file_path)
         elif file_path:
             messagebox.showerror(
                 "Invalid File",
-                "Please select a valid flasher_args.json file"
+                f"Please select a valid flasher_args.json or {BUNDLE_ARCHIVE_EXT} file"
             )
 
 
@@ -421,92 +672,17 @@ class ESPFlashTool:
         try:
             # 1. Limpieza inicial
             self.clear_files(silent=True)
-            config_dir = os.path.dirname(os.path.abspath(json_path))
-            
-            # 2. Carga y validación básica del JSON
-            with open(json_path, 'r') as f:
-                try:
-                    config_data = json.load(f)
-                except json.JSONDecodeError as e:
-                    raise ValueError(f"Inavlid JSON File: {str(e)}")
-            
-            if not isinstance(config_data, dict):
-                raise ValueError("JSON File does not have valid parameters")
-
-            # 3. Sistema de resolución de rutas mejorado
-            def resolve_file_path(rel_path, config_dir):
-                """Resolves file paths using multiple fallback strategies."""  
 
-                if not rel_path or not isinstance(rel_path, str):
-                    return None
-                
-                # Intentar rutas en este orden:
-                search_paths = [
-                    os.path.abspath(rel_path),  # Ruta absoluta directa
-                    os.path.normpath(os.path.join(config_dir, rel_path)),  # Relativa al JSON
-                    os.path.join(config_dir, os.path.basename(rel_path)),  # Solo el nombre en dir JSON
-                    os.path.abspath(os.path.join('build', rel_path)),  # En directorio build
-                    os.path.abspath(os.path.join('build', os.path.basename(rel_path)))  # Nombre en build
-                ]
-                
-                for path in search_paths:
-                    if os.path.exists(path):
-                        return os.path.normpath(path)
-                return None
+            # 2. Carga, resolución de rutas y parámetros (esp_flash_core)
+            self.load_flasher_args(json_path)
 
-            # 4. Procesamiento dinámico de flash_files
-            processed_files = {}
-            
-            # Caso 1: Estructura con flash_files directo
-            if 'flash_files' in config_data and isinstance(config_data['flash_files'], dict):
-                for offset, rel_path in config_data['flash_files'].items():
-                    if not isinstance(offset, str) or not offset.startswith('0x'):
-                        continue
-                    
-                    abs_path = resolve_file_path(rel_path, config_dir)
-                    if abs_path:
-                        processed_files[offset] = abs_path
-                    else:
-                        self.show_path_warning(rel_path, config_dir, offset)
-
-            # Caso 2: Estructura modular (bootloader, app, partition-table)
-            for section in ['bootloader', 'app', 'partition-table', 'ota_data', 'nvs']:
-                if section in config_data and isinstance(config_data[section], dict):
-                    section_data = config_data[section]
-                    offset = section_data.get('offset')
-                    rel_path = section_data.get('file')
-                    
-                    if offset and rel_path and isinstance(offset, str) and offset.startswith('0x'):
-                        abs_path = resolve_file_path(rel_path, config_dir)
-                        if abs_path:
-                            processed_files[offset] = abs_path
-                        else:
-                            self.show_path_warning(rel_path, config_dir, f"{section} ({offset})")
-
-            # 5. Validación de archivos mínimos requeridos
-            if not processed_files:
-                raise ValueError("No valid files found for flashing")
-
-            # 6. Actualización de estado de la aplicación
-            self.flash_files = processed_files
-            
-            # 7. Manejo de parámetros de flasheo con valores por defecto
-            self.write_flash_args = config_data.get(
-                'write_flash_args',
-                DEFAULT_FLASH_PARAMS["write_flash_args"].copy()
-            )
-            
-            self.extra_esptool_args = config_data.get(
-                'extra_esptool_args',
-                {}
-            )
-            
-            # 8. Actualización de interfaz
+            # 3. Actualización de interfaz
             self.update_file_listbox()
-            
-            # 9. Notificación al usuario
-            loaded_files = len(self.flash_files)
 
+        except MissingFilesError as e:
+            # Un bundle incompleto no se carga: un único aviso con todo lo que falta
+            self.show_missing_files(e.missing)
+            self.clear_files(silent=True)
         except Exception as e:
             messagebox.showerror(
                 "Settings Error",
@@ -514,103 +690,117 @@ class ESPFlashTool:
             )
             self.clear_files(silent=True)
 
-    def show_path_warning(self, rel_path, config_dir, context):
-        """Displays a detailed warning when a file is not found."""  
+    def process_bundle_archive(self, archive_path):
+        """Loads a single-file firmware bundle (manifest + binaries, no path probing)."""
+        try:
+            self.clear_files(silent=True)
+            manifest = self.load_bundle_archive(archive_path)
+            self.update_file_listbox()
+            self.monitor_output.insert(
+                tk.END, f"Bundle {os.path.basename(archive_path)} loaded: {len(manifest['files'])} files, "
+                        f"chip {manifest.get('chip')}\n")
+        except Exception as e:
+            messagebox.showerror(
+                "Settings Error",
+                f"Bundle could not be loaded:\n{str(e)}"
+            )
+            self.clear_files(silent=True)
+
+    def show_missing_files(self, missing):
+        """Displays one error listing every flasher_args entry that was not found."""
+        entries = "\n".join(f"• {entry.context}: {entry.rel_path}" for entry in missing)
+        searched = sorted({os.path.dirname(path) for entry in missing for path in entry.searched})
+        locations_msg = "\n• ".join(searched)
 
-        search_locations = [
-            os.path.normpath(os.path.join(config_dir, rel_path)),
-            os.path.join(config_dir, os.path.basename(rel_path)),
-            os.path.abspath(os.path.join('build', rel_path)),
-            os.path.abspath(os.path.join('build', os.path.basename(rel_path)))
-        ]
-        
-        locations_msg = "\n• ".join(search_locations)
-        
-        messagebox.showwarning(
+        messagebox.showerror(
             "File not found",
-            f"File not found {context}:\n"
-            f"Original Path: {rel_path}\n\n"
-            f"Path used to searcg:\n• {locations_msg}"
+            f"{len(missing)} file(s) not found, nothing was loaded:\n{entries}\n\n"
+            f"Folders searched:\n• {locations_msg}"
         )
-        
+
     def save_json_to_csv(self):
-        """Save JSON data to a CSV file with Linux permission handling"""
+        """Queue the current JSON data for the background CSV/SQLite writer.
+
+        Safe to call from the serial reader thread: it never blocks on disk
+        or dialogs; the outcome is shown by poll_record_results.
+        """
         if not hasattr(self, 'json_data') or not self.json_data:
-            messagebox.showwarning("Warning", "No JSON data to save.")
+            self.record_writer.results.put(("error", self.csv_file_path, None, "No JSON data to save."))
             return
 
         if not self.csv_file_path:
-            messagebox.showwarning("Warning", "No CSV file path selected.")
+            self.record_writer.results.put(("error", None, None, "No CSV file path selected."))
             return
 
-        try:
-            # Validar formato JSON
-            if isinstance(self.json_data, dict):
-                data_to_save = [self.json_data]
-            elif isinstance(self.json_data, list):
-                data_to_save = self.json_data
-            else:
-                raise ValueError("Formato JSON no soportado")
-
-            # Obtener headers del primer registro
-            headers = list(data_to_save[0].keys())
-            hw_id = data_to_save[0].get("hw_id")
+        # Validar formato JSON
+        if isinstance(self.json_data, dict):
+            record = self.json_data
+        elif isinstance(self.json_data, list) and self.json_data and isinstance(self.json_data[0], dict):
+            record = self.json_data[0]
+        else:
+            self.record_writer.results.put(("error", self.csv_file_path, None, "Formato JSON no soportado"))
+            return
 
-            existing_data = []
-            file_exists = os.path.exists(self.csv_file_path)
+        self.record_writer.submit(self.csv_file_path, record)
+
+    def poll_record_results(self):
+        """Show writer results in the status label (Tk thread, non-modal)."""
+        while True:
+            try:
+                status, path, hw_id, detail = self.record_writer.results.get_nowait()
+            except queue.Empty:
+                break
+            if status == "ok":
+                self.record_status_var.set(f"Saved {hw_id} - {detail} records")
+                self.record_status_label.config(foreground="dark green")
+                self.record_error_shown = False
+                continue
+
+            if isinstance(detail, PermissionError):
+                message = (f"No se puede escribir en:\n{path}\n"
+                           "Verifique los permisos del archivo.")
+            else:
+                message = f"Error guardando CSV:\n{detail}"
+            self.record_status_var.set(f"Save failed: {detail}")
+            self.record_status_label.config(foreground="red")
+            self.monitor_output.insert(tk.END, f"\n{message}\n")
+            self.monitor_output.see(tk.END)
+            # Un solo diálogo hasta que vuelva a guardar bien
+            if not self.record_error_shown:
+                self.record_error_shown = True
+                messagebox.showerror("Critical Error", message)
 
-            # Leer datos existentes si el archivo existe
-            if file_exists:
-                try:
-                    with open(self.csv_file_path, mode='r', newline='', encoding='utf-8') as csv_file:
-                        reader = csv.DictReader(csv_file)
-                        existing_data = list(reader)
-                except Exception as read_error:
-                    messagebox.showerror("Read Error", f"Error reading CSV: {read_error}")
-                    return
-
-            # Actualizar registro existente
-            updated = False
-            for row in existing_data:
-                if row.get("hw_id") == hw_id:
-                    row.update(data_to_save[0])
-                    updated = True
-                    break
-
-            # Añadir nuevo registro si no existe
-            if not updated:
-                existing_data.append(data_to_save[0])
-
-            # Escribir archivo completo
-            with open(self.csv_file_path, mode='w', newline='', encoding='utf-8') as csv_file:
-                writer = csv.DictWriter(csv_file, fieldnames=headers)
-                writer.writeheader()
-                writer.writerows(existing_data)
-                
-                # Establecer permisos Linux (rw-rw----)
-                os.chmod(self.csv_file_path, 0o660)
-
-            # Feedback al usuario
-            success_msg = (
-                f"Archivo actualizado:\n"
-                f"Ubicación: {self.csv_file_path}\n"
-                f"Registros: {len(existing_data)}"
-            )
-            messagebox.showinfo("Success", success_msg)
+        self.root.after(MONITOR_REFRESH_MS, self.poll_record_results)
 
-        except PermissionError:
-            messagebox.showerror("Permission Denied", 
-                f"No se puede escribir en:\n{self.csv_file_path}\n"
-                "Verifique los permisos del archivo.")
-        except Exception as e:
-            messagebox.showerror("Critical Error", 
-                f"Error guardando CSV:\n{str(e)}")
+    def on_close(self):
+        """Window close handler: stop the monitor and flush mfg records."""
+        self.stop_monitoring()
+        self.port_watcher.stop()
+        self.record_writer.close()
+        self.root.destroy()
 
     def get_selected_port(self):
         """Obtiene el nombre real del puerto seleccionado o None si es inválido."""
         selected_display = self.port_var.get()
         return self.port_map.get(selected_display, None)
 
+    def ensure_write_flash_args(self):
+        """Ask for flash mode/freq/size when no write_flash args are loaded.
+
+        Returns:
+            bool: True if write_flash args are available.
+        """
+        if self.write_flash_args:
+            return True
+        flash_mode = simpledialog.askstring("Input", "Enter flash mode (e.g., dio):", initialvalue="dio")
+        flash_freq = simpledialog.askstring("Input", "Enter flash frequency (e.g., 80m):", initialvalue="80m")
+        flash_size = simpledialog.askstring("Input", "Enter flash size (e.g., 2MB):", initialvalue="2MB")
+        if flash_mode and flash_freq and flash_size:
+            self.write_flash_args = ["--flash_mode", flash_mode, "--flash_freq", flash_freq, "--flash_size", flash_size]
+            return True
+        messagebox.showerror("Error", "You must enter valid values for flash parameters.")
+        return False
+
     def flash_device(self):
         """Flash the device with the selected files."""
         port = self.get_selected_port()  # <- Esto es lo importante
@@ -622,106 +812,333 @@ class ESPFlashTool:
             messagebox.showerror("Error", "No files selected for flashing.")
             return
 
-        # Obtener la ruta correcta de esptool.py
-        if getattr(sys, 'frozen', False):
-            # Si la aplicación está empaquetada con PyInstaller
-            base_path = sys._MEIPASS
-        else:
-            # Si la aplicación se ejecuta desde el código fuente
-            base_path = os.path.dirname(os.path.abspath(__file__))
-
-        esptool_path = os.path.join(base_path, "esptool_py", "esptool", "esptool.py")
+        # Agregar los argumentos de write_flash
+        if not self.ensure_write_flash_args():
+            return
 
-        if getattr(sys, 'frozen', False):
-            python_exec = sys.executable  # Usa el Python embebido
-        else:
-            python_exec = "python"
-
-        # Construir el comando base
-        cmd = [
-            python_exec,
-            esptool_path,
-            "-p", port,
-            "-b", baudrate,
-            "--before", self.extra_esptool_args.get("before", "default_reset"),
-            "--after", self.extra_esptool_args.get("after", "hard_reset"),
-            "--chip", self.extra_esptool_args.get("chip", "esp32"),
-            "write_flash"
-        ]
+        image_error = self.check_flash_images()
+        if image_error:
+            messagebox.showerror("Error", image_error)
+            return
 
-        # Agregar los argumentos de write_flash
-        if not self.write_flash_args:
-            flash_mode = simpledialog.askstring("Input", "Enter flash mode (e.g., dio):", initialvalue="dio")
-            flash_freq = simpledialog.askstring("Input", "Enter flash frequency (e.g., 80m):", initialvalue="80m")
-            flash_size = simpledialog.askstring("Input", "Enter flash size (e.g., 2MB):", initialvalue="2MB")
-            if flash_mode and flash_freq and flash_size:
-                self.write_flash_args = ["--flash_mode", flash_mode, "--flash_freq", flash_freq, "--flash_size", flash_size]
-            else:
-                messagebox.showerror("Error", "You must enter valid values for flash parameters.")
-                return
-        cmd.extend(self.write_flash_args)
+        if self.flash_thread and self.flash_thread.is_alive():
+            messagebox.showwarning("Busy", "A flash process is already running.")
+            return
 
-        # Agregar los archivos de flash con sus offsets
         for offset, file in self.flash_files.items():
             print(f"File to flash: {file} at offset {offset}")
-            cmd.extend([offset, file])
 
+        self.monitor_output.insert(tk.END, "Starting flash process...\n")
+        self.monitor_output.see(tk.END)
+        self.flash_progress['value'] = 0
+        self.flash_status_var.set("Connecting...")
+        self.flash_button['state'] = 'disabled'
+        self.flash_thread_port = port
+        self.begin_flash_job(port)
+
+        # esptool corre en un hilo; la GUI vacía la cola con root.after
+        self.flash_queue = queue.Queue(maxsize=FLASH_QUEUE_SIZE)
+        self.flash_thread = threading.Thread(
+            target=self.flash_worker, args=(port, baudrate, self.flash_queue), daemon=True)
+        self.flash_thread.start()
+        self.root.after(UI_POLL_MS, self.poll_flash_queue)
+
+    def start_baud_calibration(self):
+        """Find and save the fastest reliable baud for the selected port's adapter."""
+        port = self.get_selected_port()
+        if not port:
+            messagebox.showerror("Error", "Please select a port.")
+            return
+        if self.flash_thread and self.flash_thread.is_alive():
+            messagebox.showwarning("Busy", "A flash process is already running.")
+            return
+        if self.serial_monitor is not None and self.serial_monitor.running and self.serial_monitor.port == port:
+            messagebox.showwarning("Busy", "Stop monitoring this port before calibrating.")
+            return
 
-        try:
-            self.monitor_output.insert(tk.END, "Starting flash process...\n")
-            self.monitor_output.insert(tk.END, "Command: " + " ".join(cmd) + "\n\n")
+        self.monitor_output.insert(tk.END, f"\nCalibrating baud rate on {port} (read only)...\n")
+        self.monitor_output.see(tk.END)
+        self.flash_status_var.set("Calibrating...")
+        self.flash_button['state'] = 'disabled'
+        self.flash_thread_port = port
+        self.begin_flash_job(port)
+
+        # Mismo esquema que el flasheo: hilo + cola vaciada con root.after
+        self.flash_queue = queue.Queue()
+
+        def run():
+            try:
+                baud = self.calibrate_baud(port, lambda line: self.flash_queue.put(("line", line)))
+                self.flash_queue.put(("calibrated", (port, baud, None)))
+            except Exception as e:
+                self.flash_queue.put(("calibrated", (port, None, str(e))))
+
+        self.flash_thread = threading.Thread(target=run, name="baud-calibration", daemon=True)
+        self.flash_thread.start()
+        self.root.after(UI_POLL_MS, self.poll_calibration_queue)
+
+    def poll_calibration_queue(self):
+        """Show calibration output and the final rate (Tk thread)."""
+        lines = []
+        result = None
+        while True:
+            try:
+                kind, value = self.flash_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "line":
+                lines.append(value)
+            else:
+                result = value
+        if lines:
+            self.monitor_output.insert(tk.END, "".join(lines))
             self.monitor_output.see(tk.END)
-            
-            # Configurar parámetros para ocultar la ventana en Windows
-            startupinfo = None
-            creationflags = 0
-            if sys.platform.startswith('win'):
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-                startupinfo.wShowWindow = subprocess.SW_HIDE
-                creationflags = subprocess.CREATE_NO_WINDOW
-            else:  # Configuración para Linux
-                # Asegurar que esptool está en el PATH del entorno empaquetado
-                if getattr(sys, 'frozen', False):
-                    esptool_dir = os.path.join(sys._MEIPASS, "esptool")
-                    os.environ["PATH"] += os.pathsep + esptool_dir
-
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                bufsize=1,
-                startupinfo=startupinfo,
-                creationflags=creationflags
-            )
-                    
-            # Leer la salida línea por línea
-            for line in process.stdout:
-                self.monitor_output.insert(tk.END, line)
-                self.monitor_output.see(tk.END)
-                self.monitor_output.update_idletasks()  # Actualizar la interfaz
-            
-            # Esperar a que termine el proceso
-            return_code = process.wait()
-            
-            if return_code == 0:
-                self.monitor_output.insert(tk.END, "\nDevice flashed successfully!\n")
+        if result is None:
+            self.root.after(UI_POLL_MS, self.poll_calibration_queue)
+            return
+
+        port, baud, error = result
+        self.flash_button['state'] = 'normal'
+        self.end_flash_job(port)
+        if baud:
+            self.flash_status_var.set(f"Calibrated: {baud} baud")
+            self.baudrate_var.set(AUTO_BAUD)
+            messagebox.showinfo("Baud Calibration", f"Fastest reliable baud on {port}: {baud}\n"
+                                "Flashing with 'Auto' will use it for this adapter.")
+        else:
+            self.flash_status_var.set("Calibration failed")
+            messagebox.showerror("Baud Calibration", f"No baud rate worked on {port}.\n{error or ''}")
+
+    def flash_worker(self, port, baudrate, events):
+        """Worker thread: run the flash and feed output/progress events to the GUI.
 
+        Events are ("line", text), ("progress", (address, percent)) and
+        ("done", (return_code, error)).
+        """
+        def handle_line(line):
+            match = FLASH_PROGRESS_RE.search(line)
+            if match:
+                # El progreso se descarta si la GUI va atrasada; llegará otro
+                try:
+                    events.put_nowait(("progress", (match.group(1), float(match.group(2)))))
+                except queue.Full:
+                    pass
             else:
-                self.monitor_output.insert(tk.END, f"\nFlash process failed with return code {return_code}\n")
-                messagebox.showerror("Error", f"Failed to flash device. Return code: {return_code}")
-                
-            self.monitor_output.see(tk.END)
+                events.put(("line", line))
 
-        except subprocess.CalledProcessError as e:
-            self.monitor_output.insert(tk.END, f"\nCommand failed: {e.output}\n")
+        try:
+            return_code = self.flash_port(port, baudrate, handle_line)
+            events.put(("done", (return_code, None)))
         except FileNotFoundError as e:
-            self.monitor_output.insert(tk.END, f"\nesptool.py not found: {str(e)}\n")
+            events.put(("done", (-1, f"esptool.py not found: {str(e)}")))
+        except Exception as e:
+            events.put(("done", (-1, f"Error during flash process: {str(e)}")))
+
+    def poll_flash_queue(self):
+        """Drain the flash queue on the Tk thread and apply updates in one batch."""
+        lines = []
+        progress = None
+        result = None
+        while True:
+            try:
+                kind, value = self.flash_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "line":
+                lines.append(value)
+            elif kind == "progress":
+                progress = value
+            elif kind == "done":
+                result = value
+
+        if lines:
+            self.monitor_output.insert(tk.END, "".join(lines))
+            self.monitor_output.see(tk.END)
+        if progress:
+            address, percent = progress
+            self.flash_progress['value'] = percent
+            self.flash_status_var.set(f"Writing at {address} ({percent:.0f} %)")
+
+        if result is None:
+            self.root.after(UI_POLL_MS, self.poll_flash_queue)
+            return
+
+        return_code, error = result
+        self.flash_button['state'] = 'normal'
+        self.end_flash_job(self.flash_thread_port)
+        if error:
+            self.flash_status_var.set("Error")
+            self.monitor_output.insert(tk.END, f"\n{error}\n")
+            self.monitor_output.see(tk.END)
+            messagebox.showerror("Error", f"Failed to flash device: {error}")
+        elif return_code == 0:
+            self.flash_progress['value'] = 100
+            self.flash_status_var.set("Done")
+            self.monitor_output.insert(tk.END, "\nDevice flashed successfully!\n")
+            self.monitor_output.see(tk.END)
+        else:
+            self.flash_status_var.set("Failed")
+            self.monitor_output.insert(tk.END, f"\nFlash process failed with return code {return_code}\n")
+            self.monitor_output.see(tk.END)
+            messagebox.showerror("Error", f"Failed to flash device. Return code: {return_code}")
+
+    def open_gang_flash(self):
+        """Open the gang-programming window to flash several ports at once."""
+        if not self.flash_files:
+            messagebox.showerror("Error", "No files selected for flashing.")
+            return
+
+        self.refresh_ports()
+        gang_window = tk.Toplevel(self.root)
+        gang_window.title("Gang Flash")
+        gang_window.geometry("560x420")
+
+        # Lista de puertos (selección múltiple)
+        ttk.Label(gang_window, text="Select Ports:").grid(row=0, column=0, padx=10, pady=5, sticky="nw")
+        port_listbox = tk.Listbox(gang_window, selectmode=tk.MULTIPLE, height=6, exportselection=False)
+        for display_text in self.port_map:
+            port_listbox.insert(tk.END, display_text)
+        port_listbox.grid(row=0, column=1, padx=10, pady=5, sticky="ew")
+
+        ttk.Label(gang_window, text="Parallel jobs:").grid(row=1, column=0, padx=10, pady=5, sticky="w")
+        workers_var = tk.StringVar(value=str(min(8, MAX_GANG_WORKERS)))
+        ttk.Spinbox(
+            gang_window, from_=1, to=MAX_GANG_WORKERS, textvariable=workers_var, width=5
+        ).grid(row=1, column=1, padx=10, pady=5, sticky="w")
+
+        # Una fila de progreso/resultado por puerto
+        self.gang_tree = ttk.Treeview(
+            gang_window, columns=("port", "progress", "status"), show="headings", height=8
+        )
+        self.gang_tree.heading("port", text="Port")
+        self.gang_tree.heading("progress", text="Progress")
+        self.gang_tree.heading("status", text="Status")
+        self.gang_tree.column("port", width=140)
+        self.gang_tree.column("progress", width=80, anchor="center")
+        self.gang_tree.column("status", width=300)
+        self.gang_tree.grid(row=2, column=0, columnspan=2, padx=10, pady=5, sticky="nsew")
+
+        def start():
+            selected = [port_listbox.get(i) for i in port_listbox.curselection()]
+            try:
+                workers = int(workers_var.get())
+            except ValueError:
+                workers = 1
+            self.start_gang_flash([self.port_map[text] for text in selected], workers)
+
+        ttk.Button(gang_window, text="Start Gang Flash", command=start).grid(
+            row=3, column=0, columnspan=2, pady=10)
+
+        gang_window.columnconfigure(1, weight=1)
+        gang_window.rowconfigure(2, weight=1)
+
+    def start_gang_flash(self, ports, workers):
+        """Run one write_flash job per port on a bounded worker pool."""
+        if not ports:
+            messagebox.showerror("Error", "Please select at least one port.")
+            return
+        if getattr(self, 'gang_executor', None) and self.gang_pending:
+            messagebox.showwarning("Busy", "A gang flash is already running.")
+            return
+        if not self.ensure_write_flash_args():
+            return
+        image_error = self.check_flash_images()
+        if image_error:
+            messagebox.showerror("Error", image_error)
+            return
+
+        baudrate = self.baudrate_var.get()
+        workers = max(1, min(workers, MAX_GANG_WORKERS, len(ports)))
+
+        for item in self.gang_tree.get_children():
+            self.gang_tree.delete(item)
+        for port in ports:
+            self.gang_tree.insert("", tk.END, iid=port, values=(port, "0 %", "Queued"))
+
+        self.gang_queue = queue.Queue()
+        self.gang_pending = set(ports)
+        for port in ports:
+            self.begin_flash_job(port)
+        self.gang_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gang-flash")
+        for port in ports:
+            self.gang_executor.submit(self.run_flash_job, port, baudrate, self.gang_queue)
+
+        self.monitor_output.insert(
+            tk.END, f"\nGang flash started on {len(ports)} port(s) with {workers} worker(s)\n")
+        self.monitor_output.see(tk.END)
+        self.root.after(100, self.poll_gang_queue)
+
+    def run_flash_job(self, port, baudrate, events):
+        """Worker: run esptool for one port and report progress through a queue.
+
+        Events are tuples of (kind, port, value) with kind in
+        "status", "progress" or "done".
+        """
+        events.put(("status", port, "Connecting..."))
+        last_line = ""
+
+        def handle_line(line):
+            nonlocal last_line
+            line = line.strip()
+            if not line:
+                return
+            last_line = line
+            match = FLASH_PROGRESS_RE.search(line)
+            if match:
+                events.put(("progress", port, (match.group(1), float(match.group(2)))))
+            elif line.startswith(("Hash of data verified", "Wrote ", "Compressed ", "Hard resetting",
+                                  "0x", "All regions up to date")):
+                events.put(("status", port, line))
+
+        try:
+            return_code = self.flash_port(port, baudrate, handle_line)
+            events.put(("done", port, (return_code, last_line)))
         except Exception as e:
-            self.monitor_output.insert(tk.END, f"\nError during flash process: {str(e)}\n")
+            events.put(("done", port, (-1, str(e))))
+
+    def poll_gang_queue(self):
+        """Apply queued gang-flash events to the result rows on the Tk thread."""
+        while True:
+            try:
+                kind, port, value = self.gang_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "done":
+                return_code, detail = value
+                self.gang_pending.discard(port)
+                self.end_flash_job(port)
+                result = "OK" if return_code == 0 else f"FAILED ({detail})"
+                self.monitor_output.insert(tk.END, f"{port}: {result}\n")
+                self.monitor_output.see(tk.END)
+            try:
+                self.update_gang_row(kind, port, value)
+            except tk.TclError:
+                # La ventana de gang flash fue cerrada
+                pass
+
+        if self.gang_pending:
+            self.root.after(100, self.poll_gang_queue)
+        else:
+            self.gang_executor.shutdown(wait=False)
+            self.gang_executor = None
+            self.monitor_output.insert(tk.END, "Gang flash finished\n")
             self.monitor_output.see(tk.END)
-            messagebox.showerror("Error", f"Failed to flash device: {e}")
+
+    def update_gang_row(self, kind, port, value):
+        """Update the progress/result row of one port in the gang window."""
+        if kind == "status":
+            self.gang_tree.set(port, "status", value)
+        elif kind == "progress":
+            address, percent = value
+            self.gang_tree.set(port, "progress", f"{percent:.0f} %")
+            self.gang_tree.set(port, "status", f"Writing at {address}")
+        elif kind == "done":
+            return_code, detail = value
+            if return_code == 0:
+                self.gang_tree.set(port, "progress", "100 %")
+                self.gang_tree.set(port, "status", "OK")
+            else:
+                self.gang_tree.set(port, "status", f"FAILED ({return_code}): {detail}")
 
     def close_serial_port(self):
         """Cierra todas las conexiones seriales y restablece los puertos."""
@@ -759,17 +1176,7 @@ class ESPFlashTool:
                 messagebox.showerror("Error", "Please select a port")
                 return
 
-            # Check if port exists and is accessible
-            if not os.path.exists(port):
-                raise serial.SerialException(f"Port {port} not found")
-
-            # Reset sequence (DTR/RTS)
-            with serial.Serial(port=port, baudrate=115200) as ser:
-                ser.dtr = False
-                ser.rts = True
-                time.sleep(0.1)
-                ser.dtr = True
-                ser.rts = False
+            reset_board(port)
 
             self.monitor_output.insert(tk.END, "\nReset successful!\n")
             self.monitor_output.see(tk.END)
@@ -796,63 +1203,78 @@ class ESPFlashTool:
     def monitor_device(self):
         """Start monitoring the device."""
         # Detener cualquier instancia previa de manera segura
-        if hasattr(self, 'serial_thread') and self.serial_thread.is_alive():
-            self.stop_serial = True  # Nueva bandera de control
-            self.serial_thread.join()
-
-        if hasattr(self, 'ser') and self.ser.is_open:
-            self.ser.close()
+        self.stop_monitoring()
 
         port = self.get_selected_port()  
         if not port:
             messagebox.showerror("Error", "Please select a port.")
             return
 
-        baudrate = 115200  # Default baudrate
-
         try:
-            # Configuración serial con control de flujo
-            self.ser = serial.Serial(
-                port=port,
-                baudrate=baudrate,
-                timeout=1,
-                rtscts=True  # Habilita control de flujo hardware
-            )
-            self.ser.reset_input_buffer()
-            
-            self.stop_serial = False  # Reiniciar bandera
-
-            def read_serial():
-                """Hilo de lectura con manejo seguro de cierre"""
-                while not self.stop_serial and self.ser.is_open:
-                    try:
-                        data = self.ser.readline().decode("utf-8", errors="ignore").strip()
-                        if data:
-                            # Actualizar GUI de manera segura
-                            self.monitor_output.insert(tk.END, data + "\n")
-                            self.monitor_output.see(tk.END)
-
-                            # Procesar datos de manufactura
-                            if '{"type":"mfg"' in data:
-                                match = re.search(r'(\{.*?"type":"mfg".*?\})', data)
-                                if match:
-                                    try:
-                                        self.json_data = json.loads(match.group(1))
-                                        self.save_json_to_csv()
-                                    except json.JSONDecodeError:
-                                        print("Failed to decode JSON")
-                                        
-                    except (serial.SerialException, OSError, TypeError, AttributeError) as e:
-                        print(f"Serial read error: {e}")
-                        break
-
-            # Iniciar hilo con verificación de estado
-            self.serial_thread = threading.Thread(target=read_serial, daemon=True)
-            self.serial_thread.start()
-
+            self.open_monitor(port)
+            self.monitor_slot = self.port_slots.get(port)
         except serial.SerialException as e:
             messagebox.showerror("Error", f"Failed to open port {port}: {e}")
-            self.stop_serial = True
+            self.serial_monitor = None
+
+    def open_monitor(self, port):
+        """Start a SerialMonitor on `port` and the widget refresh loop."""
+        self.serial_monitor = SerialMonitor(port, MONITOR_BAUDRATE, on_mfg_record=self.handle_mfg_record)
+        self.serial_monitor.start()
+        self.monitor_seq = 0
+        if getattr(self, 'monitor_render_job', None):
+            self.root.after_cancel(self.monitor_render_job)
+        self.monitor_render_job = self.root.after(MONITOR_REFRESH_MS, self.render_monitor)
+
+    def resume_monitor(self, port):
+        """Reopen the monitor of a slot whose board came back, possibly on a new device."""
+        monitor = self.serial_monitor
+        if monitor is None or monitor.running:
+            return  # Parado por el usuario, o sigue leyendo
+        monitor.stop()
+        try:
+            self.open_monitor(port)
+        except serial.SerialException as e:
+            self.serial_monitor = None
+            self.monitor_output.insert(tk.END, f"\nMonitor not resumed on {port}: {e}\n")
+            return
+        self.monitor_output.insert(tk.END, f"\nMonitor resumed on {port} (slot {self.monitor_slot})\n")
+        self.monitor_output.see(tk.END)
+
+    def handle_mfg_record(self, record):
+        """Called from the monitor reader thread for every mfg record."""
+        self.json_data = record
+        self.save_json_to_csv()
+
+    def render_monitor(self):
+        """Push the new tail of the monitor buffer to the widget (Tk thread only)."""
+        monitor = self.serial_monitor
+        if monitor is None:
+            self.monitor_render_job = None
+            return
+
+        self.monitor_seq, lines, dropped = monitor.buffer.since(self.monitor_seq)
+        if dropped:
+            lines.insert(0, f"... {dropped} lines dropped ...")
+        if lines:
+            self.monitor_output.insert(tk.END, "\n".join(lines) + "\n")
+            self.trim_monitor_output()
+            self.monitor_output.see(tk.END)
+
+        if not monitor.running:
+            self.monitor_render_job = None
+        else:
+            self.monitor_render_job = self.root.after(MONITOR_REFRESH_MS, self.render_monitor)
+
+    def trim_monitor_output(self):
+        """Delete the oldest widget lines beyond the configured maximum."""
+        try:
+            max_lines = int(self.monitor_max_lines_var.get())
+        except (ValueError, tk.TclError):
+            max_lines = MONITOR_WIDGET_MAX_LINES
+        line_count = int(self.monitor_output.index('end-1c').split('.')[0])
+        if max_lines > 0 and line_count > max_lines:
+            self.monitor_output.delete('1.0', f'{line_count - max_lines + 1}.0')
 
     def create_patch(self):
         patch_window = tk.Toplevel(self.root)
@@ -889,12 +1311,25 @@ class ESPFlashTool:
         ).grid(row=1, column=0, padx=5, pady=5)
         ttk.Label(file_frame, textvariable=self.new_binary_path).grid(row=1, column=1, sticky="w")
 
-        # Generate Button
-        ttk.Button(
+        ttk.Checkbutton(
             patch_window,
+            text="Optimize compression (try all settings)",
+            variable=self.optimize_patch_var
+        ).grid(row=3, column=0, columnspan=2, pady=(0, 10))
+
+        # Generate Buttons
+        buttons_frame = ttk.Frame(patch_window)
+        buttons_frame.grid(row=2, column=0, columnspan=2, pady=10)
+        ttk.Button(
+            buttons_frame,
             text="Generate Patch",
             command=self.generate_patch
-        ).grid(row=2, column=0, columnspan=2, pady=10)
+        ).pack(side=tk.LEFT, padx=5)
+        ttk.Button(
+            buttons_frame,
+            text="Batch from Folder...",
+            command=self.generate_patch_batch
+        ).pack(side=tk.LEFT, padx=5)
 
         # Grid configuration
         patch_window.columnconfigure(1, weight=1)
@@ -938,112 +1373,203 @@ class ESPFlashTool:
         if not save_path:
             return
 
+        # Parche ya generado para el mismo par de imágenes: copiarlo del caché
+        chip = self.chip_var.get().lower()
+        optimize = self.optimize_patch_var.get()
+        compression = optimized_patch_cache_label() if optimize else "heatshrink"
+        try:
+            cache_key = self.patch_cache.key(self.base_binary_full, self.new_binary_full, compression, chip)
+            cached_patch = self.patch_cache.get(cache_key)
+        except OSError as e:
+            messagebox.showerror("Error", f"Cannot read binaries:\n{e}")
+            return
+        if cached_patch:
+            copy_file_atomic(cached_patch, save_path)
+            messagebox.showinfo("Success", f"Patch generated successfully (cached):\n{save_path}")
+            return
+
+        if optimize:
+            self.start_patch_optimizer(save_path, chip, cache_key)
+            return
 
-        if getattr(sys, 'frozen', False):
-            # Si la aplicación está empaquetada con PyInstaller
-            base_path = sys._MEIPASS
-        else:
-            # Si la aplicación se ejecuta desde el código fuente
-            base_path = os.path.dirname(os.path.abspath(__file__))
+        # Build patch (image checks, detools, 64-byte header)
+        try:
+            build_ota_patch(self.base_binary_full, self.new_binary_full, save_path, chip)
+        except PatchError as e:
+            messagebox.showerror("Process Error", str(e))
+            return
+        except Exception as e:
+            messagebox.showerror("Unexpected Error", str(e))
+            return
 
-        esptool_path = os.path.join(base_path, "esptool_py", "esptool", "esptool.py")
+        try:
+            self.patch_cache.put(cache_key, save_path)
+        except OSError as e:
+            print(f"Patch cache not updated: {e}")
 
-        if getattr(sys, 'frozen', False):
-            python_exec = sys.executable  # Usa el Python embebido
-        else:
-            python_exec = "python"
+        messagebox.showinfo("Success", f"Patch generated successfully:\n{save_path}")
+
+    def start_patch_optimizer(self, save_path, chip, cache_key):
+        """Run the compression sweep in the background and report the table."""
+        if getattr(self, 'optimize_thread', None) and self.optimize_thread.is_alive():
+            messagebox.showwarning("Busy", "Patch optimization is already running.")
+            return
+        self.optimize_queue = queue.Queue()
+        self.monitor_output.insert(tk.END, "\nOptimizing patch compression...\n")
+        self.monitor_output.see(tk.END)
+        base_path, new_path = self.base_binary_full, self.new_binary_full
 
+        def run():
+            try:
+                self.optimize_queue.put(("done", optimize_ota_patch(base_path, new_path, save_path, chip)))
+            except Exception as e:
+                self.optimize_queue.put(("error", e))
 
-        # Step 1: Get validation hash using esptool
+        self.optimize_thread = threading.Thread(target=run, daemon=True)
+        self.optimize_thread.start()
+        self.root.after(UI_POLL_MS, lambda: self.poll_patch_optimizer(save_path, cache_key))
+
+    def poll_patch_optimizer(self, save_path, cache_key):
+        """Show the size/time table once the optimizer finishes (Tk thread)."""
         try:
-            esptool_cmd = [
-                python_exec,
-                esptool_path,
-                "--chip", self.chip_var.get().lower(),
-                "image_info",
-                self.base_binary_full
-            ]
-            result = subprocess.run(
-                esptool_cmd,
-                check=True,
-                capture_output=True,
-                timeout=30
-            )
-        except subprocess.CalledProcessError as e:
-            messagebox.showerror("Error", f"esptool failed: {e.stderr.decode()}")
+            kind, value = self.optimize_queue.get_nowait()
+        except queue.Empty:
+            self.root.after(UI_POLL_MS, lambda: self.poll_patch_optimizer(save_path, cache_key))
             return
-        except FileNotFoundError:
-            messagebox.showerror("Error", "esptool.py not found in PATH")
+
+        if kind == "error":
+            messagebox.showerror("Process Error", str(value))
             return
 
-        # Extract validation hash
-        hash_match = re.search(rb"Validation Hash: ([A-Fa-f0-9]+) \(valid\)", result.stdout)
+        best, rows = value
+        table = [f"{'Setting':<28} {'Size':>9} {'Time':>7}  Device"]
+        for row in rows:
+            if "error" in row:
+                table.append(f"{row['label']:<28} {'error':>9} {'':>7}  {row['error']}")
+            else:
+                marker = " <- selected" if row is best else ""
+                table.append(f"{row['label']:<28} {row['size']:>9} {row['seconds']:>6.2f}s  "
+                             f"{'yes' if row['device'] else 'no'}{marker}")
+        self.monitor_output.insert(tk.END, "\n".join(table) + "\n")
+        self.monitor_output.see(tk.END)
 
-        if not hash_match:
-            messagebox.showerror("Error", "Validation hash not found")
+        try:
+            self.patch_cache.put(cache_key, save_path)
+        except OSError as e:
+            print(f"Patch cache not updated: {e}")
+
+        messagebox.showinfo(
+            "Success",
+            f"Patch generated successfully:\n{save_path}\n"
+            f"{best['label']}, {best['size']} bytes")
+
+    def generate_patch_batch(self):
+        """Build patches from a folder of field firmware versions to the new binary."""
+        if not self.new_binary_full:
+            messagebox.showerror("Error", "Please select the new binary first.")
+            return
+        if getattr(self, 'batch_thread', None) and self.batch_thread.is_alive():
+            messagebox.showwarning("Busy", "A batch patch generation is already running.")
+            return
+        base_dir = filedialog.askdirectory(title="Select folder with base binaries")
+        if not base_dir:
+            return
+        output_dir = filedialog.askdirectory(title="Select output folder for patches")
+        if not output_dir:
             return
-        digest = bytes.fromhex(hash_match.group(1).decode())
 
-            # Step 2: Generate temporary patch
-        try:
-            # Usar el mismo enfoque que el script original
-            temp_patch_path = "patch_file_temp.bin"
-            
-                # Comando detools
-            subprocess.run(
-                [
-                    sys.executable,
-                    "-m", "detools",
-                    "create_patch",
-                    "-c", "heatshrink",
-                    self.base_binary_full,
-                    self.new_binary_full,
-                    temp_patch_path
-                ],
-                check=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
+        chip = self.chip_var.get().lower()
+        self.batch_queue = queue.Queue()
+        self.monitor_output.insert(tk.END, f"\nGenerating patches from {base_dir} ...\n")
+        self.monitor_output.see(tk.END)
 
-            # Step 3: Create final file with header
-            with open(temp_patch_path, "rb") as src_file, open(save_path, "wb") as dest_file:
-                # Write custom header
-                dest_file.write(self.ESP_DELTA_OTA_MAGIC.to_bytes(self.MAGIC_SIZE, 'little'))
-                dest_file.write(digest)
-                dest_file.write(b"\x00" * self.RESERVED_HEADER)
-                # Copy patch data
-                shutil.copyfileobj(src_file, dest_file)
-
-            messagebox.showinfo("Success", f"Patch generated successfully:\n{save_path}")
-
-        except subprocess.CalledProcessError as e:
-            tool_name = 'esptool' if 'esptool' in str(e.cmd) else 'detools'
-            error_msg = f"{tool_name} error:\n"
-            error_msg += e.stderr.decode() if e.stderr else "Unknown error"
-            messagebox.showerror("Process Error", error_msg)
-        except Exception as e:
-            messagebox.showerror("Unexpected Error", str(e))
-        finally:
-            if os.path.exists(temp_patch_path):
-                os.remove(temp_patch_path)
+        def run():
+            try:
+                manifest = generate_patch_matrix(
+                    base_dir, self.new_binary_full, output_dir, chip,
+                    cache=self.patch_cache, on_result=lambda entry: self.batch_queue.put(("entry", entry)),
+                    on_line=lambda line: self.batch_queue.put(("line", line)))
+                self.batch_queue.put(("done", manifest))
+            except Exception as e:
+                self.batch_queue.put(("error", e))
+
+        self.batch_thread = threading.Thread(target=run, daemon=True)
+        self.batch_thread.start()
+        self.root.after(UI_POLL_MS, lambda: self.poll_batch_queue(output_dir))
+
+    def poll_batch_queue(self, output_dir):
+        """Report batch patch results in the monitor (Tk thread)."""
+        while True:
+            try:
+                kind, value = self.batch_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "entry":
+                if "error" in value:
+                    line = f"{value['base_file']}: FAILED - {value['error']}"
+                else:
+                    line = (f"{value['base_file']}: {value['patch_file']} "
+                            f"{value['patch_size']} bytes ({value['ratio'] * 100:.1f} %)")
+                self.monitor_output.insert(tk.END, line + "\n")
+                self.monitor_output.see(tk.END)
+            elif kind == "line":
+                self.monitor_output.insert(tk.END, value)
+                self.monitor_output.see(tk.END)
+            elif kind == "done":
+                summary = (f"{len(value['patches'])} patch(es), {len(value['errors'])} error(s)\n"
+                           f"Manifest: {os.path.join(output_dir, PATCH_MANIFEST_NAME)}")
+                self.monitor_output.insert(tk.END, summary + "\n")
+                self.monitor_output.see(tk.END)
+                messagebox.showinfo("Batch Patches", summary)
+                return
+            elif kind == "error":
+                messagebox.showerror("Batch Patches", f"Batch generation failed:\n{value}")
+                return
+        self.root.after(UI_POLL_MS, lambda: self.poll_batch_queue(output_dir))
 
     def stop_monitoring(self):
         """Safe shutdown procedure"""
-        self.stop_serial = True
-        if hasattr(self, 'serial_thread') and self.serial_thread.is_alive():
-            self.serial_thread.join()
-        if hasattr(self, 'ser') and self.ser.is_open:
-            self.ser.close()
+        self.monitor_slot = None
+        if self.serial_monitor is not None:
+            self.serial_monitor.stop()
 
 
     def __del__(self):
         """Close the serial port when the instance is destroyed."""
-        if hasattr(self, "ser") and self.ser.is_open:
-            self.ser.close()
+        if getattr(self, "serial_monitor", None) is not None:
+            self.serial_monitor.stop()
+
+
+
+def startup_report(marks):
+    """Format (phase, perf_counter) marks as a timing table.
+
+    The "csv prompt" phase waits on the user, so it is listed but left out
+    of the total compared against STARTUP_BUDGET_MS.
 
+    Returns:
+        tuple: (report lines, total ms)
+    """
+    lines = []
+    total_ms = 0.0
+    for (_, previous), (name, at) in zip(marks, marks[1:]):
+        elapsed_ms = (at - previous) * 1000
+        if name == "csv prompt":
+            lines.append(f"  {name:<12} {elapsed_ms:8.1f} ms (user, not counted)")
+            continue
+        total_ms += elapsed_ms
+        lines.append(f"  {name:<12} {elapsed_ms:8.1f} ms")
+    verdict = "OK" if total_ms <= STARTUP_BUDGET_MS else "OVER BUDGET"
+    return [f"Startup (budget {STARTUP_BUDGET_MS} ms):"] + lines + [
+        f"  {'total':<12} {total_ms:8.1f} ms {verdict}"], total_ms
 
 
 if __name__ == "__main__":
+    if getattr(sys, "frozen", False):
+        import multiprocessing
+        multiprocessing.freeze_support()  # Process pool in the PyInstaller build
+    startup_marks = [("start", STARTUP_T0), ("imports", time.perf_counter())]
     root = tk.Tk()
-    app = ESPFlashTool(root)
+    startup_marks.append(("tk root", time.perf_counter()))
+    app = ESPFlashTool(root, startup_marks)
     root.mainloop()
\ No newline at end of file
@@ -6,7 +6,7 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('esptool_py/esptool', 'esptool_py/esptool')],
-    hiddenimports=[],
+    hiddenimports=['esptool'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,64 @@
+# -*- mode: python ; coding: utf-8 -*-
+# Fast-start build profile: one-dir (nothing extracted per launch), hot
+# DLLs left uncompressed, optimized bytecode.
+#   pyinstaller esp_flash_toolv2_onedir.spec
+#   -> dist/esp_flash_toolv2/esp_flash_toolv2.exe
+# Copy esp_flash_launcher.cmd next to that folder to run it from a share.
+# esp_flash_toolv2.spec (one-file) is kept for single-exe distribution.
+import sys
+
+# Cargadas en cada arranque: UPX las obligaría a descomprimirse en memoria
+python_dll = f"python{sys.version_info.major}{sys.version_info.minor}.dll"
+HOT_BINARIES = [
+    python_dll, 'python3.dll', 'vcruntime140.dll', 'vcruntime140_1.dll',
+    '_tkinter.pyd', 'tcl86t.dll', 'tk86t.dll', 'zlib1.dll',
+    '_ctypes.pyd', 'libffi-8.dll', '_hashlib.pyd', 'libcrypto-3.dll',
+    '_socket.pyd', 'select.pyd', 'unicodedata.pyd', '_lzma.pyd', '_bz2.pyd',
+]
+
+
+a = Analysis(
+    ['esp_flash_toolv2.py'],
+    pathex=[],
+    binaries=[],
+    datas=[('esptool_py/esptool', 'esptool_py/esptool')],
+    hiddenimports=['esptool'],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=[],
+    noarchive=False,
+    # Bytecode de esptool, serial y el resto de módulos puros compilado con -O
+    # (sin asserts). Nivel 2 no: quitaría los docstrings que usa la ayuda de esptool
+    optimize=1,
+)
+pyz = PYZ(a.pure)
+
+exe = EXE(
+    pyz,
+    a.scripts,
+    [],
+    exclude_binaries=True,
+    name='esp_flash_toolv2',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=False,
+    console=False,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+    icon=['esp.ico'],
+)
+
+coll = COLLECT(
+    exe,
+    a.binaries,
+    a.datas,
+    strip=False,
+    upx=True,
+    upx_exclude=HOT_BINARIES,
+    name='esp_flash_toolv2',
+)
@@ -4,8 +4,16 @@
 # SPDX-License-Identifier: Apache-2.0
 #
 
+import os
 import subprocess
 import sys
 
 if __name__ == '__main__':
-    sys.exit(subprocess.run([sys.executable, '-m', 'esptool'] + sys.argv[1:]).returncode)
+    # Drop this wrapper's directory so "import esptool" finds the package, not this file
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path = [p for p in sys.path if os.path.abspath(p or os.curdir) != script_dir]
+    try:
+        import esptool
+    except ImportError:
+        sys.exit(subprocess.run([sys.executable, '-m', 'esptool'] + sys.argv[1:]).returncode)
+    esptool._main()
@@ -0,0 +1,23 @@
+import json
+import os
+import sys
+
+import pytest
+
+# Los módulos de la herramienta están en la raíz del repo (sin paquete)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def write_flasher_args():
+    """Return a helper that writes a flasher_args.json into a directory."""
+    def write(directory, flash_files, write_flash_args=None, chip="esp32c6"):
+        path = os.path.join(directory, "flasher_args.json")
+        with open(path, "w") as f:
+            json.dump({
+                "write_flash_args": write_flash_args or ["--flash_mode", "dio"],
+                "flash_files": flash_files,
+                "extra_esptool_args": {"chip": chip},
+            }, f)
+        return path
+    return write
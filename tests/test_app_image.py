@@ -0,0 +1,39 @@
+"""Tests for parse_app_image, using the sample images in ESPFlashTool_Data."""
+import os
+
+import pytest
+
+import esp_flash_core as core
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ESPFlashTool_Data")
+NEW_IMAGE = os.path.join(DATA_DIR, "new", "iot_CTAUCM-1-SE.bin")
+
+
+def test_parse_app_image_sample():
+    image = core.parse_app_image(NEW_IMAGE)
+    assert image.chip == "esp32c6"
+    assert image.checksum_valid
+    assert image.hash_appended and image.digest_valid
+    assert image.image_size == os.path.getsize(NEW_IMAGE)
+
+
+def test_parse_app_image_detects_corruption(tmp_path):
+    data = bytearray(open(NEW_IMAGE, "rb").read())
+    data[0x1000] ^= 0xFF
+    path = tmp_path / "corrupt.bin"
+    path.write_bytes(data)
+    image = core.parse_app_image(str(path))
+    assert not image.checksum_valid or not image.digest_valid
+
+
+def test_parse_app_image_rejects_truncated_and_foreign(tmp_path):
+    data = open(NEW_IMAGE, "rb").read()
+    truncated = tmp_path / "truncated.bin"
+    truncated.write_bytes(data[:len(data) // 2])
+    with pytest.raises(ValueError):
+        core.parse_app_image(str(truncated))
+
+    partition_table = tmp_path / "pt.bin"
+    partition_table.write_bytes(b"\xaa\x50" + b"\xff" * 0xC00)
+    with pytest.raises(ValueError):
+        core.parse_app_image(str(partition_table))
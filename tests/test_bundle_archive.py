@@ -0,0 +1,74 @@
+"""Tests for the single-file .espbundle archive."""
+import json
+import os
+import zipfile
+
+import pytest
+
+import esp_flash_core as core
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ESPFlashTool_Data")
+NEW_IMAGE = os.path.join(DATA_DIR, "new", "iot_CTAUCM-1-SE.bin")
+
+
+def test_bundle_archive_round_trip(tmp_path, monkeypatch, write_flasher_args):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "pt.bin").write_bytes(b"\xaa\x50" + b"\xff" * 0xBFE)
+    json_path = write_flasher_args(str(tmp_path), {"0x8000": "pt.bin", "0x10000": NEW_IMAGE})
+    archive_path = str(tmp_path / "fw.espbundle")
+
+    manifest = core.create_bundle_archive(json_path, archive_path)
+    with zipfile.ZipFile(archive_path) as archive:
+        assert archive.namelist()[0] == core.BUNDLE_MANIFEST_NAME
+        assert {info.compress_type for info in archive.infolist()} == {zipfile.ZIP_STORED}
+
+    archive = core.BundleArchive(archive_path)
+    try:
+        assert archive.manifest["chip"] == "esp32c6"
+        app = next(entry for entry in manifest["files"] if entry["offset"] == "0x10000")
+        assert bytes(archive.members[app["name"]]) == open(NEW_IMAGE, "rb").read()
+    finally:
+        archive.close()
+
+
+def test_bundle_archive_rejects_tampered_member(tmp_path, monkeypatch, write_flasher_args):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "ota.bin").write_bytes(b"OTADATA!")
+    json_path = write_flasher_args(str(tmp_path), {"0xd000": "ota.bin"})
+    archive_path = tmp_path / "fw.espbundle"
+    core.create_bundle_archive(json_path, str(archive_path))
+
+    data = archive_path.read_bytes()
+    archive_path.write_bytes(data.replace(b"OTADATA!", b"OTADATA?"))
+    with pytest.raises(core.BundleError, match="SHA-256"):
+        core.BundleArchive(str(archive_path))
+
+
+def write_raw_bundle(path, files, members):
+    manifest = {"format": core.BUNDLE_FORMAT_VERSION, "chip": "esp32c6",
+                "write_flash_args": [], "extra_esptool_args": {}, "files": files}
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+        archive.writestr(core.BUNDLE_MANIFEST_NAME, json.dumps(manifest))
+        for name, data in members.items():
+            archive.writestr(name, data)
+
+
+@pytest.mark.parametrize("name", ["../../evil.bin", "/tmp/evil.bin", "sub/evil.bin", "..\\evil.bin", ".."])
+def test_bundle_archive_rejects_unsafe_member_names(tmp_path, name):
+    data = b"payload"
+    entry = {"offset": "0x10000", "name": name, "size": len(data),
+             "sha256": core.hashlib.sha256(data).hexdigest()}
+    path = str(tmp_path / "evil.espbundle")
+    write_raw_bundle(path, [entry], {name: data})
+    with pytest.raises(core.BundleError, match="member name"):
+        core.BundleArchive(path)
+
+
+def test_bundle_archive_rejects_invalid_offset(tmp_path):
+    data = b"payload"
+    entry = {"offset": "zz", "name": "app.bin", "size": len(data),
+             "sha256": core.hashlib.sha256(data).hexdigest()}
+    path = str(tmp_path / "bad.espbundle")
+    write_raw_bundle(path, [entry], {"app.bin": data})
+    with pytest.raises(core.BundleError, match="offset"):
+        core.BundleArchive(path)
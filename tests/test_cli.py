@@ -0,0 +1,25 @@
+"""Tests for the headless command line front end."""
+import os
+
+import esp_flash_cli
+import esp_flash_core as core
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ESPFlashTool_Data")
+NEW_IMAGE = os.path.join(DATA_DIR, "new", "iot_CTAUCM-1-SE.bin")
+
+
+def test_patch_reports_missing_input(tmp_path, capfd, monkeypatch):
+    monkeypatch.setattr(esp_flash_cli, "PatchCache", lambda: core.PatchCache(directory=str(tmp_path / "cache")))
+    missing = str(tmp_path / "missing.bin")
+    output = str(tmp_path / "patch.bin")
+    assert esp_flash_cli.main(["patch", missing, NEW_IMAGE, "-o", output, "--chip", "esp32c6"]) == 1
+    assert "Error:" in capfd.readouterr().out
+    assert esp_flash_cli.main(["patch", missing, NEW_IMAGE, "-o", output, "--chip", "esp32c6",
+                               "--no-cache"]) == 1
+
+
+def test_patch_batch_reports_missing_input(tmp_path, capfd):
+    args = ["patch-batch", str(tmp_path / "missing"), NEW_IMAGE, "-o", str(tmp_path / "out"),
+            "--chip", "esp32c6", "--no-cache"]
+    assert esp_flash_cli.main(args) == 1
+    assert "Error:" in capfd.readouterr().out
@@ -0,0 +1,52 @@
+"""Tests for plan_delta_flash against a fake connected loader."""
+import os
+import sys
+
+import pytest
+
+import esp_flash_core as core
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ESPFlashTool_Data")
+NEW_IMAGE = os.path.join(DATA_DIR, "new", "iot_CTAUCM-1-SE.bin")
+
+
+class FakeFlashLoader:
+    """Stand-in for a connected esptool loader: flash contents in memory."""
+    BOOTLOADER_FLASH_OFFSET = 0x0
+    CHIP_NAME = "ESP32-C6"
+
+    def __init__(self, flash):
+        self.flash = flash
+        self._port = type("Port", (), {"close": lambda self: None})()
+
+    def run_stub(self):
+        return self
+
+    def flash_md5sum(self, address, size):
+        return core.hashlib.md5(self.flash[address:address + size]).hexdigest()
+
+    def hard_reset(self):
+        pass
+
+
+def test_plan_delta_flash_skips_bootloader_patched_by_write_flash(tmp_path, monkeypatch):
+    esptool = pytest.importorskip("esptool")
+    bootloader = tmp_path / "bootloader.bin"
+    bootloader.write_bytes(open(NEW_IMAGE, "rb").read())
+    write_flash_args = ["--flash_mode", "dout", "--flash_size", "4MB"]
+    # Lo que hay en la placa: el bootloader tal como lo escribió write_flash
+    on_board = core.patch_bootloader_params("esp32c6", bootloader.read_bytes(), "dout", "keep", "4MB")
+    assert on_board != bootloader.read_bytes()
+    loader = FakeFlashLoader(bytearray(on_board))
+    monkeypatch.setattr(esptool.cmds, "detect_chip", lambda *args, **kwargs: loader)
+    # pytest sustituye sys.stdout en cada test: volver a poner el redirector por hilo
+    monkeypatch.setattr(sys, "stdout", core.ThreadLocalStream(sys.stdout))
+    monkeypatch.setattr(sys, "stderr", core.ThreadLocalStream(sys.stderr))
+
+    flasher = core.ESPFlashCore()
+    flasher.extra_esptool_args = {"chip": "esp32c6"}
+    flasher.write_flash_args = write_flash_args
+    flasher.flash_files = {"0x0": str(bootloader)}
+    lines = []
+    assert flasher.plan_delta_flash("/dev/fake", str(tmp_path), lines.append) == []
+    assert "unchanged, skipped" in "".join(lines)
@@ -0,0 +1,68 @@
+"""Tests for FirmwareBundle loading and validation."""
+import os
+
+import pytest
+
+import esp_flash_core as core
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ESPFlashTool_Data")
+OLD_IMAGE = os.path.join(DATA_DIR, "old", "iot_CTAUCM-1-SE.bin")
+NEW_IMAGE = os.path.join(DATA_DIR, "new", "iot_CTAUCM-1-SE.bin")
+
+
+def test_firmware_bundle_maps_files_only_while_in_use(tmp_path):
+    app = tmp_path / "app.bin"
+    app.write_bytes(open(NEW_IMAGE, "rb").read())
+    bundle = core.FirmwareBundle({"0x10000": str(app)})
+    digests = bundle.digests(timeout=5)
+    assert digests[str(app)]["md5"] == core.hashlib.md5(app.read_bytes()).hexdigest()
+    assert bundle.view(str(app)) is None  # Sin mapear tras calcular los digests
+
+    with bundle.mapped():
+        assert bytes(bundle.view(str(app))[:1]) == b"\xe9"
+    assert bundle.view(str(app)) is None
+
+    app.write_bytes(b"\xe9rebuilt")  # Se puede recompilar con el bundle cargado
+    with pytest.raises(core.BundleError, match="changed on disk"):
+        with bundle.mapped():
+            pass
+    bundle.close()
+    with pytest.raises(core.BundleError):
+        with bundle.mapped():
+            pass
+
+
+def test_firmware_bundle_rejects_bad_layout(tmp_path):
+    (tmp_path / "empty.bin").write_bytes(b"")
+    with pytest.raises(core.BundleError, match="empty"):
+        core.FirmwareBundle({"0x0": str(tmp_path / "empty.bin")})
+    with pytest.raises(core.BundleError, match="overlaps"):
+        core.FirmwareBundle({"0x10000": NEW_IMAGE, "0x20000": OLD_IMAGE})
+    with pytest.raises(core.BundleError, match="flash_size"):
+        core.FirmwareBundle({"0x300000": NEW_IMAGE}, ["--flash_size", "4MB"])
+
+
+def test_load_flasher_args_fails_on_missing_file(tmp_path, monkeypatch, write_flasher_args):
+    monkeypatch.chdir(tmp_path)
+    json_path = write_flasher_args(str(tmp_path), {"0x10000": NEW_IMAGE, "0x8000": "pt.bin"})
+    flasher = core.ESPFlashCore()
+    with pytest.raises(core.MissingFilesError) as error:
+        flasher.load_flasher_args(json_path)
+    assert [entry.rel_path for entry in error.value.missing] == ["pt.bin"]
+    assert flasher.bundle is None
+
+
+def test_check_flash_images_reports_truncated_app(tmp_path):
+    data = open(NEW_IMAGE, "rb").read()
+    truncated = tmp_path / "app.bin"
+    truncated.write_bytes(data[:len(data) // 2])
+    partition_table = tmp_path / "pt.bin"
+    partition_table.write_bytes(b"\xaa\x50" + b"\xff" * 0xBFE)
+
+    flasher = core.ESPFlashCore()
+    flasher.extra_esptool_args = {"chip": "esp32c6"}
+    flasher.flash_files = {"0x8000": str(partition_table)}
+    assert flasher.check_flash_images() is None  # No es una imagen: se ignora
+    flasher.flash_files["0x10000"] = str(truncated)
+    assert "truncated" in flasher.check_flash_images()
+    flasher.close_bundle()
@@ -0,0 +1,164 @@
+"""Tests for the merged-image flashing mode."""
+import os
+
+import pytest
+
+import esp_flash_core as core
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ESPFlashTool_Data")
+NEW_IMAGE = os.path.join(DATA_DIR, "new", "iot_CTAUCM-1-SE.bin")
+
+
+def test_build_merged_segments_single_region_is_not_copied():
+    data = memoryview(b"\x01" * 16)
+    [(address, merged)] = core.build_merged_segments([(0x10000, data)])
+    assert address == 0x10000 and merged is data
+
+
+def test_build_merged_segments_rejects_overlap():
+    with pytest.raises(ValueError):
+        core.build_merged_segments([(0x0, b"a" * 0x20), (0x10, b"b")])
+
+
+def test_build_merged_segments_keeps_idf_partitions_untouched():
+    # Layout estándar de ESP-IDF: NVS (0x9000-0xF000) y phy_init no son del bundle
+    bootloader = b"\xe9" + b"\x00" * 0x52A0
+    partition_table = b"\xaa\x50" + b"\xff" * 0xBFE
+    app = b"\xe9" + b"\x11" * 0x20000
+    segments = core.build_merged_segments([(0x0, bootloader), (0x8000, partition_table), (0x10000, app)])
+    assert [(address, len(data)) for address, data in segments] == [
+        (0x0, len(bootloader)), (0x8000, len(partition_table)), (0x10000, len(app))]
+    for address, data in segments:
+        assert not (address < 0xF000 and address + len(data) > 0x9000)
+
+
+def test_build_merged_segments_joins_regions_in_same_sector():
+    segments = core.build_merged_segments([(0x10000, b"a" * 0x10), (0x10800, b"b" * 0x10), (0x11000, b"c")])
+    assert len(segments) == 1
+    address, data = segments[0]
+    assert address == 0x10000 and len(data) == 0x1001
+    assert data[0x10:0x800] == b"\xff" * (0x800 - 0x10)
+
+
+def test_bootloader_flash_settings_treats_detect_as_keep():
+    args = ["--flash_mode", "dio", "--flash-freq", "80m", "--flash_size", "detect"]
+    assert core.bootloader_flash_settings(args) == ("dio", "80m", "keep")
+
+
+def test_patch_bootloader_params_updates_header_and_digest():
+    pytest.importorskip("esptool")
+    data = open(NEW_IMAGE, "rb").read()
+    assert core.patch_bootloader_params("esp32c6", data, "keep", "keep", "detect") is data
+    patched = core.patch_bootloader_params("esp32c6", data, "dout", "keep", "4MB")
+    assert patched[2] == core.ESP_FLASH_MODES["dout"]
+    image_size = core.parse_app_image(NEW_IMAGE).image_size
+    assert core.hashlib.sha256(patched[:image_size - 32]).digest() == patched[image_size - 32:image_size]
+    with pytest.raises(ValueError):
+        core.patch_bootloader_params("esp32c6", data, "keep", "keep", "3MB")
+
+
+def test_merged_payload_accepts_flash_size_detect(tmp_path):
+    pytest.importorskip("esptool")
+    flasher = core.ESPFlashCore()
+    flasher.payload_cache = core.PayloadCache(directory=None)
+    flasher.extra_esptool_args = {"chip": "esp32c6"}
+    flasher.write_flash_args = ["--flash_mode", "dio", "--flash_size", "detect"]
+    flasher.flash_files = {"0x0": NEW_IMAGE}
+    try:
+        [segment] = flasher.merged_payload(list(flasher.flash_files.items()), lambda line: None)
+    finally:
+        flasher.close_bundle()
+    assert segment.address == 0x0 and segment.size == os.path.getsize(NEW_IMAGE)
+
+
+def test_defl_block_timeout_follows_esptool(monkeypatch):
+    esptool = pytest.importorskip("esptool")
+    loader = esptool.loader
+    expected = loader.timeout_per_mb(loader.ERASE_WRITE_TIMEOUT_PER_MB, 0x4000 + 2 * 0x10000)
+    monkeypatch.setattr(core, "DELTA_BLOCK_SIZE", 0x1000)  # El tamaño del modo delta no influye
+    assert core.defl_block_timeout(0x4000) == expected
+    assert core.defl_block_timeout(0x400000) > core.defl_block_timeout(0x4000)
+
+
+class FakeRomLoader:
+    """Stand-in for a connected esptool ROM loader with configurable eFuses."""
+    CHIP_NAME = "ESP32-C6"
+    IMAGE_CHIP_ID = 13
+    BOOTLOADER_FLASH_OFFSET = 0x0
+    secure_download_mode = False
+
+    def __init__(self, secure_boot_v1=False, flash_encryption=False, encrypted_download_disabled=False):
+        self.secure_boot_v1 = secure_boot_v1
+        self.flash_encryption = flash_encryption
+        self.encrypted_download_disabled = encrypted_download_disabled
+
+    def get_secure_boot_v1_enabled(self):
+        return self.secure_boot_v1
+
+    def get_flash_encryption_enabled(self):
+        return self.flash_encryption
+
+    def uses_key_manager_for_flash_encryption(self):
+        return False
+
+    def get_encrypted_download_disabled(self):
+        return self.encrypted_download_disabled
+
+    chip_revision = 1  # v0.1: la imagen de ejemplo admite hasta v0.99
+
+    def get_chip_revision(self):
+        return self.chip_revision
+
+    def get_major_chip_version(self):
+        return 1
+
+
+def test_check_merged_target_accepts_matching_board():
+    pytest.importorskip("esptool")
+    items = [("0x10000", NEW_IMAGE)]
+    assert core.check_merged_target(FakeRomLoader(), "esp32c6", items, ["--flash_mode", "dio"]) is None
+
+
+def test_check_merged_target_refuses_what_write_flash_refuses():
+    esptool = pytest.importorskip("esptool")
+    items = [("0x0", NEW_IMAGE)]
+    with pytest.raises(esptool.FatalError, match="Wrong --chip"):
+        core.check_merged_target(FakeRomLoader(), "esp32c3", items, [])
+    with pytest.raises(esptool.FatalError, match="Secure Boot V1"):
+        core.check_merged_target(FakeRomLoader(secure_boot_v1=True), "esp32c6", items, [])
+    assert core.check_merged_target(FakeRomLoader(secure_boot_v1=True), "esp32c6",
+                                    [("0x10000", NEW_IMAGE)], []) is None
+    with pytest.raises(esptool.FatalError, match="plaintext"):
+        core.check_merged_target(FakeRomLoader(flash_encryption=True, encrypted_download_disabled=True),
+                                 "esp32c6", items, [])
+    new_revision = FakeRomLoader()
+    new_revision.chip_revision = 100
+    with pytest.raises(esptool.FatalError, match="chip revision"):
+        core.check_merged_target(new_revision, "esp32c6", items, [])
+    wrong_chip = FakeRomLoader()
+    wrong_chip.IMAGE_CHIP_ID = 5  # Imagen de esp32c6 en un ESP32-C3 con --chip esp32c3
+    wrong_chip.CHIP_NAME = "ESP32-C3"
+    with pytest.raises(esptool.FatalError, match="not an ESP32-C3 image"):
+        core.check_merged_target(wrong_chip, "esp32c3", items, [])
+
+
+def test_check_merged_target_falls_back_when_it_cannot_check():
+    pytest.importorskip("esptool")
+    items = [("0x10000", NEW_IMAGE)]
+    assert "--encrypt" in core.check_merged_target(FakeRomLoader(), "esp32c6", items, ["--encrypt"])
+    secure_download = FakeRomLoader()
+    secure_download.secure_download_mode = True
+    assert "secure download" in core.check_merged_target(secure_download, "esp32c6", items, [])
+
+
+def test_flash_port_uses_write_flash_when_merged_checks_cannot_run(monkeypatch):
+    pytest.importorskip("esptool")
+    flasher = core.ESPFlashCore()
+    flasher.extra_esptool_args = {"chip": "esp32c6"}
+    flasher.flash_files = {"0x10000": NEW_IMAGE}
+    flasher.set_merged_flash(True)
+    commands = []
+    monkeypatch.setattr(flasher, "flash_port_merged", lambda *args: None)
+    monkeypatch.setattr(flasher, "run_esptool", lambda cmd, on_line: commands.append(cmd) or 0)
+    assert flasher.flash_port("/dev/fake", 460800, lambda line: None) == 0
+    assert "write_flash" in commands[0]
@@ -0,0 +1,30 @@
+"""Tests for generate_patch_matrix, the batch OTA patch generator."""
+import os
+import shutil
+
+import esp_flash_core as core
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ESPFlashTool_Data")
+OLD_IMAGE = os.path.join(DATA_DIR, "old", "iot_CTAUCM-1-SE.bin")
+NEW_IMAGE = os.path.join(DATA_DIR, "new", "iot_CTAUCM-1-SE.bin")
+
+
+class ReadOnlyPatchCache(core.PatchCache):
+    """PatchCache whose disk is full: every put fails."""
+
+    def put(self, key, patch_path):
+        raise OSError("No space left on device")
+
+
+def test_patch_matrix_reports_cache_errors_through_on_line(tmp_path, capsys):
+    base_dir = tmp_path / "releases"
+    base_dir.mkdir()
+    shutil.copy(OLD_IMAGE, base_dir / "v1.bin")
+    entries, lines = [], []
+    manifest = core.generate_patch_matrix(
+        str(base_dir), NEW_IMAGE, str(tmp_path / "out"), "esp32c6", workers=1,
+        cache=ReadOnlyPatchCache(directory=str(tmp_path / "cache")),
+        on_result=entries.append, on_line=lines.append)
+    assert len(manifest["patches"]) == 1 and len(entries) == 1
+    assert lines == ["Patch cache not updated: No space left on device\n"]
+    assert capsys.readouterr().out == ""
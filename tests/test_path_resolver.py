@@ -0,0 +1,41 @@
+"""Tests for PathResolver and the cached folder listings."""
+import os
+
+import esp_flash_core as core
+
+
+def test_path_resolver_candidate_order(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config_dir = tmp_path / "out"
+    (config_dir / "bootloader").mkdir(parents=True)
+    (config_dir / "bootloader" / "bootloader.bin").write_bytes(b"b")
+    (config_dir / "app.bin").write_bytes(b"a")
+    (tmp_path / "build").mkdir()
+    (tmp_path / "build" / "ota.bin").write_bytes(b"o")
+
+    resolver = core.PathResolver(str(config_dir))
+    assert resolver.resolve("bootloader/bootloader.bin") == str(config_dir / "bootloader" / "bootloader.bin")
+    assert resolver.resolve("other/app.bin") == str(config_dir / "app.bin")  # Por nombre en el dir del JSON
+    assert resolver.resolve("ota.bin") == str(tmp_path / "build" / "ota.bin")
+    assert resolver.resolve("missing.bin") is None
+    assert resolver.resolve("bootloader") is None  # Las carpetas no cuentan
+
+
+def test_list_directory_reused_until_folder_changes(tmp_path):
+    (tmp_path / "a.bin").write_bytes(b"a")
+    first = core.list_directory(str(tmp_path))
+    assert core.list_directory(str(tmp_path)) is first
+    (tmp_path / "b.bin").write_bytes(b"b")
+    os.utime(tmp_path, ns=(0, os.stat(tmp_path).st_mtime_ns + 1))
+    assert os.path.normcase("b.bin") in core.list_directory(str(tmp_path))
+
+
+def test_parse_flasher_args_reports_missing_once(tmp_path, monkeypatch, write_flasher_args):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "app.bin").write_bytes(b"a")
+    json_path = write_flasher_args(str(tmp_path), {"0x10000": "app.bin", "0x8000": "pt.bin", "0xd000": "ota.bin"})
+    calls = []
+    flash_files, _, _ = core.parse_flasher_args(json_path, on_missing=calls.append)
+    assert list(flash_files) == ["0x10000"]
+    assert len(calls) == 1
+    assert [entry.rel_path for entry in calls[0]] == ["pt.bin", "ota.bin"]
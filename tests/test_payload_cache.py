@@ -0,0 +1,48 @@
+"""Tests for the host-side payload precompression."""
+import os
+import time
+
+import esp_flash_core as core
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ESPFlashTool_Data")
+NEW_IMAGE = os.path.join(DATA_DIR, "new", "iot_CTAUCM-1-SE.bin")
+
+
+def test_precompress_only_in_merged_mode(tmp_path, monkeypatch, write_flasher_args):
+    monkeypatch.chdir(tmp_path)
+    json_path = write_flasher_args(str(tmp_path), {"0x10000": NEW_IMAGE})
+    calls = []
+    monkeypatch.setattr(core.ESPFlashCore, "merged_payload",
+                        lambda self, flash_items, on_line, bundle=None: calls.append(bundle))
+    monkeypatch.setattr(core, "load_esptool", lambda: object())
+    flasher = core.ESPFlashCore()
+    try:
+        flasher.load_flasher_args(json_path)
+        time.sleep(0.1)
+        assert calls == []
+        flasher.set_merged_flash(True)
+        time.sleep(0.1)
+        assert calls == [flasher.bundle]
+    finally:
+        flasher.close_bundle()
+
+
+def test_payload_cache_closes_evicted_mmaps(tmp_path):
+    first, second = os.urandom(4096), os.urandom(4096)
+    writer = core.PayloadCache(directory=str(tmp_path))
+    writer.get(first)
+    writer.get(second)
+
+    cache = core.PayloadCache(directory=str(tmp_path), memory_bytes=1)
+    view = cache.get(first)  # Leído del disco: vista de un mmap
+    mapped = view.obj
+    assert bytes(view) == core.zlib.compress(first, core.MERGE_COMPRESS_LEVEL)
+    cache.get(second)  # Expulsa el primero mientras aún se usa
+    assert not mapped.closed and bytes(view[:2]) == bytes(writer.get(first)[:2])
+    view.release()
+
+    view = cache.get(first)
+    mapped = view.obj
+    view.release()
+    cache.get(second)
+    assert mapped.closed
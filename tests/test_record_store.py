@@ -0,0 +1,94 @@
+"""Tests for the manufacturing record stores and their writer thread."""
+import csv
+import json
+import os
+import time
+
+import esp_flash_core as core
+
+
+def read_csv(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        return list(csv.DictReader(f))
+
+
+def test_mfg_record_store_upsert_and_reload(tmp_path):
+    path = str(tmp_path / "records.csv")
+    store = core.MfgRecordStore(path)
+    store.upsert({"hw_id": "A", "fw": "1"})
+    store.upsert({"hw_id": "B", "fw": "1"})
+    store.upsert({"hw_id": "A", "fw": "2"})  # Actualización: va al journal
+    assert os.path.exists(path + ".journal")
+
+    reloaded = core.MfgRecordStore(path)  # Reproduce el journal y compacta
+    assert [row["fw"] for row in reloaded.rows] == ["2", "1"]
+    assert not os.path.exists(path + ".journal")
+    store.close()
+    assert read_csv(path) == [{"hw_id": "A", "fw": "2"}, {"hw_id": "B", "fw": "1"}]
+
+
+def test_mfg_record_store_ignores_torn_journal_line(tmp_path):
+    path = str(tmp_path / "records.csv")
+    core.MfgRecordStore(path).upsert({"hw_id": "A", "fw": "1"})
+    with open(path + ".journal", "w", encoding="utf-8") as journal:
+        journal.write(json.dumps({"hw_id": "A", "fw": "3"}) + "\n{\"hw_id\": \"B\"")
+    store = core.MfgRecordStore(path)
+    assert store.rows == [{"hw_id": "A", "fw": "3"}]
+
+
+# --- MfgRecordWriter + SqliteRecordStore --------------------------------------
+
+def wait_result(writer, timeout=5):
+    return writer.results.get(timeout=timeout)
+
+
+def test_sqlite_writer_reports_ok_only_after_commit(tmp_path, monkeypatch):
+    monkeypatch.setattr(core, "SQLITE_COMMIT_INTERVAL", 0.5)
+    path = str(tmp_path / "records.db")
+    writer = core.MfgRecordWriter()
+    try:
+        writer.submit(path, {"hw_id": "A", "fw": "1"})
+        time.sleep(core.MFG_WRITER_BATCH_DELAY + 0.1)
+        assert writer.results.empty()  # Aún en el buffer, sin commit
+        status, _, hw_id, count = wait_result(writer)
+        assert (status, hw_id, count) == ("ok", "A", 1)
+        assert not writer.store.pending
+    finally:
+        writer.close()
+
+
+def test_sqlite_writer_reports_failed_commit(tmp_path, monkeypatch):
+    monkeypatch.setattr(core, "SQLITE_COMMIT_INTERVAL", 0.2)
+    path = str(tmp_path / "records.db")
+    writer = core.MfgRecordWriter()
+    original_flush = core.SqliteRecordStore.flush
+    failures = []
+
+    def locked_flush(store):
+        if not failures:
+            failures.append(True)
+            store.pending_since = time.monotonic()
+            raise RuntimeError("database is locked")
+        return original_flush(store)
+
+    monkeypatch.setattr(core.SqliteRecordStore, "flush", locked_flush)
+    try:
+        writer.submit(path, {"hw_id": "A", "fw": "1"})
+        status, _, hw_id, detail = wait_result(writer)
+        assert (status, hw_id, str(detail)) == ("error", "A", "database is locked")
+        status, _, hw_id, _ = wait_result(writer)  # Reintento en el siguiente intervalo
+        assert (status, hw_id) == ("ok", "A")
+    finally:
+        writer.close()
+
+
+def test_csv_writer_reports_ok_immediately(tmp_path):
+    path = str(tmp_path / "records.csv")
+    writer = core.MfgRecordWriter()
+    try:
+        writer.submit(path, {"hw_id": "A", "fw": "1"})
+        status, _, hw_id, count = wait_result(writer)
+        assert (status, hw_id, count) == ("ok", "A", 1)
+    finally:
+        writer.close()
+    assert read_csv(path) == [{"hw_id": "A", "fw": "1"}]
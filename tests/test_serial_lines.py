@@ -0,0 +1,16 @@
+"""Tests for split_serial_lines, the monitor reader line splitter."""
+import esp_flash_core as core
+
+
+def test_split_serial_lines_keeps_partial_line():
+    lines, pending = core.split_serial_lines(b"", b"boot\r\nhello wor")
+    assert lines == ["boot"]
+    assert pending == b"hello wor"
+    lines, pending = core.split_serial_lines(pending, b"ld\n\n")
+    assert lines == ["hello world"]
+    assert pending == b""
+
+
+def test_split_serial_lines_flushes_oversized_line():
+    lines, pending = core.split_serial_lines(b"", b"x" * (core.MONITOR_MAX_LINE_BYTES + 1))
+    assert len(lines) == 1 and pending == b""